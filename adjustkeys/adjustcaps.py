@@ -7,14 +7,17 @@ from .blender_available import blender_available
 from .layout import get_layout, parse_layout
 from .lazy_import import LazyImport
 from .log import die, init_logging, printe, printi, printw, print_warnings
+from .mesh_assembly import assemble_mesh_data
+from .mesh_cache import get_cap_mesh_data, mesh_max_point, mesh_min_point, new_mesh_object
 from .obj_io import read_obj, write_obj
 from .path import walk
 from .positions import resolve_cap_position
+from .profiling import profile_count, profile_stage
+from .shared_inputs import listing_state, shared_input
 from .util import concat, dict_union, flatten_list, get_dicts_with_duplicate_field_values, get_only, list_diff, inner_join, rem
 from .uv_unwrap import uv_unwrap
 from .yaml_io import read_yaml
 from argparse import Namespace
-from concurrent.futures import ThreadPoolExecutor, wait
 from copy import deepcopy
 from math import inf, pi
 from os import access, makedirs, remove, strerror, W_OK
@@ -29,9 +32,6 @@ Euler:type = LazyImport('mathutils', 'Euler')
 Matrix:type = LazyImport('mathutils', 'Matrix')
 Vector:type = LazyImport('mathutils', 'Vector')
 if blender_available():
-    from bmesh import new as new_mesh
-    from bmesh.types import BMesh
-    from bpy import ops
     from bpy.path import abspath
     from bpy.types import Object, Collection
     data = LazyImport('bpy', 'data')
@@ -39,38 +39,39 @@ if blender_available():
 
 
 def adjust_caps(layout: [dict], colour_map:[dict], profile_data:dict, collection:Collection, layout_min_point:Vector, layout_max_point:Vector, pargs:Namespace) -> dict:
-    # Resolve output unique output name
-    printi('Getting required keycap data...')
-    caps: [dict] = get_data(layout, pargs.cap_dir, colour_map, collection, profile_data)
-
-    printi('Adjusting keycaps...')
-    for cap in caps:
-        handle_cap(cap, profile_data['unit-length'])
+    caps:[dict] = get_placed_caps(layout, colour_map, profile_data, collection, pargs)
 
     capmodel_name:str = generate_capmodel_name('capmodel')
+    capmodel_object:Object = None
+    capmodel_collection:Collection = None
     uv_image_path:str = None
     uv_material_name:str = None
     colourMaterials:list = []
-    importedCapObjects:[Object] = list(map(lambda cap: cap['cap-obj'], caps))
     imgNode:ShaderNodeTexImage = None
-    if len(importedCapObjects) != 0:
-        printi('Joining keycap models into a single object')
-        capmodel_mesh_tmp:BMesh = new_mesh()
-        for importedCapObject in importedCapObjects:
-            # Transform the object and its normals
-            importedCapObject.data.transform(importedCapObject.matrix_world)
-
-            # Append the single cap to the model for the entire layout
-            capmodel_mesh_tmp.from_mesh(importedCapObject.data)
-
-            # Remove the now-unused single-cap object
-            data.objects.remove(importedCapObject)
-        capmodel_mesh:BMesh = data.meshes.new(capmodel_name)
-        capmodel_mesh_tmp.to_mesh(capmodel_mesh)
-        capmodel_mesh.use_auto_smooth = True
-        capmodel_object:Object = data.objects.new(capmodel_name, capmodel_mesh)
-        collection.objects.link(capmodel_object)
-        capmodel_mesh_tmp.free()
+    needs_uv_map:bool = pargs.adjust_glyphs or pargs.apply_colour_map
+    scale:Matrix = Matrix.Scale(profile_data['scale'], 4)
+    if len(caps) != 0 and pargs.link_caps and not needs_uv_map:
+        printi('Creating linked keycaps')
+        with profile_stage('link'):
+            capmodel_collection = data.collections.new(capmodel_name)
+            collection.children.link(capmodel_collection)
+            model_meshes:dict = {}
+            for cap in caps:
+                if cap['cap-source'] not in model_meshes:
+                    cap['cap-obj'] = new_mesh_object(cap['cap-name'], cap['cap-mesh'], capmodel_collection)
+                    model_meshes[cap['cap-source']] = cap['cap-obj'].data
+                else:
+                    cap['cap-obj'] = data.objects.new(cap['cap-name'], model_meshes[cap['cap-source']])
+                    capmodel_collection.objects.link(cap['cap-obj'])
+                cap['cap-obj'].matrix_world = scale @ cap['cap-matrix']
+                cap['cap-obj-name'] = cap['cap-obj'].name
+    elif len(caps) != 0:
+        if pargs.link_caps:
+            printi('Keycaps must be joined to apply glyphs or colours through a uv-map, ignoring linking option')
+        printi('Assembling keycap models into a single object')
+        with profile_stage('join'):
+            capmodel_mesh_data:dict = assemble_mesh_data([ cap['cap-mesh'] for cap in caps ], [ scale @ cap['cap-matrix'] for cap in caps ])
+            capmodel_object = new_mesh_object(capmodel_name, capmodel_mesh_data, collection)
 
         printi('Handling material')
         uv_image_base:str = capmodel_name + '_uv_image.png'
@@ -79,17 +80,33 @@ def adjust_caps(layout: [dict], colour_map:[dict], profile_data:dict, collection
             uv_image_path = os_abspath(expanduser(join('~', 'Downloads', uv_image_base)))
         (imgNode, uv_material_name) = generate_uv_map_materials(pargs.use_existing_materials, uv_image_path, capmodel_name, capmodel_object)
 
-        printi('Updating cap-model scaling')
-        capmodel_object.data.transform(capmodel_object.matrix_world)
-        capmodel_object.matrix_world = Matrix.Scale(profile_data['scale'], 4)
-        capmodel_object.data.transform(capmodel_object.matrix_world)
-        capmodel_object.matrix_world = Matrix.Identity(4)
-
         printi('UV-unwrapping cap-model')
         layout_scale:float = profile_data['unit-length'] * profile_data['scale']
-        uv_unwrap(capmodel_object, layout_scale * layout_min_point, layout_scale * layout_max_point, pargs.partition_uv_by_face_direction)
+        with profile_stage('uv-unwrap'):
+            uv_unwrap(capmodel_object, layout_scale * layout_min_point, layout_scale * layout_max_point, pargs.partition_uv_by_face_direction)
+
+    return { 'keycaps-model-name': capmodel_name, 'keycaps-model': capmodel_object, 'keycaps-collection': capmodel_collection, 'material-names': colourMaterials, '~caps-with-margin-offsets': caps, '~texture-image-node': imgNode, 'uv-image-path': uv_image_path, 'uv-material-name': uv_material_name }
+
+##
+# @brief Join each key of a layout with its keycap model, its margin offset and its pose
+#
+# @param layout:[dict] The (coloured) layout
+# @param colour_map:[dict] The colour map
+# @param profile_data:dict The profile data of the keycap models
+# @param collection:Collection The collection to make models in
+# @param pargs:Namespace Parsed arguments
+#
+# @return A list of a new dictionary for each key of the layout which has a keycap model
+def get_placed_caps(layout:[dict], colour_map:[dict], profile_data:dict, collection:Collection, pargs:Namespace) -> [dict]:
+    printi('Getting required keycap data...')
+    with profile_stage('cap-import'):
+        caps: [dict] = get_data(layout, pargs.cap_dir, pargs.cache_dir if pargs.use_cache else None, colour_map, collection, profile_data)
 
-    return { 'keycaps-model-name': capmodel_name, 'keycaps-model': capmodel_object, 'material-names': colourMaterials, '~caps-with-margin-offsets': caps, '~texture-image-node': imgNode, 'uv-image-path': uv_image_path, 'uv-material-name': uv_material_name }
+    printi('Adjusting keycaps...')
+    with profile_stage('cap-pose'):
+        for cap in caps:
+            handle_cap(cap, profile_data['unit-length'])
+    return caps
 
 def check_permissions(fpath:str, perms:int) -> bool:
     try:
@@ -152,7 +169,7 @@ def generate_uv_map_materials(use_existing_materials:str, uv_image_path:str, mod
     return (imgNode, uv_material_name)
 
 
-def get_data(layout: [dict], cap_dir: str, colour_map:[dict], collection:Collection, profile_data:dict) -> [dict]:
+def get_data(layout: [dict], cap_dir: str, cache_dir:str, colour_map:[dict], collection:Collection, profile_data:dict) -> [dict]:
     printi('Finding and parsing cap models')
     # Get caps, check for duplicates
     caps: [dict] = get_caps(cap_dir)
@@ -161,29 +178,13 @@ def get_data(layout: [dict], cap_dir: str, colour_map:[dict], collection:Collect
         printw('Duplicate keycap names detected:\n\t' + '\n\t'.join(duplicate_cap_names))
     layout_with_caps: [dict] = inner_join(caps, 'cap-name', layout, 'cap-name')
 
-    # Import necessary cap models
-    firsts:dict = {}
+    # Read necessary cap models, from the cache if possible
+    model_meshes:dict = {}
     for cap_data in layout_with_caps:
-        if cap_data['cap-source'] not in firsts:
-            # Import new object
-            printi('Importing "%s" into blender...' % cap_data['cap-source'])
-            objectsPreSingleImport:[str] = data.objects.keys()
-            ops.import_scene.obj(filepath=cap_data['cap-source'])
-            objectsPostSingleImport:[str] = data.objects.keys()
-            cap_data['cap-obj-name'] = get_only(list_diff(objectsPostSingleImport, objectsPreSingleImport), 'No new id was added when importing from %s' % cap_data['cap-source'], 'Multiple ids changed when importing %s, got %%d new: %%s' % cap_data['cap-source'])
-            cap_data['cap-obj'] = context.scene.objects[cap_data['cap-obj-name']]
-            firsts[cap_data['cap-source']] = cap_data['cap-obj']
-        else:
-            # Duplicate existing object
-            printi('Duplicating existing "%s"...' % cap_data['cap-source'])
-            objectsPreCopy:[str] = data.objects.keys()
-            original_obj = firsts[cap_data['cap-source']].copy()
-            objectsPostCopy:[str] = data.objects.keys()
-            cap_data['cap-obj-name'] = get_only(list_diff(objectsPostCopy, objectsPreCopy), 'No new id was added when copying from %s' % cap_data['cap-source'], 'Multiple ids changed when copying %s, got %%d new: %%s' % cap_data['cap-source'])
-            new_obj = original_obj.copy()
-            new_obj.data = original_obj.data.copy()
-            cap_data['cap-obj'] = new_obj
-            collection.objects.link(new_obj)
+        if cap_data['cap-source'] not in model_meshes:
+            model_meshes[cap_data['cap-source']] = get_cap_mesh_data(cap_data['cap-source'], cache_dir)
+        cap_data['cap-mesh'] = model_meshes[cap_data['cap-source']]
+    profile_count('unique-caps', len(model_meshes))
 
     # Warn about missing models
     missing_models: [str] = list_diff(
@@ -199,32 +200,31 @@ def get_data(layout: [dict], cap_dir: str, colour_map:[dict], collection:Collect
 
 
 def handle_cap(cap: dict, unit_length: float):
-    printi('Adjusting cap %s' % cap['cap-name'])
+    printi('Adjusting cap %s', cap['cap-name'])
     cap = resolve_cap_position(cap, unit_length)
     cap = apply_cap_pose(cap)
 
 
 def apply_cap_pose(cap: dict) -> dict:
-    obj:object = cap['cap-obj']
-
     # Original offset
-    original_off:Vector = Vector(obj.bound_box[0])
-
-    # Reset pose
-    obj.matrix_world = Matrix.Identity(4)
+    original_off:Vector = Vector(mesh_min_point(cap['cap-mesh']))
 
     # Set rotation
-    obj.matrix_world @= Matrix.Rotation(pi/2.0, 4, 'X')
-    obj.matrix_world @= Matrix.Rotation(cap['rotation'], 4, 'Y')
+    pose:Matrix = Matrix.Rotation(pi/2.0, 4, 'X')
+    pose @= Matrix.Rotation(cap['rotation'], 4, 'Y')
 
     # Move to correct position from origin
-    obj.matrix_world @= Matrix.Translation(-original_off)
-    obj.matrix_world @= Matrix.Translation(Matrix.Rotation(-cap['rotation'], 4, 'Y') @ cap['cap-pos'])
+    pose @= Matrix.Translation(-original_off)
+    pose @= Matrix.Translation(Matrix.Rotation(-cap['rotation'], 4, 'Y') @ cap['cap-pos'])
 
+    cap['cap-matrix'] = pose
     return cap
 
 
 def get_caps(cap_dir: str) -> [dict]:
+    return shared_input('caps', cap_dir, listing_state, lambda: find_caps(cap_dir))
+
+def find_caps(cap_dir: str) -> [dict]:
     capFiles: [str] = list(filter(lambda f: f.endswith('.obj'), walk(cap_dir)))
     return list(
         map(lambda c: {
@@ -233,9 +233,10 @@ def get_caps(cap_dir: str) -> [dict]:
         }, capFiles))
 
 def get_margin_offset(cap:dict, unit_length:float) -> dict:
-    printi('Computing cap margin offset of keycap "%s"' % cap['key'])
+    printi('Computing cap margin offset of keycap "%s"', cap['key'])
 
-    cap_dims:Vector = Vector((cap['cap-obj'].dimensions.x, cap['cap-obj'].dimensions.z))
+    cap_size:Vector = Vector(mesh_max_point(cap['cap-mesh'])) - Vector(mesh_min_point(cap['cap-mesh']))
+    cap_dims:Vector = Vector((cap_size.x, cap_size.z))
     unit_dims:Vector = Vector((max(cap['width'], cap['secondary-width'] if 'secondary-width' in cap else -1.0), max(cap['height'], cap['secondary-height'] if 'secondary-height' in cap else -1.0)))
 
     cap['margin-offset'] = (unit_length * unit_dims - cap_dims) / 2.0
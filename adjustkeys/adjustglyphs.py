@@ -4,25 +4,30 @@
 from .args import parse_args, Namespace
 from .blender_available import blender_available
 from .collections import make_collection
-from .glyphinf import glyph_inf
+from .geometry import rotate
+from .glyphinf import glyph_infs, glyph_name
 from .input_types import type_check_glyph_map
 from .layout import get_layout, parse_layout
 from .lazy_import import LazyImport
 from .log import die, init_logging, printi, printw, print_warnings
 from .path import get_temp_file_name, walk
+from .png_io import read_png
 from .positions import resolve_glyph_position
+from .profiling import profile_count, profile_stage
+from .raster import rasterise_svg_groups
 from .scale import get_scale
+from .shared_inputs import listing_state, shared_dict, shared_input
+from .svg_io import SvgGroupWriter, SvgGroups
 from .util import concat, dict_union, frange, get_dicts_with_duplicate_field_values, get_only, inner_join, right_outer_join, list_diff, rob_rem, safe_get
 from .yaml_io import read_yaml, write_yaml
 from functools import reduce
 from os import remove
-from os.path import basename, exists, join
+from os.path import abspath, basename, exists, getmtime, join
 from math import degrees
+from numpy import array, float32, full, ndarray
 from re import IGNORECASE, match
 from sys import argv, exit
 from types import LambdaType
-from wand.color import Color as Colour
-from wand.image import Image
 from xml.dom.minidom import Element, parseString
 Collection:type = None
 if blender_available():
@@ -32,6 +37,7 @@ if blender_available():
 Matrix:type = LazyImport('mathutils', 'Matrix')
 Vector:type = LazyImport('mathutils', 'Vector')
 ShaderNodeTexImage:type = LazyImport('bpy', 'types', 'ShaderNodeTexImage')
+Image:type = LazyImport('bpy', 'types', 'Image')
 
 ##
 # @brief Entry point function, should be treated as the first thing called
@@ -40,92 +46,123 @@ ShaderNodeTexImage:type = LazyImport('bpy', 'types', 'ShaderNodeTexImage')
 #
 # @return Zero if and only if the program is to exit successfully
 def adjust_glyphs(layout:[dict], profile_data:dict, model_name:str, layout_min_point:Vector, layout_max_point:Vector, collection:Collection, glyph_map:dict, imgNode:ShaderNodeTexImage, uv_image_path:str, uv_material_name:str, pargs:Namespace) -> [str]:
-    glyph_data: [dict] = collect_data(layout, profile_data, pargs.glyph_dir, glyph_map, pargs.iso_enter_glyph_pos, pargs.alignment)
+    # Apply an image made earlier if given
+    if pargs.uv_image_file not in ['None', '']:
+        if not exists(pargs.uv_image_file):
+            die('Failed to find uv image "%s"' % pargs.uv_image_file)
+        printi('Importing uv image "%s" into blender', pargs.uv_image_file)
+        with profile_stage('image-load'):
+            imgNode.image = data.images.load(abspath(pargs.uv_image_file), check_existing=False)
+        return { 'uv-image-path': abspath(pargs.uv_image_file) }
+
+    # Stream the svg of each key to disk as it is produced
+    dump_svg:bool = pargs.dump_uv_svg not in ['None', '']
+    svg_path:str = pargs.dump_uv_svg if dump_svg else get_temp_file_name()
+    svg_groups:SvgGroups
+    svg_dims:Vector
+    with profile_stage('svg-build'):
+        (svg_groups, svg_dims, _) = write_uv_svg(layout, profile_data, layout_min_point, layout_max_point, glyph_map, svg_path, pargs)
+    if dump_svg:
+        printi('Wrote uv svg to "%s"', svg_path)
+
+    svgObjectNames:[str] = None
+    try:
+        with svg_groups:
+            import_and_align_glyphs_as_raster(svg_groups, svg_dims, imgNode, uv_image_path, uv_material_name, layout_min_point, layout_max_point, pargs.uv_res, pargs.adjust_glyphs or pargs.apply_colour_map, pargs.partition_uv_by_face_direction, pargs.uv_tile_size, pargs.raster_workers, pargs.rasteriser, raster_cache_dir(pargs))
+    finally:
+        if not dump_svg:
+            remove(svg_path)
+
+    printi('Successfully imported glyphs')
+
+    return { 'glyph-names': svgObjectNames } if svgObjectNames is not None else {}
+
+##
+# @brief Write the svg of the uv image of a layout, a group per key
+#
+# @param layout:[dict] Layout of the keys
+# @param profile_data:dict Data about the keycap profile used
+# @param layout_min_point:Vector The minimum point of the layout
+# @param layout_max_point:Vector The maximum point of the layout
+# @param glyph_map:dict Map of keys to glyphs
+# @param svg_path:str Name of the svg file to write
+# @param pargs:Namespace Parsed arguments
+#
+# @return An index of the groups of the svg written, the dimensions of its canvas and the placed glyphs, one per group
+def write_uv_svg(layout:[dict], profile_data:dict, layout_min_point:Vector, layout_max_point:Vector, glyph_map:dict, svg_path:str, pargs:Namespace) -> (SvgGroups, Vector, [dict]):
+    glyph_data: [dict] = collect_data(layout, profile_data, pargs.glyph_dir, glyph_map, pargs.iso_enter_glyph_pos, pargs.alignment, pargs.cache_dir if pargs.use_cache else None)
 
     offset_resolved_glyphs: [dict] = map(lambda glyph: resolve_glyph_offset(glyph, pargs.alignment if glyph['key'] != 'iso-enter' else pargs.iso_enter_glyph_pos, pargs.glyph_unit_length), glyph_data)
     placed_glyphs: [dict] = list(map(lambda glyph: resolve_glyph_position(glyph, layout_min_point, pargs.glyph_unit_length, profile_data['unit-length'], profile_data['scale']), offset_resolved_glyphs))
 
-    for i in range(len(placed_glyphs)):
-        glyph_style:str = get_style(placed_glyphs[i], 'glyph-style')
-        if 'src' in placed_glyphs[i]:
-            with open(placed_glyphs[i]['src'], 'r', encoding='utf-8') as f:
-                placed_glyphs[i] = dict_union(
-                    placed_glyphs[i],
-                    {'svg': parseString(f.read()).documentElement})
-            remove_guide_from_cap(placed_glyphs[i]['svg'], pargs.glyph_part_ignore_regex)
-            if glyph_style:
-                remove_fill_from_svg(placed_glyphs[i]['svg'])
-        placed_glyphs[i]['vector'] = get_glyph_vector_data(placed_glyphs[i], glyph_style, pargs.glyph_unit_length, pargs.partition_uv_by_face_direction, layout_min_point, layout_max_point)
-
     svg_dims:Vector
     if pargs.partition_uv_by_face_direction:
         svg_dims = pargs.glyph_unit_length * Matrix.Diagonal((1, 2)) @ (layout_max_point - layout_min_point)
     else:
         svg_dims = pargs.glyph_unit_length * (layout_max_point - layout_min_point)
 
-    svg: str = '\n'.join([
-        '<svg width="%d" height="%d" viewbox="0 0 %d %d" fill="none" xmlns="http://www.w3.org/2000/svg">'
-        % (svg_dims.x, svg_dims.y, svg_dims.x, svg_dims.y)
-    ] + list(
-        map(lambda p: '\n'.join(p['vector'])
-            if 'vector' in p else '', placed_glyphs)) + ['</svg>'])
-
-    svgObjectNames:[str] = None
-    import_and_align_glyphs_as_raster(svg, imgNode, uv_image_path, uv_material_name, layout_min_point, layout_max_point, pargs.uv_res, pargs.adjust_glyphs or pargs.apply_colour_map, pargs.partition_uv_by_face_direction)
+    glyph_cache:dict = shared_dict('glyph-svg-bodies')
+    with SvgGroupWriter(svg_path, svg_dims.x, svg_dims.y) as svg_writer:
+        for glyph in placed_glyphs:
+            glyph_style:str = get_style(glyph, 'glyph-style')
+            if 'src' in glyph:
+                glyph['svg'] = get_glyph_svg_body(glyph['src'], pargs.glyph_part_ignore_regex, bool(glyph_style), glyph_cache)
+            svg_writer.write_group(get_glyph_vector_data(glyph, glyph_style, pargs.glyph_unit_length, pargs.partition_uv_by_face_direction, layout_min_point, layout_max_point), get_glyph_vector_bounds(glyph, pargs.glyph_unit_length, pargs.partition_uv_by_face_direction, layout_min_point, layout_max_point))
+        return (svg_writer.close(), svg_dims, placed_glyphs)
 
-
-    printi('Successfully imported glyphs')
-
-    return { 'glyph-names': svgObjectNames } if svgObjectNames is not None else {}
-
-def import_and_align_glyphs_as_raster(svg:str, imgNode:ShaderNodeTexImage, uv_image_path:str, uv_material_name:str, layout_min_point:Vector, layout_max_point:Vector, uv_res:float, use_custom_image:bool, partition_uv_by_face_direction:bool):
-    # Convert to png
-    #  from cairosvg import svg2png
-    #  m:float = min((Matrix.Diagonal((1, 2)) @ layout_dims) if partition_uv_by_face_direction else layout_dims)
-    #  uv_dims:Vector = (uv_res / m) * (Matrix.Diagonal((1, 2)) @ layout_dims) if partition_uv_by_face_direction else layout_dims
-    #  svg2png_params:dict = {
-        #  'parent_width': int(uv_dims.x),
-        #  'parent_height': int(uv_dims.y),
-        #  'scale': m,
-        #  #  'unsafe': True,
-        #  'output_width': int(uv_dims.x),
-        #  'output_height': int(uv_dims.y) * (2 if partition_uv_by_face_direction else 1), # Who knows why this is required for the cairo method, but it seems to do the job
-        #  'write_to': uv_image_path,
-    #  }
-    #  svg2png(svg, **svg2png_params)
-
-    # Compute uv image dimensions
-    partition_transform:Matrix = Matrix.Diagonal((1,2)) if partition_uv_by_face_direction else Matrix.Identity(2)
-    partition_transformed_layout_dims:Vector = partition_transform @ (layout_max_point - layout_min_point)
-    m:float = min(partition_transformed_layout_dims)
-    uv_dims:Vector = (uv_res / m) * partition_transformed_layout_dims
+def import_and_align_glyphs_as_raster(svg_groups:SvgGroups, svg_dims:Vector, imgNode:ShaderNodeTexImage, uv_image_path:str, uv_material_name:str, layout_min_point:Vector, layout_max_point:Vector, uv_res:float, use_custom_image:bool, partition_uv_by_face_direction:bool, uv_tile_size:int, raster_workers:int, rasteriser:str, cache_dir:str):
+    uv_dims:Vector = get_uv_image_dims(layout_min_point, layout_max_point, uv_res, partition_uv_by_face_direction)
 
     # Blender internal image name
     bpy_internal_uv_image_name:str = basename(uv_image_path)
 
     if use_custom_image:
         printi('Converting uv image svg to png for import...')
-        png:bytes
-        with Colour('transparent') as transparent:
-            image_params:dict = {
-                'blob': svg.encode('utf-8'),
-                'format': 'svg',
-                'background': transparent,
-                'width': int(uv_dims.x),
-                'height': int(uv_dims.y),
-            }
-            with Image(**image_params) as image:
-                with image.convert('png') as converted:
-                    printi('Writing uv png to file')
-                    converted.save(filename=uv_image_path)
+        with profile_stage('rasterise'):
+            rasterise_svg_groups(svg_groups, svg_groups.bounds, (svg_dims.x, svg_dims.y), (int(uv_dims.x), int(uv_dims.y)), uv_image_path, uv_tile_size, raster_workers, rasteriser, cache_dir)
 
         # Add image to Blender's database
         printi('Importing image into blender')
-        imgNode.image = data.images.load(uv_image_path, check_existing=False)
+        with profile_stage('image-load'):
+            if imgNode.image is not None and imgNode.image.filepath == uv_image_path:
+                if tuple(imgNode.image.size) == (int(uv_dims.x), int(uv_dims.y)):
+                    swap_image_pixels(imgNode.image, uv_image_path)
+                else:
+                    imgNode.image.reload()
+            else:
+                imgNode.image = data.images.load(uv_image_path, check_existing=False)
     else:
         printi('Creating new blank uv image')
         imgNode.image = data.images.new(bpy_internal_uv_image_name, width=int(uv_dims.x), height=int(uv_dims.y))
 
+##
+# @brief Compute the size of the uv image of a layout
+#
+# @param layout_min_point:Vector The minimum point of the layout
+# @param layout_max_point:Vector The maximum point of the layout
+# @param uv_res:float The length of the shorter side of the image in pixels
+# @param partition_uv_by_face_direction:bool Whether the image has separate halves for the tops and sides of the caps
+#
+# @return The width and height of the image in pixels (not yet rounded)
+def get_uv_image_dims(layout_min_point:Vector, layout_max_point:Vector, uv_res:float, partition_uv_by_face_direction:bool) -> Vector:
+    partition_transform:Matrix = Matrix.Diagonal((1,2)) if partition_uv_by_face_direction else Matrix.Identity(2)
+    partition_transformed_layout_dims:Vector = partition_transform @ (layout_max_point - layout_min_point)
+    m:float = min(partition_transformed_layout_dims)
+    return (uv_res / m) * partition_transformed_layout_dims
+
+##
+# @brief Replace the pixels of an image already in Blender with those of a png of the same size, rather than loading the png as a new image
+#
+# @param image:Image The image to update
+# @param fname:str Name of the png, as written by `write_png`
+#
+# @return Nothing
+def swap_image_pixels(image:Image, fname:str):
+    pixels:ndarray = read_png(fname)
+    # Blender holds pixels as floats from the bottom row up
+    image.pixels.foreach_set((pixels[::-1].astype(float32) / 255.0).ravel())
+    image.update()
+
 def resolve_glyph_offset(cap:dict, alignment:str, glyph_ulen:float) -> dict:
     if 'glyph-dim' not in cap:
         cap['glyph-offset'] = Vector((0.0, 0.0))
@@ -149,6 +186,32 @@ def resolve_glyph_offset(cap:dict, alignment:str, glyph_ulen:float) -> dict:
     return cap
 
 
+##
+# @brief Obtain the cleaned, serialised content of a glyph svg, parsing each file at most once per run
+#
+# @param src:str Path to the glyph svg
+# @param glyph_part_ignore_regex:str Regex matching the ids of nodes to remove from the glyph
+# @param strip_fill:bool Whether to remove fill attributes (i.e. whether the glyph is to be styled)
+# @param cache:dict Cache of previously-serialised glyphs, holding the modification time of each `src` and its serialisations keyed on the other parameters, which are discarded when the file changes
+#
+# @return The serialised child elements of the glyph's root svg node
+def get_glyph_svg_body(src:str, glyph_part_ignore_regex:str, strip_fill:bool, cache:dict) -> str:
+    mtime:float = getmtime(src)
+    if src not in cache or cache[src][0] != mtime:
+        cache[src] = (mtime, {})
+    bodies:dict = cache[src][1]
+    cache_key:tuple = (glyph_part_ignore_regex, strip_fill)
+    if cache_key not in bodies:
+        profile_count('glyph-files-parsed')
+        glyph_svg:Element
+        with open(src, 'r', encoding='utf-8') as f:
+            glyph_svg = parseString(f.read()).documentElement
+        remove_guide_from_cap(glyph_svg, glyph_part_ignore_regex)
+        if strip_fill:
+            remove_fill_from_svg(glyph_svg)
+        bodies[cache_key] = '\n'.join(map(lambda c: c.toxml(), map(sanitise_ids, filter(lambda c: type(c) == Element, glyph_svg.childNodes))))
+    return bodies[cache_key]
+
 def remove_guide_from_cap(cap: Element, glyph_part_ignore_regex) -> Element:
     def _remove_guide_from_cap(cap: Element, glyph_part_ignore_regex) -> None:
         badKids: [Element] = list(
@@ -213,7 +276,7 @@ def resolve_special_profile_y_offsets_with_alignment(alignment:str, iso_enter_gl
     return resolved_offsets
 
 def collect_data(layout: [dict], profile: dict, glyph_dir: str,
-        glyph_map: dict, iso_enter_glyph_pos:str, alignment:str) -> [dict]:
+        glyph_map: dict, iso_enter_glyph_pos:str, alignment:str, cache_dir:str) -> [dict]:
     profile_x_offsets:dict = resolve_profile_x_offsets_with_alignment(alignment, profile['unit-length'])
     profile_x_offsets_rel: [dict] = list(
         map(lambda m: {
@@ -228,11 +291,14 @@ def collect_data(layout: [dict], profile: dict, glyph_dir: str,
     profile_special_offsets:dict = resolve_special_profile_y_offsets_with_alignment(alignment, iso_enter_glyph_pos, profile['unit-length'], profile_x_offsets, profile['y-offsets'], profile['special-offsets'])
     profile_special_offsets_rel: [dict] = list(map(lambda so: { 'key-type': so[0], 'p-off-x': so[1]['x'], 'p-off-y': so[1]['y'] }, profile_special_offsets.items()))
 
-    glyph_offsets = list(map(glyph_inf, glyph_files(glyph_dir)))
-    glyph_names:{str} = set(map(lambda g: g['glyph'], glyph_offsets))
-    duplicate_glyphs:[str] = list(map(lambda c: c[1][0]['glyph'] + ' @ ' + ', '.join(list(map(lambda c2: c2['src'], c[1]))), get_dicts_with_duplicate_field_values(glyph_offsets, 'glyph').items()))
+    # Catalogue glyphs by file name, only inspecting those which are used
+    glyph_catalogue:[dict] = list(map(lambda g: { 'glyph': glyph_name(g), 'src': g }, glyph_files(glyph_dir)))
+    glyph_names:{str} = set(map(lambda g: g['glyph'], glyph_catalogue))
+    duplicate_glyphs:[str] = list(map(lambda c: c[1][0]['glyph'] + ' @ ' + ', '.join(list(map(lambda c2: c2['src'], c[1]))), get_dicts_with_duplicate_field_values(glyph_catalogue, 'glyph').items()))
     if duplicate_glyphs != []:
         printw('Duplicate glyphs detected:\n\t' + '\n\t'.join(duplicate_glyphs))
+    referenced_glyph_names:{str} = set(map(str, glyph_map.values()))
+    glyph_offsets:[dict] = glyph_infs([ g['src'] for g in glyph_catalogue if g['glyph'] in referenced_glyph_names ], glyph_dir, cache_dir)
     glyph_map_rel = list(
         map(lambda m: {
             'key': str(m[0]),
@@ -297,7 +363,7 @@ def get_glyph_vector_data(glyph:dict, style:str, ulen:float, partition_uv_by_fac
     glyph_svg_content:[str] = []
     glyph_svg_data:[str] = []
     if 'svg' in glyph:
-        glyph_svg_content = list(map(lambda c: c.toxml(), map(sanitise_ids, filter(lambda c: type(c) == Element, glyph['svg'].childNodes))))
+        glyph_svg_content = [ glyph['svg'] ]
         glyph_svg_data = [ '<g %s>' % ' '.join(glyph_svg_header_content) ] + glyph_svg_content + [ '</g>' ]
 
     cap_svg_data:[str] = []
@@ -327,6 +393,39 @@ def get_glyph_vector_data(glyph:dict, style:str, ulen:float, partition_uv_by_fac
     # Combine and return
     return ['<g>'] + cap_svg_data + glyph_svg_data + ['</g>']
 
+##
+# @brief Compute a conservative bounding box of the svg content drawn for a glyph and its cap
+#
+# @param glyph:dict A placed glyph
+# @param ulen:float The glyph unit length
+# @param partition_uv_by_face_direction:bool Whether the cap is also drawn in the lower half of the uv-space
+# @param layout_min_point:Vector The minimum point of the layout
+# @param layout_max_point:Vector The maximum point of the layout
+#
+# @return The bounds (xmin, ymin, xmax, ymax) in svg units
+def get_glyph_vector_bounds(glyph:dict, ulen:float, partition_uv_by_face_direction:bool, layout_min_point:Vector, layout_max_point:Vector) -> (float, float, float, float):
+    cap_dims:(float, float)
+    if 'key-type' in glyph and glyph['key-type'] == 'iso-enter':
+        cap_dims = (1.5 * ulen, 2.0 * ulen)
+    else:
+        cap_dims = (ulen * max(glyph['width'], glyph['secondary-width']), ulen * max(glyph['height'], glyph['secondary-height']))
+
+    # Rectangles (position, xmin, ymin, xmax, ymax) drawn rotated about their positions, padded to allow for anti-aliasing and glyphs which overflow their declared size
+    cap_pad:float = 0.05 * ulen
+    cap_top_pos:Vector = ulen * (glyph['kle-pos'] - layout_min_point)
+    rects:[tuple] = [ (cap_top_pos.x, cap_top_pos.y, -cap_pad, -cap_pad, cap_dims[0] + cap_pad, cap_dims[1] + cap_pad) ]
+    if partition_uv_by_face_direction:
+        rects.append((cap_top_pos.x, cap_top_pos.y + ulen * (layout_max_point - layout_min_point).y, -cap_pad, -cap_pad, cap_dims[0] + cap_pad, cap_dims[1] + cap_pad))
+    if 'glyph-dim' in glyph:
+        glyph_pad:float = 0.5 * ulen
+        rects.append((glyph['glyph-pos'].x, glyph['glyph-pos'].y, -glyph_pad, -glyph_pad, glyph['glyph-dim'].x + glyph_pad, glyph['glyph-dim'].y + glyph_pad))
+
+    rect_arr:ndarray = array(rects)
+    corners:ndarray = rect_arr[:, None, 0:2] + rotate(rect_arr[:, [[2, 3], [2, 5], [4, 3], [4, 5]]], full(len(rects), glyph['rotation']))
+    lo:ndarray = corners.reshape(-1, 2).min(axis=0)
+    hi:ndarray = corners.reshape(-1, 2).max(axis=0)
+    return (float(lo[0]), float(lo[1]), float(hi[0]), float(hi[1]))
+
 def generate_cap_svg_content(glyph:dict, ulen:float) -> [str]:
     svg_content:[str]
     cap_style:str = get_style(glyph, 'cap-style')
@@ -344,7 +443,7 @@ def sanitise_ids(node:Element) -> Element:
         original_name:str = node.getAttribute('id')
         sanitised_id:str = original_name
         i:int = 1
-        while sanitised_id in data.objects:
+        while blender_available() and sanitised_id in data.objects:
             i += 1
             sanitised_id = original_name + '-' + str(i)
         node.setAttribute('id', sanitised_id)
@@ -379,7 +478,20 @@ def apply_vertical_margin_offset(cap:dict) -> dict:
         cap['p-off-y'] += cap['margin-offset'][1]
     return cap
 
+##
+# @brief Choose where renderings of single keys are cached.
+# Compositing cached renderings only pays off when an earlier run has rendered most of the keys, so it is only used by incremental runs (including those made when watching).
+#
+# @param pargs:Namespace Parsed arguments
+#
+# @return The cache directory, or None if the uv image should be rendered directly
+def raster_cache_dir(pargs:Namespace) -> str:
+    return pargs.cache_dir if pargs.use_cache and pargs.incremental else None
+
 def glyph_files(dname: str) -> [str]:
+    return shared_input('glyph-files', dname, listing_state, lambda: find_glyph_files(dname))
+
+def find_glyph_files(dname: str) -> [str]:
     if not exists(dname):
         die('Directory "%s" doesn\'t exist' % dname)
     svgs: [str] = list(filter(lambda f: f.endswith('.svg'), walk(dname)))
@@ -4,22 +4,32 @@
 from .adjustcaps import adjust_caps, get_caps
 from .adjustglyphs import adjust_glyphs, glyph_files
 from .args import parse_args, Namespace
-from .blender_available import blender_available
+from .batch import print_batch_timings, read_batch_jobs
+from .blender_available import blender_available, disable_blender
 from .colour_map_parser import parse_colour_map
 from .colour_resolver import colourise_layout
 from .exceptions import AdjustKeysException, AdjustKeysGracefulExit
 from .glyphinf import glyph_name
+from .headless import headless_adjustkeys
+from .incremental import incremental_adjust_caps, incremental_adjust_glyphs, session_inputs
 from .input_types import type_check_glyph_map, type_check_profile_data
 from .layout import get_layout, dumb_parse_layout, compute_layout_dims
 from .lazy_import import LazyImport
 from .log import die, init_logging, printi, printw, print_warnings
+from .mathutils_shim import install_mathutils_shim
+from .profiling import init_profiling, print_profile, profile_count, profile_report, profile_stage, profiling_enabled, write_profile
 from .scale import get_scale
+from .shared_inputs import file_state, shared_input, sharing_inputs
 from .update_checker import check_update
+from .watch import watch, watched_paths
 from .util import dict_union, safe_get
 from .yaml_io import read_yaml
-from os import makedirs
+from concurrent.futures import Future, ProcessPoolExecutor
+from os import cpu_count, makedirs
 from os.path import exists, join
 from sys import argv, exit
+from tempfile import mkdtemp
+from time import perf_counter
 from yaml import dump
 if blender_available():
     from bpy.types import Collection
@@ -41,6 +51,7 @@ def main(*args:[[str]]) -> dict:
 def adjustkeys(*args: [[str]]) -> dict:
     pargs: Namespace = parse_args(args)
     init_logging(pargs)
+    init_profiling(pargs)
 
     if pargs.print_opts_yml:
         print(dump(pargs.__dict__)[:-1])
@@ -73,61 +84,209 @@ def adjustkeys(*args: [[str]]) -> dict:
             kc[0] = kc[0].ljust(maxLen)
         print('\n'.join(list(map(lambda kc: kc[0] + ' @ ' + kc[1], knownCaps))))
         return {}
+    if pargs.batch_file not in ['None', '']:
+        return batch_adjustkeys(pargs, read_batch_jobs(pargs.batch_file))
 
-    if not blender_available():
-        die('bpy is not available, please run `adjustkeys` from within Blender (instructions should be in the supplied README.md file)')
+    if pargs.headless:
+        install_mathutils_shim()
+    elif not blender_available():
+        die('bpy is not available, please run `adjustkeys` from within Blender (instructions should be in the supplied README.md file), or use --headless to only make the uv image and placement manifest')
 
+    if pargs.watch:
+        watch_pargs:Namespace = Namespace(**dict(pargs.__dict__, incremental=True))
+        def run() -> dict:
+            init_profiling(watch_pargs)
+            return adjust_layout(watch_pargs)
+        with sharing_inputs(session_inputs):
+            return watch(watched_paths(watch_pargs), run)
+    if pargs.incremental and not pargs.headless:
+        with sharing_inputs(session_inputs):
+            return adjust_layout(pargs)
+    return adjust_layout(pargs)
+
+##
+# @brief Make the outputs of a run: the keycap models and uv image in Blender, or the uv image and placement manifest if headless
+#
+# @param pargs:Namespace Parsed arguments
+#
+# @return A dictionary of information about the outputs
+def adjust_layout(pargs:Namespace) -> dict:
     # Read profile data
     profile_data:dict = {}
     if pargs.adjust_glyphs or pargs.adjust_caps:
-        profile_data = read_yaml(join(pargs.cap_dir, 'profile_data.yml'))
-        if not type_check_profile_data(profile_data):
-            die('Profile data failed type-checking, see console for more information')
+        with profile_stage('profile-data'):
+            profile_data = get_profile_data(pargs.cap_dir)
 
     # Read layout file
     layout:[dict] = []
-    if pargs.adjust_glyphs or pargs.adjust_caps:
-        layout:[dict] = get_layout(pargs.layout_file, profile_data, pargs.apply_colour_map)
-    layout_extreme_points:Tuple[Vector, Vector] = compute_layout_dims(layout)
+    with profile_stage('layout-parse'):
+        if pargs.adjust_glyphs or pargs.adjust_caps:
+            layout:[dict] = get_layout(pargs.layout_file, profile_data, pargs.apply_colour_map)
+        layout_extreme_points:Tuple[Vector, Vector] = compute_layout_dims(layout)
     layout_min_point:Vector = layout_extreme_points[0]
     layout_max_point:Vector = layout_extreme_points[1]
+    profile_count('keys', len(layout))
 
     # Read colour-map file
     colour_map:[dict] = None
     if pargs.apply_colour_map:
-        colour_map:[dict] = parse_colour_map(pargs.colour_map_file)
+        with profile_stage('colour-map-parse'):
+            colour_map:[dict] = get_colour_map(pargs.colour_map_file)
 
-    coloured_layout:[dict] = colourise_layout(pargs.layout_file, layout, colour_map)
+    with profile_stage('colourise'):
+        coloured_layout:[dict] = colourise_layout(pargs.layout_file, layout, colour_map)
 
     glyph_map:dict = {}
     if pargs.adjust_glyphs:
-        glyph_map = read_yaml(pargs.glyph_map_file)
-        if not type_check_glyph_map(glyph_map):
-            die('Glyph map failed type-checking see the console for more information')
-
-    # Make collection
-    collection:Collection = context.collection
-    collection_data:dict = { 'temporary-collection': collection }
+        with profile_stage('glyph-map'):
+            glyph_map = read_yaml(pargs.glyph_map_file)
+            if not type_check_glyph_map(glyph_map):
+                die('Glyph map failed type-checking see the console for more information')
 
-    # Adjust model positions
+    collection_data:dict = {}
     model_data:dict = {}
-    if pargs.adjust_caps:
-        model_data = adjust_caps(coloured_layout, colour_map, profile_data, collection, layout_min_point, layout_max_point, pargs)
-
     glyph_data:dict = {}
-    if pargs.adjust_caps:
-        # Obtain data for glyph alignment
-        model_name:str = safe_get(model_data, 'keycap-model-name')
-        glyph_layout:[dict] = safe_get(model_data, '~caps-with-margin-offsets', default=coloured_layout)
-        imgNode:ShaderNodeTexImage = safe_get(model_data, '~texture-image-node')
-        uv_image_path:str = safe_get(model_data, 'uv-image-path')
-        uv_material_name:str = safe_get(model_data, 'uv-material-name')
+    if pargs.headless:
+        with profile_stage('headless'):
+            glyph_data = headless_adjustkeys(coloured_layout, profile_data, layout_min_point, layout_max_point, glyph_map, pargs)
+    else:
+        # Make collection
+        collection:Collection = context.collection
+        collection_data = { 'temporary-collection': collection }
+
+        # Adjust model positions
+        if pargs.adjust_caps:
+            with profile_stage('adjust-caps'):
+                model_data = (incremental_adjust_caps if pargs.incremental else adjust_caps)(coloured_layout, colour_map, profile_data, collection, layout_min_point, layout_max_point, pargs)
+
+        if pargs.adjust_caps and safe_get(model_data, '~texture-image-node') is not None:
+            # Obtain data for glyph alignment
+            model_name:str = safe_get(model_data, 'keycap-model-name')
+            glyph_layout:[dict] = safe_get(model_data, '~caps-with-margin-offsets', default=coloured_layout)
+            imgNode:ShaderNodeTexImage = safe_get(model_data, '~texture-image-node')
+            uv_image_path:str = safe_get(model_data, 'uv-image-path')
+            uv_material_name:str = safe_get(model_data, 'uv-material-name')
 
-        # Adjust glyph positions
-        glyph_data = adjust_glyphs(glyph_layout, profile_data, model_name, layout_min_point, layout_max_point, collection, glyph_map, imgNode, uv_image_path, uv_material_name, pargs)
+            # Adjust glyph positions
+            with profile_stage('adjust-glyphs'):
+                glyph_data = (incremental_adjust_glyphs if pargs.incremental else adjust_glyphs)(glyph_layout, profile_data, model_name, layout_min_point, layout_max_point, collection, glyph_map, imgNode, uv_image_path, uv_material_name, pargs)
+
+    # Report profiling information
+    profiling_data:dict = {}
+    if profiling_enabled():
+        profiling_data = { 'profile': profile_report() }
+        print_profile(profiling_data['profile'])
+        if pargs.profile_out not in ['None', '']:
+            write_profile(pargs.profile_out, profiling_data['profile'])
+            printi('Wrote profile to "%s"', pargs.profile_out)
 
     # Return info
-    return remove_private_data(dict_union(collection_data, model_data, glyph_data))
+    return remove_private_data(dict_union(collection_data, model_data, glyph_data, profiling_data))
+
+##
+# @brief Run each job of a batch in turn, reading the inputs they share only once
+#
+# @param pargs:Namespace Parsed arguments, to which the options of each job are applied
+# @param jobs:[(str, dict)] The name and options of each job
+#
+# @return A dictionary holding the name, wall time and output of each job under `batch`
+def batch_adjustkeys(pargs:Namespace, jobs:[(str, dict)]) -> dict:
+    base_opts:dict = dict(pargs.__dict__, batch_file=None, opt_file=None)
+    num_workers:int = pargs.jobs if pargs.jobs > 0 else cpu_count() or 1
+    results:[dict] = []
+    start:float = perf_counter()
+    with sharing_inputs():
+        if num_workers == 1 or len(jobs) <= 1:
+            for i,(name, options) in enumerate(jobs):
+                printi('Running batch job %d of %d: %s', i + 1, len(jobs), name)
+                job_start:float = perf_counter()
+                result:dict = adjustkeys(dict_union(base_opts, options))
+                results.append({ 'name': name, 'wall-s': perf_counter() - job_start, 'result': result })
+        else:
+            results = parallel_batch_adjustkeys(base_opts, jobs, num_workers)
+    print_batch_timings(results, perf_counter() - start)
+    return { 'batch': results }
+
+##
+# @brief Run the jobs of a batch across several processes.
+# The stages which do not need Blender (up to and including making the uv image) are run in the worker processes as if `--headless` were given, then any job which is not headless has its models made in this process using the uv image made for it.
+# Inputs shared by the jobs are read before the workers are started so that, where processes are forked, they are inherited rather than read again.
+#
+# @param base_opts:dict Options to which the options of each job are applied
+# @param jobs:[(str, dict)] The name and options of each job
+# @param num_workers:int Number of worker processes
+#
+# @return The name, wall time and output of each job
+def parallel_batch_adjustkeys(base_opts:dict, jobs:[(str, dict)], num_workers:int) -> [dict]:
+    # Each job rasterises in a single process as the jobs already occupy the workers
+    job_opts:[dict] = [ dict_union(base_opts, options, { 'jobs': 1, 'raster_workers': 1 }) for _,options in jobs ]
+
+    # Jobs which are not headless keep their uv images in a temporary directory unless told otherwise
+    worker_opts:[dict] = []
+    texture_dir:str = None
+    for i,opts in enumerate(job_opts):
+        if opts['headless']:
+            worker_opts.append(opts)
+        else:
+            headless_out:str = opts['headless_out']
+            if headless_out in ['None', '']:
+                if texture_dir is None:
+                    texture_dir = mkdtemp(prefix='adjustkeys-batch-')
+                headless_out = join(texture_dir, str(i + 1))
+            worker_opts.append(dict_union(opts, { 'headless': True, 'headless_out': headless_out }))
+
+    preload_shared_inputs(job_opts)
+
+    printi('Running %d batch jobs in %d processes', len(jobs), num_workers)
+    results:[dict] = []
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=disable_blender) as executor:
+        futures:[Future] = [ executor.submit(run_batch_worker, opts) for opts in worker_opts ]
+        for (name, _),opts,future in zip(jobs, job_opts, futures):
+            (result, wall) = future.result()
+            if not opts['headless']:
+                printi('Making models of batch job %s', name)
+                blender_start:float = perf_counter()
+                uv_image_opts:dict = { 'uv_image_file': result['uv-image-path'] } if result['uv-image-path'] is not None else {}
+                result = adjustkeys(dict_union(opts, uv_image_opts))
+                wall += perf_counter() - blender_start
+            results.append({ 'name': name, 'wall-s': wall, 'result': result })
+    return results
+
+def run_batch_worker(opts:dict) -> (dict, float):
+    start:float = perf_counter()
+    try:
+        return (adjustkeys(opts), perf_counter() - start)
+    finally:
+        print_warnings()
+
+##
+# @brief Read the inputs which are shared between the jobs of a batch
+#
+# @param job_opts:[dict] The options of each job
+#
+# @return Nothing
+def preload_shared_inputs(job_opts:[dict]):
+    for opts in job_opts:
+        if opts['adjust_glyphs'] or opts['adjust_caps']:
+            get_profile_data(opts['cap_dir'])
+        if opts['adjust_caps']:
+            get_caps(opts['cap_dir'])
+        if opts['adjust_glyphs']:
+            glyph_files(opts['glyph_dir'])
+        if opts['apply_colour_map']:
+            get_colour_map(opts['colour_map_file'])
+
+def get_profile_data(cap_dir:str) -> dict:
+    return shared_input('profile-data', join(cap_dir, 'profile_data.yml'), file_state, lambda: read_profile_data(join(cap_dir, 'profile_data.yml')))
+
+def get_colour_map(fname:str) -> [dict]:
+    return shared_input('colour-map', fname, file_state, lambda: parse_colour_map(fname))
+
+def read_profile_data(fname:str) -> dict:
+    profile_data:dict = read_yaml(fname)
+    if not type_check_profile_data(profile_data):
+        die('Profile data failed type-checking, see console for more information')
+    return profile_data
 
 def remove_private_data(d:dict) -> dict:
     return dict(filter(lambda p: not p[0].startswith('~'), d.items()))
@@ -1,6 +1,7 @@
 # Copyright (C) Edward Jones
 
-from .path import adjustkeys_path
+from .blender_available import blender_available
+from .path import adjustkeys_path, user_cache_path
 from .version import version
 from os.path import join
 
@@ -20,6 +21,27 @@ args: [dict] = [{
     ],
     'type': str,
     'label': 'Alignment direction'
+}, {
+    'dest': 'batch_file',
+    'short': '-b',
+    'long': '--batch',
+    'action': 'store',
+    'help': 'Run each of the jobs in the given YAML file, a list of option dictionaries applied over the other options, reading shared inputs such as keycap models and glyphs only once',
+    'metavar': 'file',
+    'default': None,
+    'type': str,
+    'str-type': 'file',
+}, {
+    'dest': 'cache_dir',
+    'short': '-C',
+    'long': '--cache-dir',
+    'action': 'store',
+    'help': 'specify the directory in which to store data which is slow to recompute, such as imported keycap models',
+    'metavar': 'dir',
+    'default': user_cache_path(),
+    'label': 'Cache folder',
+    'type': str,
+    'str-type': 'dir'
 }, {
     'dest': 'cap_dir',
     'short': '-K',
@@ -52,6 +74,17 @@ args: [dict] = [{
     'label': 'Colour map file',
     'type': str,
     'str-type': 'file'
+}, {
+    'dest': 'dump_uv_svg',
+    'short': '-Du',
+    'long': '--dump-uv-svg',
+    'action': 'store',
+    'help': 'specify a file to keep the svg from which the uv image is rasterised in, for inspection',
+    'metavar': 'file',
+    'default': None,
+    'type': str,
+    'str-type': 'file',
+    'label': 'UV svg output file'
 }, {
     'dest': 'fatal_warnings',
     'short': '-E',
@@ -107,6 +140,24 @@ args: [dict] = [{
     'type': float,
     'soft-min': 0.0,
     'soft-max': 1000.0
+}, {
+    'dest': 'headless',
+    'short': '-H',
+    'long': '--headless',
+    'action': 'store_true',
+    'help': 'Run without Blender, writing only the uv image and a json manifest of where each key and glyph is placed',
+    'default': False,
+    'type': bool,
+}, {
+    'dest': 'headless_out',
+    'short': '-Ho',
+    'long': '--headless-out',
+    'action': 'store',
+    'help': 'Specify the directory to write the outputs of --headless to, defaults to the current directory',
+    'metavar': 'dir',
+    'default': None,
+    'type': str,
+    'str-type': 'dir',
 }, {
     'dest':
     'iso_enter_glyph_pos',
@@ -131,6 +182,26 @@ args: [dict] = [{
     'ISO-enter alignment',
     'type':
     str
+}, {
+    'dest': 'incremental',
+    'short': '-In',
+    'long': '--incremental',
+    'action': 'store_true',
+    'help': 'Reuse the keycap models and uv image of the previous run in this Blender session where the options and files they depend on are unchanged, replacing the models of that run rather than adding new ones, and re-render only the keys of the uv image which have changed',
+    'default': False,
+    'type': bool,
+    'label': 'Incremental re-run',
+}, {
+    'dest': 'jobs',
+    'short': '-j',
+    'long': '--jobs',
+    'metavar': 'int',
+    'action': 'store',
+    'help': 'Specify the number of processes to run the jobs of a batch in, 0 to use one per CPU. The stages which need Blender are run in this process once the uv image of each job is made, and jobs rasterise their uv images in one process each',
+    'default': 1,
+    'type': int,
+    'min': 0,
+    'max': 256,
 }, {
     'dest': 'layout_file',
     'short': '-L',
@@ -142,6 +213,15 @@ args: [dict] = [{
     'label': 'KLE layout JSON file',
     'type': str,
     'str-type': 'file'
+}, {
+    'dest': 'link_caps',
+    'short': '-l',
+    'long': '--link-caps',
+    'action': 'store_true',
+    'help': 'Keep keycaps as linked duplicates which share one mesh per keycap model rather than joining them into a single object. A single object is still made when glyphs or colours are applied as these require a uv-map',
+    'default': False,
+    'type': bool,
+    'label': 'Link duplicate keycaps',
 }, {
     'dest': 'list_cap_models',
     'short': '-Sc',
@@ -220,6 +300,49 @@ args: [dict] = [{
     'default': False,
     'type': bool,
     'label': 'Partition UV-map by face normals',
+}, {
+    'dest': 'profile',
+    'short': '-P',
+    'long': '--profile',
+    'action': 'store_true',
+    'help': 'Time each stage of the run and report the times, counts of the work done and peak memory use',
+    'default': False,
+    'type': bool,
+    'label': 'Profile run',
+}, {
+    'dest': 'profile_out',
+    'short': '-Po',
+    'long': '--profile-out',
+    'action': 'store',
+    'help': 'Write the profiling report as json to the given file, implies --profile',
+    'metavar': 'file',
+    'default': None,
+    'type': str,
+    'str-type': 'file',
+    'label': 'Profile output file',
+}, {
+    'dest': 'raster_workers',
+    'short': '-w',
+    'long': '--raster-workers',
+    'metavar': 'int',
+    'action': 'store',
+    'help': 'Specify the number of processes used to rasterise the uv image, 0 to use one per CPU (by default one per CPU, or 1 to rasterise without starting processes within Blender)',
+    'default': 1 if blender_available() else 0,
+    'label': 'Rasteriser processes',
+    'type': int,
+    'min': 0,
+    'max': 256,
+}, {
+    'dest': 'rasteriser',
+    'short': '-R',
+    'long': '--rasteriser',
+    'action': 'store',
+    'help': 'Specify the library used to rasterise the uv image',
+    'metavar': 'backend',
+    'default': 'wand',
+    'choices': ['wand', 'cairosvg'],
+    'type': str,
+    'label': 'SVG rasteriser',
 }, {
     'dest': 'print_opts_yml',
     'short': '-#',
@@ -243,6 +366,15 @@ args: [dict] = [{
     'type': float,
     'soft-min': 0.0,
     'soft-max': 100.0,
+}, {
+    'dest': 'use_cache',
+    'short': '-Nx',
+    'long': '--no-cache',
+    'action': 'store_false',
+    'help': 'Reuse data stored in the cache folder from previous runs where the input files are unchanged',
+    'default': True,
+    'label': 'Use cache',
+    'type': bool
 }, {
     'dest': 'use_existing_materials',
     'short': '-e',
@@ -252,6 +384,17 @@ args: [dict] = [{
     'default': False,
     'type': bool,
     'label': 'Use existing materials',
+}, {
+    'dest': 'uv_image_file',
+    'short': '-Ui',
+    'long': '--uv-image',
+    'action': 'store',
+    'help': 'Specify an existing uv image to apply (such as one made with --headless), rather than making one',
+    'metavar': 'file',
+    'default': None,
+    'type': str,
+    'str-type': 'file',
+    'label': 'Existing UV image file',
 }, {
     'dest': 'uv_res',
     'short': '-u',
@@ -264,6 +407,26 @@ args: [dict] = [{
     'type': int,
     'min': 1024,
     'max': 8192,
+}, {
+    'dest': 'uv_tile_size',
+    'short': '-t',
+    'long': '--uv-tile-size',
+    'metavar': 'res',
+    'action': 'store',
+    'help': 'Specify the length of the side of the tiles in which the uv image is rasterised. Memory use while rasterising grows with the square of this value.',
+    'default': 2048,
+    'label': 'UV map tile size',
+    'type': int,
+    'min': 256,
+    'max': 16384,
+}, {
+    'dest': 'watch',
+    'short': '-W',
+    'long': '--watch',
+    'action': 'store_true',
+    'help': 'Keep running, updating the outputs whenever the layout, glyph map, colour map or glyphs change, implies --incremental',
+    'default': False,
+    'type': bool,
 }, {
     'dest': 'verbosity',
     'short': '-v',
@@ -0,0 +1,47 @@
+# Copyright (C) Edward Jones
+
+from .arg_defs import arg_dict
+from .log import die, printi
+from .yaml_io import read_yaml
+from os.path import basename
+
+##
+# @brief Read the jobs of a batch.
+# A batch file is a YAML list of jobs, each a dictionary of options (keyed as in an option file) which are applied over those given to the batch, and optionally a `name` to report it by.
+#
+# @param fname:str Name of the batch file
+#
+# @return A list of (name, options) pairs, one per job
+def read_batch_jobs(fname:str) -> [(str, dict)]:
+    raw_jobs:object = read_yaml(fname)
+    if type(raw_jobs) != list:
+        die('Batch file "%s" should contain a list of jobs' % fname)
+    jobs:[(str, dict)] = []
+    for i,job in enumerate(raw_jobs):
+        if type(job) != dict:
+            die('Job %d of batch file "%s" should be a dictionary of options, got %s' % (i + 1, fname, str(job)))
+        options:dict = { k: v for k,v in job.items() if k != 'name' }
+        unknown_options:[str] = [ k for k in options if k not in arg_dict or k == 'batch_file' ]
+        if unknown_options != []:
+            die('Job %d of batch file "%s" has unknown options: %s' % (i + 1, fname, ', '.join(map(str, unknown_options))))
+        jobs.append((str(job['name']) if 'name' in job else job_name(i, options), options))
+    return jobs
+
+def job_name(i:int, options:dict) -> str:
+    return '%d (%s)' % (i + 1, basename(options['layout_file'])) if 'layout_file' in options else str(i + 1)
+
+##
+# @brief Report the time taken by each job of a batch
+#
+# @param results:[dict] The name (`name`) and wall time (`wall-s`) of each job
+# @param total_wall:float The wall time of the whole batch, which is less than the sum of those of its jobs if they were run in parallel
+#
+# @return Nothing
+def print_batch_timings(results:[dict], total_wall:float):
+    if results == []:
+        return
+    name_width:int = max(map(lambda r: len(r['name']), results + [{ 'name': 'job' }]))
+    printi('%s  %s', 'job'.ljust(name_width), 'wall (s)')
+    for result in results:
+        printi('%s  %8.4f', result['name'].ljust(name_width), result['wall-s'])
+    printi('%s  %8.4f', 'total'.ljust(name_width), total_wall)
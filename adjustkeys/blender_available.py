@@ -9,3 +9,11 @@ def blender_available() -> bool:
     if blender_is_available is None:
         blender_is_available = find_spec('bpy') is not None
     return blender_is_available
+
+##
+# @brief Treat Blender as unavailable in this process, for worker processes which must not touch Blender's data even if forked from within it
+#
+# @return Nothing
+def disable_blender():
+    global blender_is_available
+    blender_is_available = False
@@ -1,12 +1,15 @@
+from .colour_resolver import compile_maths_cond, compile_maths_cond_batch
 from .input_types import type_check_colour_map
-from .log import die, printe
-from .util import dict_union
+from .log import die, printe, printi
+from .util import dict_union, safe_get
 from .yaml_io import read_yaml
 from collections import OrderedDict
 from functools import partial
+from numpy import bool_, broadcast_to, equal, errstate, logical_and, logical_not, logical_or, logical_xor, ndarray
 from pyparsing import infixNotation, Literal, oneOf, opAssoc, ParserElement, ParseException, pyparsing_common, Word
+from re import compile as compile_regex, IGNORECASE, Pattern, UNICODE
 from sys import getrecursionlimit, setrecursionlimit, stderr
-from typing import Callable, Iterator, List, Tuple
+from typing import Callable, List, Tuple, Union
 
 LOWER_RECURSION_LIMIT:int = 3000
 
@@ -44,6 +47,19 @@ logicbinops:OrderedDict = OrderedDict([
     ])
 ops = dict_union(uniops, binops, compops, logicuniops, logicbinops)
 
+# Versions of the logical operators which act element-wise on arrays, the others already do
+batch_logicuniops:OrderedDict = OrderedDict([
+        ('!', logical_not),
+    ])
+batch_logicbinops:OrderedDict = OrderedDict([
+        ('&', logical_and),
+        ('|', logical_or),
+        ('^', lambda c1,c2: batch_xor(c1, c2)),
+        ('=>', lambda c1,c2: logical_or(logical_not(c1), c2)),
+        ('<=>', lambda c1,c2: equal(logical_not(c1), logical_not(c2))),
+    ])
+batch_ops = dict_union(uniops, binops, compops, batch_logicuniops, batch_logicbinops)
+
 def parse_colour_map(fname:str) -> [dict]:
     raw_map:[dict] = read_yaml(fname)
 
@@ -51,21 +67,216 @@ def parse_colour_map(fname:str) -> [dict]:
         die('Colour map failed type-checking, see console for more information')
 
     mappings:[Tuple[str, str, Callable]] = [
-        ('key-pos', 'parsed-key-pos', parse_equation),
         ('key-name', 'key-name', sanitise_key_name),
     ]
     colour_map:[dict] = raw_map
     for mappingInf in mappings:
         colour_map = recursively_add(*mappingInf, colour_map)
 
-    return list(colour_map)
+    colour_map = list(colour_map)
+    for rule in colour_map:
+        rule['matcher'] = compile_cond(rule['cond'])
+
+    return colour_map
+
+##
+# @brief Compile the condition of a colour-map rule into a function which, given the context of the layout being coloured, returns a predicate on keys.
+# Regexes are compiled once, conditions on the layout file are resolved when the context is given, and nested conjunctions and disjunctions are flattened and simplified.
+#
+# @param cond:Union[bool, dict] The condition of a rule
+#
+# @return A function which takes a layout context and returns a predicate on keys
+def compile_cond(cond:Union[bool, dict]) -> Callable[[dict], Callable[[dict], bool]]:
+    binders:[Callable] = compile_conds(cond)
+    def bind(layout_context:dict) -> Callable[[dict], bool]:
+        pred:Union[bool, Callable] = conjunction([ b(layout_context) for b in binders ])
+        return pred if callable(pred) else (lambda _: pred)
+    return bind
+
+##
+# @brief Compile each of the conditions at one level of a rule
+#
+# @param cond:Union[bool, dict] The conditions at this level of a rule
+#
+# @return A list of functions which take a layout context and return either a predicate on keys or a constant truth value
+def compile_conds(cond:Union[bool, dict]) -> [Callable[[dict], Union[bool, Callable]]]:
+    if type(cond) == bool:
+        return [lambda _: cond]
+    binders:[Callable] = [ compile_statement(statementKey, cond[statementKey]) for statementKey in cond ]
+    return [ b for b in binders if b is not None ]
+
+def compile_statement(statementKey:str, statement:object) -> Callable[[dict], Union[bool, Callable]]:
+    if statementKey.startswith('key-name'):
+        return compile_key_name(statement if type(statement) == list else [statement])
+    elif statementKey.startswith('key-pos'):
+        return compile_key_pos(statement)
+    elif statementKey.startswith('layout-file-name'):
+        return compile_layout_file_cond('layout-file-name', statement)
+    elif statementKey.startswith('layout-file-path'):
+        return compile_layout_file_cond('layout-file-path', statement)
+    elif statementKey.startswith('implication'):
+        return compile_implication(statement)
+    elif statementKey.startswith('any'):
+        return compile_junction(disjunction, statement)
+    elif statementKey.startswith('all'):
+        return compile_junction(conjunction, statement)
+    elif statementKey.startswith('not-all'):
+        return compile_junction(lambda ps: negation(conjunction(ps)), statement)
+    elif statementKey.startswith('not-any'):
+        return compile_junction(lambda ps: negation(disjunction(ps)), statement)
+    return None
+
+def compile_key_name(key_name_regexes:[str]) -> Callable[[dict], Callable]:
+    regexes:[Pattern] = [ compile_regex('^%s$' % r, IGNORECASE | UNICODE) for r in key_name_regexes ]
+    pretty_regexes:str = ', '.join(list(map(lambda r: '"%s"' % r, key_name_regexes)))
+    def bind(layout_context:dict) -> Callable[[dict], bool]:
+        layout_name:str = layout_context['layout-file-name']
+        def pred(cap:dict) -> bool:
+            cond_result:bool = any(map(lambda r: r.match(cap['key']) is not None, regexes))
+            printi('%s: Checking key name "%s" entirely matches any of [ %s ]... %r', layout_name, cap['key'], pretty_regexes, cond_result)
+            return cond_result
+        return pred
+    return bind
+
+def compile_key_pos(key_pos:str) -> Callable[[dict], Callable]:
+    parsed_key_pos:dict = parse_equation(key_pos)
+    key_pos_cond:Callable[[dict], object] = compile_maths_cond(parsed_key_pos)
+    key_pos_cond_batch:Callable[[dict], object] = compile_maths_cond_batch(parsed_key_pos)
+    def bind(layout_context:dict) -> Callable[[dict], bool]:
+        layout_name:str = layout_context['layout-file-name']
+
+        # Evaluate the condition for the whole layout at once where possible, when it is first needed
+        key_indices:dict = safe_get(layout_context, 'key-indices', default={})
+        mask:ndarray = None
+        mask_computed:bool = 'key-pos-columns' not in layout_context
+        def pred(cap:dict) -> bool:
+            nonlocal mask, mask_computed
+            if not mask_computed and id(cap) in key_indices:
+                mask = key_pos_mask(key_pos_cond_batch, layout_context['key-pos-columns'])
+                mask_computed = True
+            cond_result:object = bool(mask[key_indices[id(cap)]]) if mask is not None and id(cap) in key_indices else key_pos_cond(cap)
+            printi('%s: Checking key position (%.4fu,%.4fu) satisfies condition "%s"... %r', layout_name, cap['kle-pos'].x, cap['kle-pos'].y, key_pos, cond_result)
+            return cond_result
+        return pred
+    return bind
+
+##
+# @brief Evaluate a compiled key-position condition over the columns of a layout.
+# Where NumPy would give an infinite or undefined value (such as on division by zero) or accept an operation which the per-key evaluation rejects (such as `^` on numbers), the condition is instead evaluated key by key, so that the results and errors are the same either way.
+#
+# @param key_pos_cond_batch:Callable The condition, as compiled by `compile_maths_cond_batch`
+# @param columns:dict Arrays of the position variables of each key, as output by `colour_resolver.key_pos_columns`
+#
+# @return A boolean array which holds whether the condition holds for each key, or None if it must be evaluated key by key
+def key_pos_mask(key_pos_cond_batch:Callable[[dict], object], columns:dict) -> ndarray:
+    try:
+        with errstate(all='raise'):
+            return broadcast_to(key_pos_cond_batch(columns), columns['x'].shape).astype(bool)
+    except (ArithmeticError, TypeError, ValueError) as err:
+        printi('Evaluating key position condition key by key: %s', err)
+        return None
+
+def batch_xor(c1:object, c2:object) -> object:
+    if not is_batch_bool(c1) or not is_batch_bool(c2):
+        raise TypeError('exclusive or of non-boolean values')
+    return logical_xor(c1, c2)
+
+def is_batch_bool(c:object) -> bool:
+    return type(c) in [bool, bool_] or (type(c) == ndarray and c.dtype == bool_)
+
+def compile_layout_file_cond(context_key:str, regex:str) -> Callable[[dict], bool]:
+    pattern:Pattern = compile_regex('^%s$' % regex, IGNORECASE | UNICODE)
+    def bind(layout_context:dict) -> bool:
+        cond_result:bool = pattern.match(layout_context[context_key]) is not None
+        printi('%s: Checking "%s" entirely matches "%s"... %r', layout_context['layout-file-name'], layout_context[context_key], regex, cond_result)
+        return cond_result
+    return bind
+
+def compile_implication(implication:dict) -> Callable[[dict], Union[bool, Callable]]:
+    if_binders:[Callable] = compile_conds(implication['if'])
+    then_binders:[Callable] = compile_conds(implication['then'])
+    else_binders:[Callable] = compile_conds(implication['else']) if 'else' in implication else [lambda _: True]
+    def bind(layout_context:dict) -> Union[bool, Callable]:
+        if_pred:Union[bool, Callable] = conjunction([ b(layout_context) for b in if_binders ])
+        then_pred:Union[bool, Callable] = conjunction([ b(layout_context) for b in then_binders ])
+        else_pred:Union[bool, Callable] = conjunction([ b(layout_context) for b in else_binders ])
+        if not callable(if_pred):
+            return then_pred if if_pred else else_pred
+        then_fn:Callable = then_pred if callable(then_pred) else (lambda _: then_pred)
+        else_fn:Callable = else_pred if callable(else_pred) else (lambda _: else_pred)
+        return lambda cap: then_fn(cap) if if_pred(cap) else else_fn(cap)
+    return bind
+
+def compile_junction(junction:Callable, conds:Union[bool, dict]) -> Callable[[dict], Union[bool, Callable]]:
+    binders:[Callable] = compile_conds(conds)
+    return lambda layout_context: junction([ b(layout_context) for b in binders ])
+
+##
+# @brief Combine predicates and constants with logical and, simplifying where possible
+#
+# @param preds:[Union[bool, Callable]] Predicates on keys or constant truth values
+#
+# @return A predicate on keys or a constant if the result does not depend on the key
+def conjunction(preds:[Union[bool, Callable]]) -> Union[bool, Callable]:
+    if any(map(lambda p: not callable(p) and not p, preds)):
+        return False
+    fns:[Callable] = flatten_junction(all, [ p for p in preds if callable(p) ])
+    if fns == []:
+        return True
+    elif len(fns) == 1:
+        return fns[0]
+    return make_junction(all, fns)
+
+##
+# @brief Combine predicates and constants with logical or, simplifying where possible
+#
+# @param preds:[Union[bool, Callable]] Predicates on keys or constant truth values
+#
+# @return A predicate on keys or a constant if the result does not depend on the key
+def disjunction(preds:[Union[bool, Callable]]) -> Union[bool, Callable]:
+    if any(map(lambda p: not callable(p) and p, preds)):
+        return True
+    fns:[Callable] = flatten_junction(any, [ p for p in preds if callable(p) ])
+    if fns == []:
+        return False
+    elif len(fns) == 1:
+        return fns[0]
+    return make_junction(any, fns)
+
+def negation(pred:Union[bool, Callable]) -> Union[bool, Callable]:
+    if not callable(pred):
+        return not pred
+    return lambda cap: not pred(cap)
+
+def make_junction(quantifier:Callable, fns:[Callable]) -> Callable[[dict], bool]:
+    pred:Callable = lambda cap: quantifier(map(lambda f: f(cap), fns))
+    pred.junction = (quantifier, fns)
+    return pred
+
+def flatten_junction(quantifier:Callable, fns:[Callable]) -> [Callable]:
+    return [ g for f in fns for g in (f.junction[1] if getattr(f, 'junction', (None,))[0] is quantifier else [f]) ]
 
 def sanitise_key_name(rule:dict) -> dict:
     if 'key-name' in rule and type(rule['key-name']) == str:
         rule['key-name'] = [rule['key-name']]
     return rule
 
+##
+# @brief Parse a key-position condition, parsing each distinct condition only once
+#
+# @param eq:str The condition to parse
+#
+# @return The parse tree of the condition or None if it could not be parsed
 def parse_equation(eq:str) -> dict:
+    if eq not in parsed_equations:
+        try:
+            parsed_equations[eq] = key_pos_grammar.parse_string(eq, parse_all=True)[0]
+        except ParseException as pex:
+            printe('Error while parsing "%s": %s' %(eq, str(pex)))
+            parsed_equations[eq] = None
+    return parsed_equations[eq]
+
+def make_key_pos_grammar() -> ParserElement:
     ParserElement.enablePackrat()
 
     if getrecursionlimit() < LOWER_RECURSION_LIMIT:
@@ -84,17 +295,11 @@ def parse_equation(eq:str) -> dict:
     comp = infixNotation(expr,
             [ (Literal(op), 2, opAssoc.LEFT, op_rep) for op in compops ]
         )
-    cond = infixNotation(comp,
+    return infixNotation(comp,
             [ (Literal(op), 1, opAssoc.RIGHT, op_rep) for op in logicuniops ]
             + [ (Literal(op), 2, opAssoc.LEFT, op_rep) for op in logicbinops ]
         )
 
-    try:
-        return cond.parseString(eq, parseAll=True)[0]
-    except ParseException as pex:
-        printe('Error while parsing "%s": %s' %(eq, str(pex)))
-        return None
-
 def op_rep(_1:str, _2:int, toks:List[object]) -> dict:
     toks = toks[0]
     op:str
@@ -110,6 +315,7 @@ def op_rep(_1:str, _2:int, toks:List[object]) -> dict:
         exit(1)
     return {
         'op': ops[op],
+        'batch-op': batch_ops[op],
         'pretty-op': op,
         'args': op_args,
     }
@@ -133,3 +339,7 @@ def recursively_add(old_key:str, new_key:str, f:Callable, data:object) -> object
         type(lambda:None): lambda f: f,
     }
     return rules[type(data)](data)
+
+# The grammar is the same for every condition so is built once
+key_pos_grammar:ParserElement = make_key_pos_grammar()
+parsed_equations:dict = {}
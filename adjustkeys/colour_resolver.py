@@ -1,11 +1,9 @@
 # Copyright (C) Edward Jones
 
 from .lazy_import import LazyImport
-from .log import printi
-from functools import partial
+from numpy import array, flatnonzero, float32, float64, ndarray
 from os import sep
 from os.path import basename, split, splitext
-from re import IGNORECASE, match, UNICODE
 from typing import Callable, List, Tuple, Union
 Matrix:type = LazyImport('mathutils', 'Matrix')
 Vector:type = LazyImport('mathutils', 'Vector')
@@ -15,9 +13,14 @@ def colourise_layout(layout_file_path:str, layout:[dict], colour_map:[dict]) ->
             'layout-file-path': sanitise_path(layout_file_path),
             'layout-file-name': splitext(basename(layout_file_path))[0],
         }
+    layout_context['key-pos-columns'] = key_pos_columns(layout)
+    layout_context['key-indices'] = { id(key): i for i,key in enumerate(layout) }
+
+    # Specialise the compiled rules to this layout
+    bound_colour_map:[Tuple[dict, Callable]] = [ (mapping, mapping['matcher'](layout_context)) for mapping in colour_map ] if colour_map is not None else None
     for key in layout:
-        apply_sanitised_colouring(layout_context, key, colour_map, 'cap-style', 'cap-style-raw', 'cap-style')
-        apply_sanitised_colouring(layout_context, key, colour_map, 'glyph-style', 'glyph-colour-raw', 'glyph-style')
+        apply_sanitised_colouring(key, bound_colour_map, 'cap-style', 'cap-style-raw', 'cap-style')
+        apply_sanitised_colouring(key, bound_colour_map, 'glyph-style', 'glyph-colour-raw', 'glyph-style')
     return layout
 
 def sanitise_path(path:str) -> str:
@@ -33,92 +36,91 @@ def sanitise_path(path:str) -> str:
     folders.reverse()
     return '/'.join(folders)
 
-def apply_sanitised_colouring(layout_context:dict, key:dict, colour_map:[dict], target_key:str, raw_key:str, extraction_key:str):
-    (key[target_key], key[target_key + '-rule']) = sanitise_colour(get_colouring(layout_context, key, colour_map, target_key, raw_key, extraction_key))
+def apply_sanitised_colouring(key:dict, bound_colour_map:[Tuple[dict, Callable]], target_key:str, raw_key:str, extraction_key:str):
+    (key[target_key], key[target_key + '-rule']) = sanitise_colour(get_colouring(key, bound_colour_map, target_key, raw_key, extraction_key))
 
-def get_colouring(layout_context:dict, key:dict, colour_map:[dict], target_key:str, raw_key:str, extraction_key:str) -> Tuple[str, str]:
+def get_colouring(key:dict, bound_colour_map:[Tuple[dict, Callable]], target_key:str, raw_key:str, extraction_key:str) -> Tuple[str, str]:
     if raw_key in key and key[raw_key] is not None:
         return (key[raw_key], None)
     else:
-        if colour_map is not None:
-            for mapping in colour_map:
-                if target_key in mapping and rule_match(layout_context, key, mapping):
+        if bound_colour_map is not None:
+            for mapping,matches in bound_colour_map:
+                if target_key in mapping and matches(key):
                     return (mapping[extraction_key], mapping['name'])
         return (None, None)
 
-def rule_match(layout_context:dict, key:dict, rule:dict) -> bool:
-    return all(resolve_matches(layout_context, key, rule['cond']))
-    #  key_name:str = key['key']
-    #  return any(map(lambda r: match('^' + r + '$', key_name, IGNORECASE) is not None, rule['keys']))
-
-def resolve_matches(layout_context:dict, cap:dict, rule:Union[bool, dict]) -> [bool]:
-    if type(rule) == bool:
-        return [rule]
-
-    printi_name:Callable = partial(printi, '%s:' % layout_context['layout-file-name'])
-    conds:[bool] = []
-
-    # Resolve conditions at this level
-    for statementKey in rule:
-        if statementKey.startswith('key-name'):
-            printi_name('Checking key name "%s" entirely matches any of' % cap['key'], end=' ')
-            key_name_regexes = rule['key-name'] if type(rule['key-name']) == list else [rule['key-name']]
-            printi('[ %s ]...' % ', '.join(list(map(lambda r: '"%s"' % r, key_name_regexes))), end=' ')
-            cond_result:bool = any(map(lambda r: match('^%s$' % r, cap['key'], IGNORECASE | UNICODE) is not None, key_name_regexes))
-            printi('%r' % cond_result)
-
-            conds.append(cond_result)
-        elif statementKey.startswith('key-pos'):
-            printi_name('Checking key position (%.4fu,%.4fu) satisfies condition "%s"...' % (cap['kle-pos'].x, cap['kle-pos'].y, rule['key-pos']), end=' ')
-            cond_result:bool = eval_maths_cond(cap, rule['parsed-key-pos'])
-            printi('%r' % cond_result)
-
-            conds.append(cond_result)
-        elif statementKey.startswith('layout-file-name'):
-            printi_name('Checking "%s" entirely matches "%s"...' % (layout_context['layout-file-name'], rule['layout-file-name']), end=' ')
-            cond_result:bool = match('^%s$' % rule['layout-file-name'], layout_context['layout-file-name'], IGNORECASE | UNICODE) is not None
-            printi('%r' % cond_result)
-
-            conds.append(cond_result)
-        elif statementKey.startswith('layout-file-path'):
-            printi_name('Checking "%s" entirely matches "%s"...' % (layout_context['layout-file-path'], rule['layout-file-path']), end=' ')
-            cond_result:bool = match('^%s$' % rule['layout-file-path'], layout_context['layout-file-path'], IGNORECASE | UNICODE) is not None
-            printi('%r' % cond_result)
-
-            conds.append(cond_result)
-
-        # Resolve sub-conditions
-        elif statementKey.startswith('implication'):
-            if all(resolve_matches(layout_context, cap, rule[statementKey]['if'])):
-                conds.append(all(resolve_matches(layout_context, cap, rule[statementKey]['then'])))
-            elif 'else' in rule[statementKey]:
-                conds.append(all(resolve_matches(layout_context, cap, rule[statementKey]['else'])))
-            else:
-                conds.append(True)
-        elif statementKey.startswith('any'):
-            conds.append(any(resolve_matches(layout_context, cap, rule[statementKey])))
-        elif statementKey.startswith('all'):
-            conds.append(all(resolve_matches(layout_context, cap, rule[statementKey])))
-        elif statementKey.startswith('not-all'):
-            conds.append(not all(resolve_matches(layout_context, cap, rule[statementKey])))
-        elif statementKey.startswith('not-any'):
-            conds.append(not any(resolve_matches(layout_context, cap, rule[statementKey])))
-
-    return conds
-
-def eval_maths_cond(cap:dict, pos_cond:Union[str, int, float, dict]) -> object:
-    if type(pos_cond) in [int, float]:
-        return pos_cond
+##
+# @brief Compile the parse tree of a key-position condition into a function of a key
+#
+# @param pos_cond:Union[str, int, float, dict] A parse tree as output by `colour_map_parser.parse_equation`, or None if parsing failed
+#
+# @return A function which evaluates the condition on a key
+def compile_maths_cond(pos_cond:Union[str, int, float, dict]) -> Callable[[dict], object]:
+    if type(pos_cond) in [int, float] or pos_cond is None:
+        return lambda _: pos_cond
+    elif type(pos_cond) == str:
+        return key_pos_variables[pos_cond]
+    elif type(pos_cond) == dict:
+        op:Callable = pos_cond['op']
+        args:[Callable] = list(map(compile_maths_cond, pos_cond['args']))
+        if len(args) == 1:
+            arg:Callable = args[0]
+            return lambda cap: op(arg(cap))
+        (lhs, rhs) = args
+        return lambda cap: op(lhs(cap), rhs(cap))
+
+##
+# @brief Compile the parse tree of a key-position condition into a function of the position variables of a whole layout, the counterpart of `compile_maths_cond`
+#
+# @param pos_cond:Union[str, int, float, dict] A parse tree as output by `colour_map_parser.parse_equation`, or None if parsing failed
+#
+# @return A function which takes a dictionary of the arrays of each variable and returns the value of the condition for each key (or a single value if it does not depend on the key)
+def compile_maths_cond_batch(pos_cond:Union[str, int, float, dict]) -> Callable[[dict], object]:
+    if type(pos_cond) in [int, float] or pos_cond is None:
+        return lambda _: pos_cond
     elif type(pos_cond) == str:
-        return {
-            'x': lambda: cap['kle-pos'].x,
-            'y': lambda: cap['kle-pos'].y,
-            'X': lambda: (cap['kle-pos'] + 0.5 * Matrix.Rotation(cap['rotation'], 2) @ Vector((cap['secondary-width'], cap['secondary-height']))).x,
-            'Y': lambda: (cap['kle-pos'] + 0.5 * Matrix.Rotation(cap['rotation'], 2) @ Vector((cap['secondary-width'], cap['secondary-height']))).y,
-        }[pos_cond]()
+        return lambda columns: columns[pos_cond]
     elif type(pos_cond) == dict:
-        eval_cap_cond:Callable = partial(eval_maths_cond, cap)
-        return pos_cond['op'](*tuple(map(eval_cap_cond, pos_cond['args'])))
+        op:Callable = pos_cond['batch-op']
+        args:[Callable] = list(map(compile_maths_cond_batch, pos_cond['args']))
+        if len(args) == 1:
+            arg:Callable = args[0]
+            return lambda columns: op(arg(columns))
+        (lhs, rhs) = args
+        return lambda columns: op(lhs(columns), rhs(columns))
+
+##
+# @brief Compute the position variables of every key of a layout, giving exactly the same values as `key_pos_variables`
+#
+# @param layout:[dict] The layout
+#
+# @return A dictionary of arrays of each variable, indexed by the variable name
+def key_pos_columns(layout:[dict]) -> dict:
+    # Positions are held in single precision, as mathutils does
+    kle_pos:ndarray = array([ (k['kle-pos'][0], k['kle-pos'][1]) for k in layout ], dtype=float32).reshape(-1, 2)
+    secondary_dims:ndarray = array([ (k['secondary-width'], k['secondary-height']) for k in layout ], dtype=float32).reshape(-1, 2)
+    centres:ndarray = kle_pos + float32(0.5) * secondary_dims
+
+    # Rotated keys go through mathutils as its trigonometry may round differently
+    for i in flatnonzero(array([ k['rotation'] != 0.0 for k in layout ], dtype=bool)):
+        centres[i] = tuple(key_centre(layout[i]))
+
+    return {
+        'x': kle_pos[:, 0].astype(float64),
+        'y': kle_pos[:, 1].astype(float64),
+        'X': centres[:, 0].astype(float64),
+        'Y': centres[:, 1].astype(float64),
+    }
+
+def key_centre(cap:dict) -> Vector:
+    return cap['kle-pos'] + 0.5 * Matrix.Rotation(cap['rotation'], 2) @ Vector((cap['secondary-width'], cap['secondary-height']))
+
+key_pos_variables:dict = {
+    'x': lambda cap: cap['kle-pos'].x,
+    'y': lambda cap: cap['kle-pos'].y,
+    'X': lambda cap: key_centre(cap).x,
+    'Y': lambda cap: key_centre(cap).y,
+}
 
 def sanitise_colour(colour_str:str) -> str:
     if colour_str is None:
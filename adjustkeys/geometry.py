@@ -0,0 +1,86 @@
+# Copyright (C) Edward Jones
+
+from numpy import array, column_stack, cos, float64, ndarray, sin, stack
+
+##
+# @brief Compute the positions of keys from their rotation origins, angles and offsets, as done by KLE
+#
+# @param origins:ndarray An n×2 array of rotation origins (rx, ry)
+# @param rotations:ndarray An array of n rotation angles in radians (as stored in the `rotation` field)
+# @param offsets:ndarray An n×2 array of offsets (x, y) from the rotation origin before rotating
+#
+# @return An n×2 array of key positions, origin + Rotation(-rotation) @ offset for each key
+def kle_positions(origins:ndarray, rotations:ndarray, offsets:ndarray) -> ndarray:
+    return origins + rotate(offsets, rotations)
+
+##
+# @brief Rotate each of a set of points by the negation of its corresponding angle (i.e. apply mathutils.Matrix.Rotation(-r, 2))
+#
+# @param points:ndarray An n×2 (or n×m×2) array of points
+# @param rotations:ndarray An array of n angles in radians
+#
+# @return The array of rotated points, of the same shape as `points`
+def rotate(points:ndarray, rotations:ndarray) -> ndarray:
+    c:ndarray = cos(rotations)
+    s:ndarray = sin(rotations)
+    if points.ndim == 3:
+        c = c[:, None]
+        s = s[:, None]
+    x:ndarray = points[..., 0]
+    y:ndarray = points[..., 1]
+    return stack((c * x + s * y, c * y - s * x), axis=-1)
+
+##
+# @brief Compute the corner points of the rectangles of the given dimensions placed at each key
+#
+# @param kle_pos:ndarray An n×2 array of key positions
+# @param rotations:ndarray An array of n key rotations
+# @param dims:ndarray An n×2 array of rectangle dimensions
+#
+# @return An n×4×2 array of the corners (0,0), (0,h), (w,0) and (w,h) of each rectangle after rotation and translation
+def key_corner_points(kle_pos:ndarray, rotations:ndarray, dims:ndarray) -> ndarray:
+    w:ndarray = dims[:, 0]
+    h:ndarray = dims[:, 1]
+    zero:ndarray = 0.0 * w
+    corners:ndarray = stack((
+            column_stack((zero, zero)),
+            column_stack((zero, h)),
+            column_stack((w, zero)),
+            column_stack((w, h)),
+        ), axis=1)
+    return kle_pos[:, None, :] + rotate(corners, rotations)
+
+##
+# @brief Compute the extreme points of a layout, considering both the primary and secondary rectangles of each key.
+# This method doesn't take into account extremely weird keycap shapes (which use x2, y2 keys but it should work for everything which actually exists) and which doesn't have an iso-enter in the very bottom right
+#
+# @param columns:dict Columns of the layout as output by `layout_columns`
+#
+# @return A pair of arrays, the minimum and maximum points of the layout (which always include (0,0) and (1,1) respectively)
+def layout_bounds(columns:dict) -> (ndarray, ndarray):
+    lo:ndarray = array([0.0, 0.0])
+    hi:ndarray = array([1.0, 1.0])
+    if len(columns['rotation']) == 0:
+        return (lo, hi)
+
+    points:ndarray = stack((
+            key_corner_points(columns['kle-pos'], columns['rotation'], columns['dims']),
+            key_corner_points(columns['kle-pos'], columns['rotation'], columns['secondary-dims'])
+        )).reshape(-1, 2)
+    lo = lo.clip(max=points.min(axis=0))
+    hi = hi.clip(min=points.max(axis=0))
+    return (lo, hi)
+
+##
+# @brief Gather the geometric fields of a layout into arrays
+#
+# @param layout:[Key] A parsed layout
+#
+# @return A dictionary of arrays, `kle-pos`, `dims` and `secondary-dims` are n×2, `rotation` has length n
+def layout_columns(layout:[dict]) -> dict:
+    return {
+        'kle-pos': array([ (k['kle-pos'][0], k['kle-pos'][1]) for k in layout ], dtype=float64).reshape(-1, 2),
+        'rotation': array([ k['rotation'] for k in layout ], dtype=float64),
+        'dims': array([ (k['width'], k['height']) for k in layout ], dtype=float64).reshape(-1, 2),
+        'secondary-dims': array([ (k['secondary-width'], k['secondary-height']) for k in layout ], dtype=float64).reshape(-1, 2),
+    }
@@ -2,25 +2,114 @@
 # Copyright (C) Edward Jones
 
 from .lazy_import import LazyImport
-from os.path import basename
+from .log import die, printw
+from .shared_inputs import shared_input
+from hashlib import sha1
+from json import dump, load
+from os import getpid, makedirs, replace, stat, stat_result
+from os.path import abspath, basename, dirname, exists, join, relpath
 from re import search
-from xml.dom.minidom import Document, parse
+from xml.etree.ElementTree import Element, iterparse, ParseError
 Vector:type = LazyImport('mathutils', 'Vector')
 
 numRegex:str = r'([0-9]*\.[0-9]+|[0-9]+)'
 
+# Increment when the layout of the glyph index changes
+glyph_index_format_version:int = 1
+
 def glyph_inf(gpath: str) -> dict:
-    gname: str = glyph_name(gpath)
-    gfile: Document = parse(gpath).documentElement
-    rawWidth:str = search(numRegex, gfile.attributes['width'].value).group(0)
-    rawHeight:str = search(numRegex, gfile.attributes['height'].value).group(0)
-    svg_width: float = float(rawWidth)
-    svg_height: float = float(rawHeight)
+    (svg_width, svg_height) = read_svg_dims(gpath)
+    return make_glyph_inf(gpath, svg_width, svg_height)
+
+def make_glyph_inf(gpath:str, svg_width:float, svg_height:float) -> dict:
     return {
-        'glyph': gname,
+        'glyph': glyph_name(gpath),
         'glyph-dim': Vector((float(svg_width), float(svg_height))),
         'src': gpath
     }
 
+##
+# @brief Obtain information about several glyphs in the same directory, using the dimension index of that directory in the cache to avoid reading unchanged files
+#
+# @param gpaths:[str] Paths of the glyphs to inspect
+# @param glyph_dir:str The directory which contains the glyphs
+# @param cache_dir:str Directory containing cached data or None if the cache should not be used
+#
+# @return A list of glyph information for each of `gpaths`, in the same order
+def glyph_infs(gpaths:[str], glyph_dir:str, cache_dir:str) -> [dict]:
+    index_path:str = glyph_index_path(glyph_dir, cache_dir) if cache_dir is not None else None
+    index:dict = shared_input('glyph-index', abspath(glyph_dir), lambda _: index_path, lambda: read_glyph_index(index_path) if index_path is not None else {})
+    index_changed:bool = False
+
+    infs:[dict] = []
+    for gpath in gpaths:
+        gstat:stat_result = stat(gpath)
+        entry_name:str = relpath(gpath, glyph_dir)
+        entry:dict = index.get(entry_name)
+        if entry is None or entry['mtime'] != gstat.st_mtime_ns or entry['size'] != gstat.st_size:
+            (svg_width, svg_height) = read_svg_dims(gpath)
+            entry = { 'mtime': gstat.st_mtime_ns, 'size': gstat.st_size, 'width': svg_width, 'height': svg_height }
+            index[entry_name] = entry
+            index_changed = True
+        infs.append(make_glyph_inf(gpath, entry['width'], entry['height']))
+
+    if index_changed and index_path is not None:
+        # Forget glyphs which have since been removed so that the index does not grow without bound
+        for entry_name in [ e for e in index if not exists(join(glyph_dir, e)) ]:
+            del index[entry_name]
+        write_glyph_index(index_path, index)
+
+    return infs
+
+##
+# @brief Find where the dimension index of a glyph directory is kept in the cache, named after the absolute path of the directory so that glyph directories themselves are never written to
+#
+# @param glyph_dir:str The directory which contains the glyphs
+# @param cache_dir:str Directory containing cached data
+#
+# @return The path of the index, which may not yet exist
+def glyph_index_path(glyph_dir:str, cache_dir:str) -> str:
+    return join(cache_dir, 'glyph-indices', '%s-v%d.json' % (sha1(abspath(glyph_dir).encode('utf-8')).hexdigest(), glyph_index_format_version))
+
+##
+# @brief Read the width and height of an svg without parsing more than its root element
+#
+# @param gpath:str Path to an svg file
+#
+# @return The numerical values of the width and height attributes of the root svg element
+def read_svg_dims(gpath:str) -> (float, float):
+    root:Element = None
+    with open(gpath, 'rb') as f:
+        try:
+            for _,root in iterparse(f, events=('start',)):
+                break
+        except ParseError as perr:
+            die('Failed to parse glyph "%s": %s' % (gpath, str(perr)))
+    if root is None or root.get('width') is None or root.get('height') is None:
+        die('Glyph "%s" does not specify both a width and a height in its root element' % gpath)
+    rawWidth:str = search(numRegex, root.get('width')).group(0)
+    rawHeight:str = search(numRegex, root.get('height')).group(0)
+    return (float(rawWidth), float(rawHeight))
+
+def read_glyph_index(index_path:str) -> dict:
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index:object = load(f)
+            return index if type(index) == dict else {}
+    except (OSError, ValueError):
+        return {}
+
+def write_glyph_index(index_path:str, index:dict):
+    try:
+        index_dir:str = dirname(index_path)
+        if not exists(index_dir):
+            makedirs(index_dir)
+        tmp_index_path:str = '%s.%d.tmp' % (index_path, getpid())
+        with open(tmp_index_path, 'w', encoding='utf-8') as f:
+            dump(index, f)
+        replace(tmp_index_path, index_path)
+    except OSError as oserr:
+        printw('Could not write glyph index "%s": %s' % (index_path, oserr))
+
 def glyph_name(gpath:str) -> str:
     return basename(gpath)[:-4]
@@ -0,0 +1,114 @@
+# Copyright (C) Edward Jones
+
+from .adjustcaps import get_data
+from .adjustglyphs import get_uv_image_dims, raster_cache_dir, write_uv_svg
+from .lazy_import import LazyImport
+from .log import printi
+from .path import get_temp_file_name
+from .positions import resolve_cap_position
+from .profiling import profile_stage
+from .raster import rasterise_svg_groups
+from .svg_io import SvgGroups
+from .util import safe_get
+from argparse import Namespace
+from json import dump
+from os import makedirs, remove
+from os.path import abspath, basename, exists, join, splitext
+Vector:type = LazyImport('mathutils', 'Vector')
+
+# Increment when the format of the placement manifest changes
+manifest_format_version:int = 1
+
+# Scalar properties of each key copied into the manifest where present
+manifest_key_fields:[str] = ['key', 'cap-name', 'cap-source', 'glyph', 'src', 'rotation', 'width', 'height', 'secondary-width', 'secondary-height', 'key-type', 'cap-style', 'glyph-style']
+
+# Vector properties of each key copied into the manifest where present
+manifest_key_vector_fields:[str] = ['kle-pos', 'margin-offset', 'cap-pos', 'glyph-dim', 'glyph-offset', 'glyph-pos']
+
+
+##
+# @brief Produce the outputs of a run which do not need Blender: the uv image of the layout and a manifest of where each key and glyph is placed.
+# These may be computed on machines without Blender, leaving only the keycap models to be made within it.
+#
+# @param layout:[dict] Coloured layout of the keys
+# @param profile_data:dict Data about the keycap profile used
+# @param layout_min_point:Vector The minimum point of the layout
+# @param layout_max_point:Vector The maximum point of the layout
+# @param glyph_map:dict Map of keys to glyphs
+# @param pargs:Namespace Parsed arguments
+#
+# @return A dictionary of the paths of the files written
+def headless_adjustkeys(layout:[dict], profile_data:dict, layout_min_point:Vector, layout_max_point:Vector, glyph_map:dict, pargs:Namespace) -> dict:
+    out_dir:str = pargs.headless_out if pargs.headless_out not in ['None', ''] else '.'
+    if not exists(out_dir):
+        makedirs(out_dir)
+    out_name:str = splitext(basename(pargs.layout_file))[0]
+
+    # Margins are taken from the keycap models so glyphs sit where they would on the caps made in Blender
+    glyph_layout:[dict] = layout
+    if pargs.adjust_caps:
+        with profile_stage('cap-import'):
+            glyph_layout = get_data(layout, pargs.cap_dir, pargs.cache_dir if pargs.use_cache else None, None, None, profile_data)
+        for cap in glyph_layout:
+            resolve_cap_position(cap, profile_data['unit-length'])
+
+    dump_svg:bool = pargs.dump_uv_svg not in ['None', '']
+    svg_path:str = pargs.dump_uv_svg if dump_svg else get_temp_file_name()
+    svg_groups:SvgGroups
+    svg_dims:Vector
+    placed_glyphs:[dict]
+    with profile_stage('svg-build'):
+        (svg_groups, svg_dims, placed_glyphs) = write_uv_svg(glyph_layout, profile_data, layout_min_point, layout_max_point, glyph_map, svg_path, pargs)
+    if dump_svg:
+        printi('Wrote uv svg to "%s"', svg_path)
+
+    uv_dims:Vector = get_uv_image_dims(layout_min_point, layout_max_point, pargs.uv_res, pargs.partition_uv_by_face_direction)
+    uv_image_path:str = None
+    try:
+        if pargs.adjust_glyphs or pargs.apply_colour_map:
+            uv_image_path = abspath(join(out_dir, out_name + '_uv_image.png'))
+            with svg_groups:
+                with profile_stage('rasterise'):
+                    rasterise_svg_groups(svg_groups, svg_groups.bounds, (svg_dims.x, svg_dims.y), (int(uv_dims.x), int(uv_dims.y)), uv_image_path, pargs.uv_tile_size, pargs.raster_workers, pargs.rasteriser, raster_cache_dir(pargs))
+            printi('Wrote uv image to "%s"', uv_image_path)
+    finally:
+        if not dump_svg:
+            remove(svg_path)
+
+    manifest_path:str = abspath(join(out_dir, out_name + '_manifest.json'))
+    with profile_stage('manifest'):
+        manifest:dict = {
+            'format-version': manifest_format_version,
+            'layout-file': pargs.layout_file,
+            'uv-image-path': uv_image_path,
+            'uv-image-dims': [int(uv_dims.x), int(uv_dims.y)],
+            'uv-svg-dims': vector_list(svg_dims),
+            'layout-min-point': vector_list(layout_min_point),
+            'layout-max-point': vector_list(layout_max_point),
+            'unit-length': profile_data['unit-length'],
+            'scale': profile_data['scale'],
+            'glyph-unit-length': pargs.glyph_unit_length,
+            'partition-uv-by-face-direction': pargs.partition_uv_by_face_direction,
+            'keys': [ manifest_key(glyph, bounds) for glyph,bounds in zip(placed_glyphs, svg_groups.bounds.tolist()) ],
+        }
+        with open(manifest_path, 'w') as f:
+            dump(manifest, f, indent=2)
+    printi('Wrote placement manifest to "%s"', manifest_path)
+
+    return { 'uv-image-path': uv_image_path, 'manifest-path': manifest_path }
+
+##
+# @brief Describe the placement of a key for the manifest
+#
+# @param glyph:dict A placed glyph, as output by `write_uv_svg`
+# @param bounds:[float] The bounds (xmin, ymin, xmax, ymax) in svg units of the content drawn for the key
+#
+# @return A dictionary which can be serialised as json
+def manifest_key(glyph:dict, bounds:[float]) -> dict:
+    key:dict = { f: glyph[f] for f in manifest_key_fields if safe_get(glyph, f) is not None }
+    key.update({ f: vector_list(glyph[f]) for f in manifest_key_vector_fields if f in glyph })
+    key['svg-bounds'] = bounds
+    return key
+
+def vector_list(v:Vector) -> [float]:
+    return list(map(float, v))
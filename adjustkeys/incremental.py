@@ -0,0 +1,147 @@
+# Copyright (C) Edward Jones
+
+from .adjustcaps import adjust_caps, get_placed_caps
+from .adjustglyphs import adjust_glyphs
+from .blender_available import blender_available
+from .lazy_import import LazyImport
+from .log import printi
+from .mesh_cache import file_hash
+from .path import dir_state
+from .util import dict_union, safe_get
+from argparse import Namespace
+from hashlib import sha1
+from os.path import exists, isdir
+Collection:type = None
+Mesh:type = None
+Object:type = None
+if blender_available():
+    from bpy.types import Collection, Mesh, Object
+    data = LazyImport('bpy', 'data')
+Vector:type = LazyImport('mathutils', 'Vector')
+ShaderNodeTexImage:type = LazyImport('bpy', 'types', 'ShaderNodeTexImage')
+
+# The fingerprint and result of each stage of the last incremental run in this session
+previous_stages:dict = {}
+
+# Inputs shared by the incremental runs in this session (see `shared_inputs.sharing_inputs`)
+session_inputs:dict = {}
+
+# Options and paths which affect the keycap models
+caps_stage_options:[str] = ['adjust_caps', 'adjust_glyphs', 'apply_colour_map', 'link_caps', 'partition_uv_by_face_direction', 'use_existing_materials']
+caps_stage_paths:[str] = ['cap_dir', 'layout_file']
+
+# Options and paths which affect the uv image
+uv_image_stage_options:[str] = ['adjust_caps', 'adjust_glyphs', 'alignment', 'apply_colour_map', 'glyph_part_ignore_regex', 'glyph_unit_length', 'iso_enter_glyph_pos', 'partition_uv_by_face_direction', 'rasteriser', 'uv_res']
+uv_image_stage_paths:[str] = ['cap_dir', 'colour_map_file', 'glyph_dir', 'glyph_map_file', 'layout_file', 'uv_image_file']
+
+
+##
+# @brief Make the keycap models as `adjust_caps` does, unless the options and files which affect them are unchanged since the last incremental run and its models still exist, in which case they are reused.
+# Models of the last run which are not reused are removed.
+# As the colours of the keys do not affect the models, the keys given for glyph alignment are joined afresh from the current layout so that they hold its colours rather than those of the last run.
+#
+# @return The result of `adjust_caps` for the current options
+def incremental_adjust_caps(layout:[dict], colour_map:[dict], profile_data:dict, collection:Collection, layout_min_point:Vector, layout_max_point:Vector, pargs:Namespace) -> dict:
+    fingerprint:str = stage_fingerprint(pargs, caps_stage_options, caps_stage_paths)
+    if 'adjust-caps' in previous_stages:
+        previous:tuple = previous_stages.pop('adjust-caps')
+        (previous_fingerprint, previous_model_data, previous_model_name) = previous
+        if previous_fingerprint == fingerprint and models_exist(previous_model_data, previous_model_name):
+            printi('Keycap models are unchanged since the last run, reusing them')
+            previous_stages['adjust-caps'] = previous
+            return dict_union(previous_model_data, { '~caps-with-margin-offsets': get_placed_caps(layout, colour_map, profile_data, collection, pargs) })
+        remove_models(previous_model_data, previous_model_name)
+    model_data:dict = adjust_caps(layout, colour_map, profile_data, collection, layout_min_point, layout_max_point, pargs)
+    previous_stages['adjust-caps'] = (fingerprint, model_data, models_name(model_data))
+    return model_data
+
+##
+# @brief Make and apply the uv image as `adjust_glyphs` does, reusing that of the last incremental run if the options and files which affect it are unchanged.
+# The image is not touched if it is already shown by the image node, and is loaded without being made again if the node is new.
+#
+# @return The result of `adjust_glyphs` for the current options
+def incremental_adjust_glyphs(layout:[dict], profile_data:dict, model_name:str, layout_min_point:Vector, layout_max_point:Vector, collection:Collection, glyph_map:dict, imgNode:ShaderNodeTexImage, uv_image_path:str, uv_material_name:str, pargs:Namespace) -> dict:
+    fingerprint:str = stage_fingerprint(pargs, uv_image_stage_options, uv_image_stage_paths)
+    previous:tuple = previous_stages.pop('adjust-glyphs', None)
+    if previous is not None:
+        (previous_fingerprint, previous_uv_image_path, previous_glyph_data) = previous
+        if previous_fingerprint == fingerprint and previous_uv_image_path is not None and exists(previous_uv_image_path):
+            if imgNode.image is not None and imgNode.image.filepath == previous_uv_image_path:
+                printi('UV image is unchanged since the last run')
+            else:
+                printi('UV image is unchanged since the last run, reloading it')
+                adjust_glyphs(layout, profile_data, model_name, layout_min_point, layout_max_point, collection, glyph_map, imgNode, uv_image_path, uv_material_name, Namespace(**dict(pargs.__dict__, uv_image_file=previous_uv_image_path)))
+            previous_stages['adjust-glyphs'] = previous
+            return previous_glyph_data
+    glyph_data:dict = adjust_glyphs(layout, profile_data, model_name, layout_min_point, layout_max_point, collection, glyph_map, imgNode, uv_image_path, uv_material_name, pargs)
+    previous_stages['adjust-glyphs'] = (fingerprint, safe_get(glyph_data, 'uv-image-path', default=uv_image_path), glyph_data)
+    return glyph_data
+
+##
+# @brief Compute a fingerprint of the inputs of a stage
+#
+# @param pargs:Namespace Parsed arguments
+# @param options:[str] Names of the options which affect the stage
+# @param paths:[str] Names of the options which hold paths to files or directories read by the stage
+#
+# @return A string which changes if any of the given options or the contents of any of the given files change
+def stage_fingerprint(pargs:Namespace, options:[str], paths:[str]) -> str:
+    h = sha1()
+    for option in options:
+        h.update(('%s=%r\n' % (option, getattr(pargs, option))).encode('utf-8'))
+    for path in paths:
+        h.update(('%s=%s\n' % (path, path_fingerprint(getattr(pargs, path)))).encode('utf-8'))
+    return h.hexdigest()
+
+##
+# @brief Compute a fingerprint of a file or directory, using the contents of a file or the sizes and modification times of the files in a directory
+#
+# @param path:str Path of the file or directory
+#
+# @return A string which changes when the file or directory changes
+def path_fingerprint(path:str) -> str:
+    if path in ['None', ''] or not exists(path):
+        return 'missing'
+    elif isdir(path):
+        return ' '.join(map(lambda f: '%s:%s:%s' % f, dir_state(path)))
+    return file_hash(path)
+
+##
+# @brief Find the name of the collection (if linked) or object (if joined) which holds the models made by a run, which may differ from that intended if the name was taken
+#
+# @param model_data:dict The result of `adjust_caps` for the run
+#
+# @return The name, or None if no models were made
+def models_name(model_data:dict) -> str:
+    if safe_get(model_data, 'keycaps-collection') is not None:
+        return model_data['keycaps-collection'].name
+    elif safe_get(model_data, 'keycaps-model') is not None:
+        return model_data['keycaps-model'].name
+    return None
+
+def models_exist(model_data:dict, model_name:str) -> bool:
+    if safe_get(model_data, 'keycaps-collection') is not None:
+        return model_name in data.collections
+    return safe_get(model_data, 'keycaps-model') is not None and model_name in data.objects
+
+##
+# @brief Remove the keycap models made by a run, if they still exist
+#
+# @param model_data:dict The result of `adjust_caps` for the run
+# @param model_name:str The name of the models, as given by `models_name` when they were made
+#
+# @return Nothing
+def remove_models(model_data:dict, model_name:str):
+    if safe_get(model_data, 'keycaps-collection') is not None and model_name in data.collections:
+        printi('Removing keycap models of the last run')
+        model_collection:Collection = data.collections[model_name]
+        for obj in list(model_collection.objects):
+            data.objects.remove(obj)
+        data.collections.remove(model_collection)
+    elif safe_get(model_data, 'keycaps-model') is not None and model_name in data.objects:
+        printi('Removing keycap model of the last run')
+        model:Object = data.objects[model_name]
+        model_mesh:Mesh = model.data
+        data.objects.remove(model)
+        if model_mesh.users == 0:
+            data.meshes.remove(model_mesh)
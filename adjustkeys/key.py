@@ -0,0 +1,103 @@
+# Copyright (C) Edward Jones
+
+from collections.abc import MutableMapping
+
+# Fields which are known to the pipeline, stored in slots rather than a per-key dictionary
+key_fields:[str] = [
+    'key', 'cap-name', 'key-type',
+    'kle-pos', 'rotation', 'r', 'rx', 'ry', 'shift-x', 'shift-y',
+    'width', 'height', 'secondary-width', 'secondary-height',
+    'homing', 'stepped', 'profile-part',
+    'cap-style-raw', 'glyph-colour-raw', 'cap-style', 'cap-style-rule', 'glyph-style', 'glyph-style-rule',
+    'cap-source', 'cap-mesh', 'cap-matrix', 'cap-obj', 'cap-obj-name', 'cap-pos', 'margin-offset',
+    'glyph', 'src', 'glyph-dim', 'glyph-offset', 'glyph-pos', 'p-off-x', 'p-off-y', 'svg', 'vector', 'vector-bounds',
+]
+key_field_attrs:dict = { f: f.replace('-', '_') for f in key_fields }
+
+
+##
+# @brief Compact record of a single key in a layout.
+# Fields in `key_fields` are held in slots and anything else (for example, unrecognised KLE properties) is held in a small dictionary.
+# Keys behave as dictionaries indexed by the usual hyphenated names, so colour-map rules and the returned data are unaffected.
+class Key(MutableMapping):
+    __slots__ = tuple(key_field_attrs.values()) + ('extras',)
+
+    def __init__(self, *args, **kwargs):
+        self.extras:dict = None
+        if args or kwargs:
+            self.update(*args, **kwargs)
+
+    def __getitem__(self, k:object) -> object:
+        attr:str = key_field_attrs.get(k)
+        if attr is not None:
+            try:
+                return getattr(self, attr)
+            except AttributeError:
+                raise KeyError(k)
+        if self.extras is not None and k in self.extras:
+            return self.extras[k]
+        raise KeyError(k)
+
+    def __setitem__(self, k:object, v:object):
+        attr:str = key_field_attrs.get(k)
+        if attr is not None:
+            setattr(self, attr, v)
+        else:
+            if self.extras is None:
+                self.extras = {}
+            self.extras[k] = v
+
+    def __delitem__(self, k:object):
+        attr:str = key_field_attrs.get(k)
+        if attr is not None:
+            try:
+                delattr(self, attr)
+                return
+            except AttributeError:
+                raise KeyError(k)
+        if self.extras is not None and k in self.extras:
+            del self.extras[k]
+        else:
+            raise KeyError(k)
+
+    def __contains__(self, k:object) -> bool:
+        attr:str = key_field_attrs.get(k)
+        if attr is not None:
+            return hasattr(self, attr)
+        return self.extras is not None and k in self.extras
+
+    def __iter__(self):
+        for f, attr in key_field_attrs.items():
+            if hasattr(self, attr):
+                yield f
+        if self.extras is not None:
+            yield from self.extras
+
+    def __len__(self) -> int:
+        return sum(map(lambda attr: hasattr(self, attr), key_field_attrs.values())) + (len(self.extras) if self.extras is not None else 0)
+
+    def get(self, k:object, default:object=None) -> object:
+        attr:str = key_field_attrs.get(k)
+        if attr is not None:
+            return getattr(self, attr, default)
+        return self.extras.get(k, default) if self.extras is not None else default
+
+    def update(self, *args, **kwargs):
+        for other in args + (kwargs,):
+            for k, v in (other.items() if hasattr(other, 'items') else other):
+                self[k] = v
+
+    def copy(self) -> 'Key':
+        ret:Key = Key()
+        for attr in key_field_attrs.values():
+            if hasattr(self, attr):
+                setattr(ret, attr, getattr(self, attr))
+        if self.extras is not None:
+            ret.extras = dict(self.extras)
+        return ret
+
+    def __reduce__(self) -> tuple:
+        return (Key, (dict(self.items()),))
+
+    def __repr__(self) -> str:
+        return 'Key(%s)' % repr(dict(self.items()))
@@ -1,27 +1,29 @@
 # Copyright (C) Edward Jones
 
-from .log import die, printi, printw
+from .geometry import kle_positions, layout_bounds, layout_columns
+from .log import die, printi, printi_enabled, printw
 from .input_types import type_check_kle_layout
+from .key import Key
 from .lazy_import import LazyImport
-from .util import dict_union, key_subst, rem, safe_get
+from .util import safe_get
 from .yaml_io import read_yaml
-from math import cos, radians, sin
+from math import radians
+from numpy import array, ndarray
 from types import SimpleNamespace
 from re import match
 
-Matrix:type = LazyImport('mathutils', 'Matrix')
 Vector:type = LazyImport('mathutils', 'Vector')
 
 cap_deactivation_colour:str = '#cccccc'
 glyph_deactivation_colour:str = '#000000'
 
-def get_layout(layout_file:str, profile_data:dict, use_deactivation_colour:bool) -> [dict]:
+def get_layout(layout_file:str, profile_data:dict, use_deactivation_colour:bool) -> [Key]:
     return parse_layout(read_yaml(layout_file), profile_data, use_deactivation_colour)
 
-def dumb_parse_layout(layout:[[dict]]) -> [dict]:
+def dumb_parse_layout(layout:[[dict]]) -> [Key]:
     return parse_layout(layout, None, True)
 
-def parse_layout(layout: [[dict]], profile_data:dict, use_deactivation_colour:bool) -> [dict]:
+def parse_layout(layout: [[dict]], profile_data:dict, use_deactivation_colour:bool) -> [Key]:
     if not type_check_kle_layout(layout):
         die('KLE layout failed type-checking, see console for more information')
     printi('Reading layout information')
@@ -33,7 +35,8 @@ def parse_layout(layout: [[dict]], profile_data:dict, use_deactivation_colour:bo
 
     profile_row_map:dict = safe_get(profile_data, 'profile-row-map')
 
-    parsed_layout: [dict] = []
+    parsed_layout: [Key] = []
+    parsed_layout_placements:[tuple] = []
     parser_default_state_dict:dict = {
             'c': cap_deactivation_colour if not use_deactivation_colour else None,
             't': glyph_deactivation_colour if not use_deactivation_colour else None,
@@ -53,11 +56,12 @@ def parse_layout(layout: [[dict]], profile_data:dict, use_deactivation_colour:bo
             continue
         while parser_state.i < len(line):
             # Parse for the next key
-            printi('Handling layout, looking at pair "%s" and "%s"' %
-                   (str(line[parser_state.i]).replace('\n', '\\n'),
-                    str(safe_get(line, parser_state.i + 1)).replace('\n', '\\n')))
+            if printi_enabled():
+                printi('Handling layout, looking at pair "%s" and "%s"',
+                       str(line[parser_state.i]).replace('\n', '\\n'),
+                       str(safe_get(line, parser_state.i + 1)).replace('\n', '\\n'))
             (shift, line[parser_state.i]) = parse_key(line[parser_state.i], safe_get(line, parser_state.i + 1), parser_state, profile_row_map)
-            key: dict = line[parser_state.i]
+            key: Key = line[parser_state.i]
 
             # Handle colour changes
             parser_state.c = key['cap-style-raw']
@@ -83,24 +87,20 @@ def parse_layout(layout: [[dict]], profile_data:dict, use_deactivation_colour:bo
             parser_state.r = key['rotation']
             if 'r' in key or 'rx' in key or 'ry' in key:
                 if 'rx' in key:
-                    parser_state.rx = key['rx']
-                    key = rem(key, 'rx')
+                    parser_state.rx = key.pop('rx')
                 else:
                     parser_state.rx = -key['shift-x'] if 'shift-x' in key else 0.0
                 if 'ry' in key:
-                    parser_state.ry = key['ry']
-                    key = rem(key, 'ry')
+                    parser_state.ry = key.pop('ry')
                 else:
                     parser_state.ry = -key['shift-y'] if 'shift-y' in key else 0.0
                 parser_state.x = key['shift-x'] if 'shift-x' in key else 0.0
                 parser_state.y = key['shift-y'] if 'shift-y' in key else 0.0
 
-            # Apply current position data
-            key['kle-pos'] = Vector((parser_state.rx, parser_state.ry)) + Matrix.Rotation(-parser_state.r, 2) @ Vector((parser_state.x, parser_state.y))
-
-            # Add to layout
+            # Add to layout, noting current position data
             if 'key' in key and (not 'd' in key or not key['d']):
                 parsed_layout += [key]
+                parsed_layout_placements.append((parser_state.rx, parser_state.ry, parser_state.r, parser_state.x, parser_state.y))
 
             # Move col to next position
             parser_state.x += key['width']
@@ -110,20 +110,24 @@ def parse_layout(layout: [[dict]], profile_data:dict, use_deactivation_colour:bo
         if len(line) > 1 and 'shift-y' not in line[-1]:
             parser_state.y += 1
 
+    # Apply position data to all keys at once
+    placements:ndarray = array(parsed_layout_placements, dtype=float).reshape(-1, 5)
+    for key,kle_pos in zip(parsed_layout, kle_positions(placements[:, 0:2], placements[:, 2], placements[:, 3:5]).tolist()):
+        key['kle-pos'] = Vector(kle_pos)
+
     return list(map(add_cap_name, parsed_layout))
 
-def parse_key(key: 'either str dict', nextKey: 'maybe (either str dict)', parser_state:SimpleNamespace, profile_row_map:dict) -> [int, dict]:
-    ret: dict
+def parse_key(key: 'either str dict', nextKey: 'maybe (either str dict)', parser_state:SimpleNamespace, profile_row_map:dict) -> [int, Key]:
+    ret: Key
     shift: int = 1
 
     if type(key) == str:
-        ret = {'key': parse_name(key)}
+        ret = Key(key=parse_name(key))
     elif type(key) == dict:
+        ret = Key(key)
         if nextKey is not None and type(nextKey) == str:
-            ret = dict_union(key, {'key': parse_name(nextKey)})
+            ret['key'] = parse_name(nextKey)
             shift = 2
-        else:
-            ret = dict(key)
     else:
         die('Malformed data when reading %s and %s' % (str(key), str(nextKey)))
 
@@ -145,34 +149,34 @@ def parse_key(key: 'either str dict', nextKey: 'maybe (either str dict)', parser
             ret['key-type'] = 'num-enter'
 
     if 'a' in ret:
-        ret = rem(ret, 'a')
+        del ret['a']
 
     if 'x' in ret:
-        ret = key_subst(ret, 'x', 'shift-x')
+        ret['shift-x'] = ret.pop('x')
     if 'y' in ret:
-        ret = key_subst(ret, 'y', 'shift-y')
+        ret['shift-y'] = ret.pop('y')
     if 'c' in ret:
-        ret = key_subst(ret, 'c', 'cap-style-raw')
+        ret['cap-style-raw'] = ret.pop('c')
     else:
         ret['cap-style-raw'] = parser_state.c
     if 't' in ret:
-        ret = key_subst(ret, 't', 'glyph-colour-raw')
+        ret['glyph-colour-raw'] = ret.pop('t')
     else:
         ret['glyph-colour-raw'] = parser_state.t
     if 'w' in ret:
-        ret = key_subst(ret, 'w', 'width')
+        ret['width'] = ret.pop('w')
     else:
         ret['width'] = 1.0
     if 'w2' in ret:
-        ret = key_subst(ret, 'w2', 'secondary-width')
+        ret['secondary-width'] = ret.pop('w2')
     else:
         ret['secondary-width'] = ret['width']
     if 'h' in ret:
-        ret = key_subst(ret, 'h', 'height')
+        ret['height'] = ret.pop('h')
     else:
         ret['height'] = 1.0
     if 'h2' in ret:
-        ret = key_subst(ret, 'h2', 'secondary-height')
+        ret['secondary-height'] = ret.pop('h2')
     else:
         ret['secondary-height'] = ret['height']
     if 'r' in ret:
@@ -181,11 +185,11 @@ def parse_key(key: 'either str dict', nextKey: 'maybe (either str dict)', parser
     else:
         ret['rotation'] = parser_state.r
     if 'n' in ret:
-        ret = key_subst(ret, 'n', 'homing')
+        ret['homing'] = ret.pop('n')
     else:
         ret['homing'] = False
     if 'l' in ret:
-        ret = key_subst(ret, 'l', 'stepped')
+        ret['stepped'] = ret.pop('l')
     else:
         ret['stepped'] = False
     if 'p' in ret and ret['p']:
@@ -194,7 +198,7 @@ def parse_key(key: 'either str dict', nextKey: 'maybe (either str dict)', parser
                 ret['p'] = profile_row_map[ret['p']]
             else:
                 printw('Profile row map does not contain key "%s" (this message appears once for each key which uses this profile)' % ret['p'])
-        ret = key_subst(ret, 'p', 'profile-part')
+        ret['profile-part'] = ret.pop('p')
     else:
         ret['profile-part'] = parser_state.p
 
@@ -210,11 +214,11 @@ def parse_name(txt: str) -> str:
     return '-'.join(txt.split('\n'))
 
 
-def add_cap_name(key:dict) -> dict:
+def add_cap_name(key:Key) -> Key:
     key['cap-name'] = gen_cap_name(key)
     return key
 
-def gen_cap_name(key:dict) -> str:
+def gen_cap_name(key:Key) -> str:
     if 'key-type' in key:
         return key['key-type']
     else:
@@ -227,32 +231,6 @@ def gen_cap_name(key:dict) -> str:
             name += '-bar'
         return name
 
-def compute_layout_dims(layout:[dict]) -> Vector:
-    def point_enumerator(v:Vector) -> Matrix:
-        return Matrix([
-            (0.0, 0.0,  v[0], v[0]),
-            (0.0, v[1], 0.0,  v[1])
-        ])
-
-    # Initial extreme values
-    xmin = 0.0
-    ymin = 0.0
-    xmax = 1.0
-    ymax = 1.0
-
-    for cap in layout:
-        rot:Matrix = Matrix.Rotation(-cap['rotation'], 2)
-        primary_dims:Vector = Vector((cap['width'], cap['height']))
-        secondary_dims:Vector = Vector((cap['secondary-width'], cap['secondary-height']))
-        kle_pos_mat:Matrix = Matrix([[cap['kle-pos'][0]] * 4, [cap['kle-pos'][1]] * 4])
-
-        # This method doesn't take into account extremely weird keycap shapes (which use x2, y2 keys but it should work for everything which actually exists) and which doesn't have an iso-enter in the very bottom right
-        primary_points:Matrix = kle_pos_mat + rot @ point_enumerator(primary_dims)
-        secondary_points:Matrix = kle_pos_mat + rot @ point_enumerator(secondary_dims)
-
-        xmin = min(xmin, *primary_points[0], *secondary_points[0])
-        ymin = min(ymin, *primary_points[1], *secondary_points[1])
-        xmax = max(xmax, *primary_points[0], *secondary_points[0])
-        ymax = max(ymax, *primary_points[1], *secondary_points[1])
-
-    return (Vector((xmin, ymin)), Vector((xmax, ymax)))
+def compute_layout_dims(layout:[Key]) -> (Vector, Vector):
+    (lo, hi) = layout_bounds(layout_columns(layout))
+    return (Vector(lo.tolist()), Vector(hi.tolist()))
@@ -48,15 +48,25 @@ def die(*args, **kwargs):
 
 
 ##
-# @brief Output information to stderr
+# @brief Output information to stderr.
+# Formatting is deferred until the message is known to be shown, so calls are cheap when output is disabled: pass the values to insert as arguments (as in `printi('Adjusting %s', name)`) rather than formatting them beforehand.
 #
-# @param args Message things
-# @param kwargs More message things
+# @param msg:str Message, a format string if any args are given
+# @param args Values to insert into the message
+# @param kwargs Keyword arguments to print
 #
 # @return Nothing
-def printi(*args, **kwargs):
-    if verbosity >= 2:
-        print(*args, file=stderr, **kwargs)
+def printi(msg:str, *args, **kwargs):
+    if verbosity < 2:
+        return
+    print(msg % args if args else msg, file=stderr, **kwargs)
+
+##
+# @brief Check whether informational output is shown, to guard the preparation of expensive messages
+#
+# @return True if and only if printi produces output
+def printi_enabled() -> bool:
+    return verbosity >= 2
 
 
 ##
@@ -0,0 +1,153 @@
+# Copyright (C) Edward Jones
+
+from .log import die
+from importlib.util import find_spec
+from math import cos, sin
+from numpy import array, diag, eye, float32, ndarray, ones
+from numbers import Real
+from sys import modules
+from typing import Iterator
+
+##
+# @brief Make `mathutils` importable outside of Blender by substituting this module for it, if it is not already installed
+#
+# @return Nothing
+def install_mathutils_shim():
+    if 'mathutils' not in modules and find_spec('mathutils') is None:
+        modules['mathutils'] = modules[__name__]
+
+##
+# @brief Stand-in for mathutils.Vector which holds single-precision coordinates in a NumPy array, supporting the operations used outside of mesh handling
+class Vector:
+    def __init__(self, seq:object=(0.0, 0.0, 0.0)):
+        self.v:ndarray = array(seq, dtype=float32).ravel()
+
+    @property
+    def x(self) -> float:
+        return float(self.v[0])
+
+    @property
+    def y(self) -> float:
+        return float(self.v[1])
+
+    @property
+    def z(self) -> float:
+        return float(self.v[2])
+
+    def __len__(self) -> int:
+        return len(self.v)
+
+    def __getitem__(self, i:int) -> float:
+        return float(self.v[i])
+
+    def __iter__(self) -> Iterator:
+        return iter(map(float, self.v))
+
+    def __add__(self, other:'Vector') -> 'Vector':
+        return Vector(self.v + other.v)
+
+    def __sub__(self, other:'Vector') -> 'Vector':
+        return Vector(self.v - other.v)
+
+    def __neg__(self) -> 'Vector':
+        return Vector(-self.v)
+
+    def __mul__(self, k:Real) -> 'Vector':
+        if not isinstance(k, Real):
+            return NotImplemented
+        return Vector(float32(k) * self.v)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, k:Real) -> 'Vector':
+        return Vector(self.v / float32(k))
+
+    def __matmul__(self, other:'Vector') -> float:
+        return float(self.v @ other.v)
+
+    def __eq__(self, other:object) -> bool:
+        return isinstance(other, Vector) and len(self.v) == len(other.v) and bool((self.v == other.v).all())
+
+    def to_tuple(self) -> tuple:
+        return tuple(self)
+
+    def __repr__(self) -> str:
+        return 'Vector((%s))' % ', '.join(map(lambda c: '%.4f' % c, self))
+
+##
+# @brief Stand-in for mathutils.Matrix which holds a single-precision square matrix in a NumPy array, supporting the operations used outside of mesh handling
+class Matrix:
+    def __init__(self, rows:object=eye(4)):
+        self.m:ndarray = array(rows, dtype=float32)
+
+    @staticmethod
+    def Identity(size:int) -> 'Matrix':
+        return Matrix(eye(size))
+
+    @staticmethod
+    def Diagonal(vector:object) -> 'Matrix':
+        return Matrix(diag(array(tuple(vector), dtype=float32)))
+
+    @staticmethod
+    def Scale(factor:float, size:int, axis:object=None) -> 'Matrix':
+        if axis is not None:
+            die('Scaling along an axis is not supported without Blender')
+        scale:ndarray = factor * ones(size)
+        if size == 4:
+            scale[3] = 1.0
+        return Matrix(diag(scale))
+
+    @staticmethod
+    def Rotation(angle:float, size:int, axis:str=None) -> 'Matrix':
+        c:float = cos(angle)
+        s:float = sin(angle)
+        if size == 2:
+            return Matrix(((c, -s), (s, c)))
+        rot:ndarray
+        if axis == 'X':
+            rot = array(((1.0, 0.0, 0.0), (0.0, c, -s), (0.0, s, c)))
+        elif axis == 'Y':
+            rot = array(((c, 0.0, s), (0.0, 1.0, 0.0), (-s, 0.0, c)))
+        elif axis == 'Z':
+            rot = array(((c, -s, 0.0), (s, c, 0.0), (0.0, 0.0, 1.0)))
+        else:
+            die('Rotation about "%s" is not supported without Blender' % str(axis))
+        ret:ndarray = eye(size)
+        ret[:3, :3] = rot
+        return Matrix(ret)
+
+    @staticmethod
+    def Translation(vector:object) -> 'Matrix':
+        ret:ndarray = eye(4)
+        ret[:3, 3] = tuple(vector)
+        return Matrix(ret)
+
+    def __len__(self) -> int:
+        return len(self.m)
+
+    def __getitem__(self, i:int) -> Vector:
+        return Vector(self.m[i])
+
+    def __matmul__(self, other:object) -> object:
+        if isinstance(other, Matrix):
+            return Matrix(self.m @ other.m)
+        elif isinstance(other, Vector):
+            if len(other.v) == len(self.m) - 1:
+                # Vectors are extended with a unit coordinate to be transformed by a larger matrix, as by mathutils
+                return Vector((self.m[:-1, :-1] @ other.v) + self.m[:-1, -1])
+            return Vector(self.m @ other.v)
+        return NotImplemented
+
+    def __mul__(self, k:Real) -> 'Matrix':
+        if not isinstance(k, Real):
+            return NotImplemented
+        return Matrix(float32(k) * self.m)
+
+    __rmul__ = __mul__
+
+    def inverted(self) -> 'Matrix':
+        from numpy.linalg import inv
+        return Matrix(inv(self.m))
+
+    def __repr__(self) -> str:
+        return 'Matrix((%s))' % ', '.join(map(lambda r: '(%s)' % ', '.join(map(lambda c: '%.4f' % c, r)), self.m))
@@ -0,0 +1,71 @@
+# Copyright (C) Edward Jones
+
+from numpy import array, concatenate, cumsum, einsum, float32, float64, int32, ndarray, zeros
+from numpy.linalg import inv, norm
+
+##
+# @brief Combine copies of several meshes, each placed by an affine transform, into the arrays of a single mesh
+#
+# @param meshes:[dict] Mesh arrays (as output by `mesh_cache.extract_mesh_data`) of each copy, the same dictionary may be given several times
+# @param matrices:[object] A 4×4 transformation matrix for each copy
+#
+# @return A dictionary of mesh arrays in the same form as the input meshes
+def assemble_mesh_data(meshes:[dict], matrices:[object]) -> dict:
+    # Group the copies of each distinct mesh so each can be transformed in one step
+    groups:dict = {}
+    for mesh,matrix in zip(meshes, matrices):
+        if id(mesh) not in groups:
+            groups[id(mesh)] = (mesh, [])
+        groups[id(mesh)][1].append(matrix)
+
+    parts:[dict] = [ transform_mesh_data(mesh, array(mats, dtype=float64).reshape(-1, 4, 4)) for mesh,mats in groups.values() ]
+    if parts == []:
+        return {
+            'co': zeros((0, 3), dtype=float32),
+            'loop-vertices': zeros(0, dtype=int32),
+            'loop-starts': zeros(0, dtype=int32),
+            'loop-totals': zeros(0, dtype=int32),
+            'smooth': zeros(0, dtype=bool),
+            'loop-normals': zeros((0, 3), dtype=float32),
+        }
+
+    # Offset the indices of each part by the sizes of those before it
+    vertex_offsets:ndarray = cumsum([0] + [ len(p['co']) for p in parts[:-1] ])
+    loop_offsets:ndarray = cumsum([0] + [ len(p['loop-vertices']) for p in parts[:-1] ])
+    return {
+        'co': concatenate([ p['co'] for p in parts ]),
+        'loop-vertices': concatenate([ p['loop-vertices'] + o for p,o in zip(parts, vertex_offsets) ]).astype(int32),
+        'loop-starts': concatenate([ p['loop-starts'] + o for p,o in zip(parts, loop_offsets) ]).astype(int32),
+        'loop-totals': concatenate([ p['loop-totals'] for p in parts ]),
+        'smooth': concatenate([ p['smooth'] for p in parts ]),
+        'loop-normals': concatenate([ p['loop-normals'] for p in parts ]),
+    }
+
+##
+# @brief Make transformed copies of a single mesh
+#
+# @param mesh:dict Mesh arrays
+# @param matrices:ndarray A k×4×4 array of transformation matrices, one for each copy
+#
+# @return Mesh arrays which hold all k transformed copies
+def transform_mesh_data(mesh:dict, matrices:ndarray) -> dict:
+    k:int = len(matrices)
+    num_verts:int = len(mesh['co'])
+    num_loops:int = len(mesh['loop-vertices'])
+    linear:ndarray = matrices[:, :3, :3]
+    co:ndarray = einsum('kij,nj->kni', linear, mesh['co']) + matrices[:, None, :3, 3]
+
+    # Normals transform by the inverse transpose of the linear part
+    normals:ndarray = einsum('kji,nj->kni', inv(linear), mesh['loop-normals'])
+    lengths:ndarray = norm(normals, axis=-1, keepdims=True)
+    lengths[lengths == 0.0] = 1.0
+
+    copy_offsets:ndarray = array(range(k))[:, None]
+    return {
+        'co': co.reshape(-1, 3).astype(float32),
+        'loop-vertices': (mesh['loop-vertices'][None, :] + num_verts * copy_offsets).ravel(),
+        'loop-starts': (mesh['loop-starts'][None, :] + num_loops * copy_offsets).ravel(),
+        'loop-totals': mesh['loop-totals'][None, :].repeat(k, axis=0).ravel(),
+        'smooth': mesh['smooth'][None, :].repeat(k, axis=0).ravel(),
+        'loop-normals': (normals / lengths).reshape(-1, 3).astype(float32),
+    }
@@ -0,0 +1,170 @@
+# Copyright (C) Edward Jones
+
+from .blender_available import blender_available
+from .lazy_import import LazyImport
+from .log import printi, printw
+from .obj_io import read_obj
+from .shared_inputs import file_state, shared_input
+from .util import get_only, list_diff
+from hashlib import sha1
+from numpy import empty, float32, int32, load, ndarray, savez
+from os import getpid, makedirs, replace
+from os.path import dirname, exists, join
+Collection:type = None
+Mesh:type = None
+Object:type = None
+if blender_available():
+    from bpy import ops
+    from bpy.types import Collection, Mesh, Object
+    data = LazyImport('bpy', 'data')
+
+# Increment when the layout of the cached arrays changes
+mesh_cache_format_version:int = 1
+
+
+##
+# @brief Obtain the mesh data of a keycap model, using the on-disk cache where possible to avoid the slow obj importer
+#
+# @param cap_source:str Path to the keycap obj file
+# @param cache_dir:str Directory containing cached data or None if the cache should not be used
+#
+# @return A dictionary of the arrays which describe the mesh (see `extract_mesh_data`)
+def get_cap_mesh_data(cap_source:str, cache_dir:str) -> dict:
+    return shared_input('cap-mesh', cap_source, file_state, lambda: load_cap_mesh_data(cap_source, cache_dir))
+
+def load_cap_mesh_data(cap_source:str, cache_dir:str) -> dict:
+    cache_path:str = None
+    if cache_dir is not None:
+        cache_path = join(cache_dir, 'meshes', '%s-v%d.npz' % (file_hash(cap_source), mesh_cache_format_version))
+        if exists(cache_path):
+            try:
+                printi('Reading cached mesh of "%s"...', cap_source)
+                return read_mesh_data(cache_path)
+            except (OSError, ValueError, KeyError) as err:
+                printi('Failed to read cached mesh "%s", re-importing: %s', cache_path, err)
+
+    if not blender_available():
+        return read_mesh_vertices(cap_source)
+
+    mesh_data:dict = import_mesh_data(cap_source)
+    if cache_path is not None:
+        write_mesh_data(cache_path, mesh_data)
+    return mesh_data
+
+def file_hash(fname:str) -> str:
+    h = sha1()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+##
+# @brief Import an obj file using Blender's importer and extract its mesh data, leaving no new objects behind
+#
+# @param cap_source:str Path to the keycap obj file
+#
+# @return A dictionary of the arrays which describe the mesh
+def import_mesh_data(cap_source:str) -> dict:
+    printi('Importing "%s" into blender...', cap_source)
+    objectsPreImport:[str] = data.objects.keys()
+    ops.import_scene.obj(filepath=cap_source)
+    objectsPostImport:[str] = data.objects.keys()
+    obj_name:str = get_only(list_diff(objectsPostImport, objectsPreImport), 'No new id was added when importing from %s' % cap_source, 'Multiple ids changed when importing %s, got %%d new: %%s' % cap_source)
+    obj:Object = data.objects[obj_name]
+    mesh:Mesh = obj.data
+
+    mesh_data:dict = extract_mesh_data(mesh)
+
+    data.objects.remove(obj)
+    data.meshes.remove(mesh)
+    return mesh_data
+
+##
+# @brief Read the vertices of an obj file without Blender, for when only the extent of the mesh is needed.
+# The result is not cached as it lacks the rest of the mesh.
+#
+# @param cap_source:str Path to the keycap obj file
+#
+# @return A dictionary holding only the vertex coordinates (`co`), in the axes of the obj file as in the meshes made by Blender's importer (which converts axes in the object's transform rather than the mesh)
+def read_mesh_vertices(cap_source:str) -> dict:
+    printi('Reading vertices of "%s"...', cap_source)
+    return { 'co': read_obj(cap_source)['v'][:, :3].astype(float32) }
+
+##
+# @brief Extract the geometry of a mesh into arrays
+#
+# @param mesh:Mesh A Blender mesh
+#
+# @return A dictionary of arrays, vertex coordinates (`co`), the vertex of each loop (`loop-vertices`), the first loop and number of loops of each polygon (`loop-starts`, `loop-totals`), polygon smoothing (`smooth`) and loop normals (`loop-normals`)
+def extract_mesh_data(mesh:Mesh) -> dict:
+    co:ndarray = empty(3 * len(mesh.vertices), dtype=float32)
+    mesh.vertices.foreach_get('co', co)
+    loop_vertices:ndarray = empty(len(mesh.loops), dtype=int32)
+    mesh.loops.foreach_get('vertex_index', loop_vertices)
+    loop_starts:ndarray = empty(len(mesh.polygons), dtype=int32)
+    mesh.polygons.foreach_get('loop_start', loop_starts)
+    loop_totals:ndarray = empty(len(mesh.polygons), dtype=int32)
+    mesh.polygons.foreach_get('loop_total', loop_totals)
+    smooth:ndarray = empty(len(mesh.polygons), dtype=bool)
+    mesh.polygons.foreach_get('use_smooth', smooth)
+    if hasattr(mesh, 'calc_normals_split'):
+        mesh.calc_normals_split()
+    loop_normals:ndarray = empty(3 * len(mesh.loops), dtype=float32)
+    mesh.loops.foreach_get('normal', loop_normals)
+    return {
+        'co': co.reshape(-1, 3),
+        'loop-vertices': loop_vertices,
+        'loop-starts': loop_starts,
+        'loop-totals': loop_totals,
+        'smooth': smooth,
+        'loop-normals': loop_normals.reshape(-1, 3),
+    }
+
+##
+# @brief Create a new object from extracted mesh data
+#
+# @param name:str The name of the new object and mesh
+# @param mesh_data:dict Mesh arrays as output by `extract_mesh_data`
+# @param collection:Collection The collection to link the new object into
+#
+# @return The new object
+def new_mesh_object(name:str, mesh_data:dict, collection:Collection) -> Object:
+    mesh:Mesh = data.meshes.new(name)
+    mesh.vertices.add(len(mesh_data['co']))
+    mesh.vertices.foreach_set('co', mesh_data['co'].ravel())
+    mesh.loops.add(len(mesh_data['loop-vertices']))
+    mesh.loops.foreach_set('vertex_index', mesh_data['loop-vertices'])
+    mesh.polygons.add(len(mesh_data['loop-starts']))
+    mesh.polygons.foreach_set('loop_start', mesh_data['loop-starts'])
+    mesh.polygons.foreach_set('loop_total', mesh_data['loop-totals'])
+    mesh.polygons.foreach_set('use_smooth', mesh_data['smooth'])
+    mesh.update(calc_edges=True)
+    mesh.uv_layers.new()
+    mesh.use_auto_smooth = True
+    mesh.normals_split_custom_set(mesh_data['loop-normals'])
+
+    obj:Object = data.objects.new(name, mesh)
+    collection.objects.link(obj)
+    return obj
+
+def mesh_min_point(mesh_data:dict) -> (float, float, float):
+    return tuple(map(float, mesh_data['co'].min(axis=0))) if len(mesh_data['co']) != 0 else (0.0, 0.0, 0.0)
+
+def mesh_max_point(mesh_data:dict) -> (float, float, float):
+    return tuple(map(float, mesh_data['co'].max(axis=0))) if len(mesh_data['co']) != 0 else (0.0, 0.0, 0.0)
+
+def read_mesh_data(cache_path:str) -> dict:
+    with load(cache_path) as cached:
+        return { k: cached[k] for k in cached.files }
+
+def write_mesh_data(cache_path:str, mesh_data:dict):
+    try:
+        cache_dir:str = dirname(cache_path)
+        if not exists(cache_dir):
+            makedirs(cache_dir)
+        tmp_cache_path:str = '%s.%d.tmp' % (cache_path, getpid())
+        with open(tmp_cache_path, 'wb') as f:
+            savez(f, **mesh_data)
+        replace(tmp_cache_path, cache_path)
+    except OSError as oserr:
+        printw('Could not write mesh cache "%s": %s' % (cache_path, oserr))
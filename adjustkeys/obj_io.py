@@ -1,65 +1,166 @@
 # Copyright (C) Edward Jones
 
-from .log import die, printi
-from .util import concat
-from functools import reduce
+from .log import die
+from numpy import array, bincount, concatenate, cumsum, float64, frombuffer, fromstring, int32, ndarray, searchsorted, uint8, zeros
 from os.path import exists
-from sys import stdout
+from re import compile, Pattern
+from sys import stdin, stdout
 
 # Keeps the python parser happy when looking at type annotations. It doesn't even use them so it doesn't really have a right to complain, does it?
 file: str = 'file'
 
+# Records which affect all faces which follow them
+obj_state_records:[str] = ['o', 'g', 'usemtl', 's']
 
-def read_obj(cfile: str) -> [dict]:
-    if not exists(cfile):
+# Records are matched from the newline which precedes them, which is much faster than matching at every line start
+obj_vector_record_regices:dict = { r: compile(rb'\n' + r.encode() + rb'[ \t]+([^\n]*)') for r in ['v', 'vn', 'vt'] }
+obj_vector_record_start_regices:dict = { r: compile(rb'\n' + r.encode() + rb'[ \t]') for r in ['v', 'vn', 'vt'] }
+obj_face_record_regex:Pattern = compile(rb'\nf[ \t]+([^\n]*)')
+obj_face_record_start_regex:Pattern = compile(rb'\nf[ \t]')
+obj_state_record_regex:Pattern = compile(rb'\n(' + b'|'.join(map(str.encode, obj_state_records)) + rb')(?:[ \t]+([^\n]*))?(?=\n)')
+obj_mtllib_record_regex:Pattern = compile(rb'\nmtllib[ \t]+([^\n]*)')
+
+
+##
+# @brief Read an obj file into arrays
+#
+# @param cfile:str Path to the file to read, or '-' for stdin
+#
+# @return The parsed obj (see `parse_obj`)
+def read_obj(cfile: str) -> dict:
+    if cfile != '-' and not exists(cfile):
         die('Failed to read keycap file "%s"' % cfile)
-    rawCap: [str]
-    if 'cfile' == '-':
-        rawCap = stdin.readlines()
+    rawCap: bytes
+    if cfile == '-':
+        rawCap = stdin.buffer.read()
     else:
-        with open(cfile, 'r') as f:
-            rawCap = f.readlines()
-    return parse_cap(rawCap)
-
-
-def parse_cap(rawCap: [str]) -> [[str, int, int, [[str, list]]]]:
-    robj: [[str]] = list(map(lambda l: l.strip().split(' '), rawCap))
-    currGrpName: str = 'DEFAULT_GROUP'
-    currGrpData: [[str, list]] = []
-    obj: [[str, int, [[str, list]]]] = []
-    currTotVertices: int = 0
-    groupTotVertices: int = 0
-    for line in robj:
-        if line[0] == 'g':
-            printi('Parsing group', currGrpName)
-            # Handle the old group
-            if currGrpName is not None:
-                obj.append((currGrpName, currTotVertices, groupTotVertices,
-                            currGrpData))
-            groupTotVertices: int = 0
-            # New group
-            currGrpName = ' '.join(line[1:])
-            currGrpData = []
-        elif line[0] == 'v':
-            # Parse vertex
-            currGrpData.append((line[0], list(map(float, line[1:]))))
-            currTotVertices += 1
-            groupTotVertices += 1
-        #  elif line[0] == 'f':
-            #  # Parse face
-            #  currGrpData.append(
-                #  (line[0],
-                 #  list(map(lambda p: list(map(int, p.split('/'))), line[1:]))))
-        else:
-            # Store text, don't handle
-            currGrpData.append((line[0], line[1:]))
-    if currGrpData != {}:
-        obj.append(
-            (currGrpName, currTotVertices, groupTotVertices, currGrpData))
+        with open(cfile, 'rb') as f:
+            rawCap = f.read()
+    return parse_obj(rawCap)
+
+
+##
+# @brief Parse the contents of an obj file.
+# Each kind of record is extracted from the whole file at once and converted by NumPy rather than handling the file line by line.
+#
+# @param rawCap:bytes The contents of an obj file
+#
+# @return A dictionary holding:
+#   `v`, `vn` and `vt`, arrays of the vertex positions, normals and texture coordinates, one row per record;
+#   `face-v`, `face-vt` and `face-vn`, zero-based indices into these arrays for each face corner, -1 where a corner does not reference one;
+#   `face-starts` and `face-sizes`, the first corner and number of corners of each face;
+#   `states`, a list of (first face, record, value) for each object, group, material and smoothing record in file order;
+#   `mtllib`, the material libraries referenced.
+def parse_obj(rawCap: bytes) -> dict:
+    rawCap = b'\n' + rawCap.replace(b'\r\n', b'\n') + b'\n'
+    obj: dict = { r: parse_vectors(rawCap, r) for r in obj_vector_record_regices }
+
+    faces: [bytes] = obj_face_record_regex.findall(rawCap)
+    face_sizes: ndarray = array([ len(f.split()) for f in faces ], dtype=int32)
+    corners: ndarray = parse_face_corners(b' '.join(faces).split())
+    obj['face-sizes'] = face_sizes
+    obj['face-starts'] = (cumsum(face_sizes) - face_sizes).astype(int32)
+
+    # Resolve one-based and relative indices
+    corner_record_positions: ndarray = None
+    for i,r in enumerate(['v', 'vt', 'vn']):
+        idxs: ndarray = corners[:, i]
+        if (idxs < 0).any():
+            if corner_record_positions is None:
+                corner_record_positions = record_starts(obj_face_record_start_regex, rawCap).repeat(face_sizes)
+            record_positions: ndarray = record_starts(obj_vector_record_start_regices[r], rawCap)
+            num_before: ndarray = searchsorted(record_positions, corner_record_positions)
+            idxs = idxs.copy()
+            idxs[idxs < 0] += num_before[idxs < 0] + 1
+        obj['face-' + r] = (idxs - 1).astype(int32)
+        if ((obj['face-' + r] < -1) | (obj['face-' + r] >= len(obj[r]))).any():
+            die('Face references a %s record which does not exist' % r)
+
+    # Locate the faces affected by each state-changing record
+    obj['states'] = [ (faces_before(rawCap, m.start()), m.group(1).decode(), (m.group(2) or b'').strip().decode()) for m in obj_state_record_regex.finditer(rawCap) ]
+    obj['mtllib'] = [ m.strip().decode() for m in obj_mtllib_record_regex.findall(rawCap) ]
+
     return obj
 
 
-def write_obj(fname: str, data: [[str, int, int, [[str, list]]]]):
+def parse_vectors(rawCap: bytes, record: str) -> ndarray:
+    lines: [bytes] = obj_vector_record_regices[record].findall(rawCap)
+    if lines == []:
+        return zeros((0, 2 if record == 'vt' else 3), dtype=float64)
+    width: int = len(lines[0].split())
+    values: ndarray = fromstring(b' '.join(lines), dtype=float64, sep=' ')
+    if len(values) != width * len(lines):
+        die('Inconsistent number of components in "%s" records' % record)
+    return values.reshape(-1, width)
+
+
+##
+# @brief Parse face corners of the form v, v/vt, v//vn or v/vt/vn
+#
+# @param corners:[bytes] The corner tokens of all faces
+#
+# @return An n×3 array of the raw (one-based, possibly relative) v, vt and vn indices of each corner, zero where absent
+def parse_face_corners(corners: [bytes]) -> ndarray:
+    ret: ndarray = zeros((len(corners), 3), dtype=int32)
+    if corners == []:
+        return ret
+
+    # Fast path, all corners are of the same form as the first
+    form: [bool] = [ p != b'' for p in corners[0].split(b'/') ]
+    raw_corners: bytes = b' '.join(corners)
+    if corners_share_slash_pattern(raw_corners, len(corners)):
+        raw: ndarray = fromstring(raw_corners.replace(b'/', b' '), dtype=int32, sep=' ')
+        if len(raw) == sum(form) * len(corners):
+            ret[:, [ i for i,present in enumerate(form) if present ]] = raw.reshape(len(corners), -1)
+            return ret
+
+    # Slow path, corners of mixed forms
+    for i,c in enumerate(corners):
+        for j,p in enumerate(c.split(b'/')):
+            if p != b'':
+                ret[i, j] = int(p)
+    return ret
+
+
+##
+# @brief Check whether every corner has the same numbers of slashes and of empty fields between slashes, which together with the count of the numbers they hold determine the form of each corner
+#
+# @param raw_corners:bytes The corner tokens of all faces separated by single spaces
+# @param num_corners:int The number of corners
+#
+# @return True if and only if all corners share the slash pattern of the first
+def corners_share_slash_pattern(raw_corners: bytes, num_corners: int) -> bool:
+    chars: ndarray = frombuffer(raw_corners, dtype=uint8)
+    corner_idxs: ndarray = cumsum(chars == ord(' '))
+    slashes: ndarray = chars == ord('/')
+    double_slashes: ndarray = slashes[:-1] & slashes[1:]
+    slash_counts: ndarray = bincount(corner_idxs[slashes], minlength=num_corners)
+    double_slash_counts: ndarray = bincount(corner_idxs[:-1][double_slashes], minlength=num_corners)
+    return bool((slash_counts == slash_counts[0]).all() and (double_slash_counts == double_slash_counts[0]).all())
+
+
+def faces_before(rawCap: bytes, pos: int) -> int:
+    return rawCap.count(b'\nf ', 0, pos) + rawCap.count(b'\nf\t', 0, pos)
+
+
+def record_starts(regex: Pattern, rawCap: bytes) -> ndarray:
+    return array([ m.start() for m in regex.finditer(rawCap) ], dtype=int)
+
+
+##
+# @brief Obtain the ranges of faces covered by each record of a given state-changing kind
+#
+# @param obj:dict A parsed obj
+# @param record:str The kind of record, one of `obj_state_records`
+#
+# @return A list of (value, first face, end face) triples
+def face_ranges(obj: dict, record: str) -> [(str, int, int)]:
+    starts: [(int, str)] = [ (first_face, value) for first_face,r,value in obj['states'] if r == record ]
+    ends: [int] = [ first_face for first_face,_ in starts[1:] ] + [ len(obj['face-sizes']) ]
+    return [ (value, first_face, end) for (first_face,value),end in zip(starts, ends) ]
+
+
+def write_obj(fname: str, data: dict):
     if fname == '-':
         write_obj_to_file(data, stdout)
     else:
@@ -67,15 +168,28 @@ def write_obj(fname: str, data: [[str, int, int, [[str, list]]]]):
             write_obj_to_file(data, f)
 
 
-def write_obj_to_file(obj: [[str, int, int, [[str, list]]]], f: file) -> str:
-    for gn, _, _, gd in obj:
-        print('g %s' % gn, file=f)
-        print('o %s' % gn, file=f)
-        for t, d in gd:
-            #  if t == 'f':
-                #  print('f',
-                      #  ' '.join(
-                          #  list(map(lambda t: '/'.join(list(map(str, t))), d))),
-                      #  file=f)
-            #  else:
-            print(t, ' '.join(list(map(str, d))), file=f)
+def write_obj_to_file(obj: dict, f: file):
+    for mtllib in obj['mtllib']:
+        print('mtllib', mtllib, file=f)
+    for r in ['v', 'vt', 'vn']:
+        f.writelines([ '%s %s\n' % (r, ' '.join(map(repr, row))) for row in obj[r].tolist() ])
+
+    # Format corners
+    present: ndarray = concatenate([ (obj['face-' + r] != -1)[:, None] for r in ['v', 'vt', 'vn'] ], axis=1)
+    corners: [str] = [ '/'.join([ str(i + 1) if p else '' for i,p in zip(idxs, ps) ]).rstrip('/')
+            for idxs,ps in zip(zip(obj['face-v'].tolist(), obj['face-vt'].tolist(), obj['face-vn'].tolist()), present.tolist()) ]
+
+    states: [tuple] = obj['states']
+    s: int = 0
+    lines: [str] = []
+    for i,(start,size) in enumerate(zip(obj['face-starts'].tolist(), obj['face-sizes'].tolist())):
+        while s < len(states) and states[s][0] <= i:
+            lines.append(state_line(states[s]))
+            s += 1
+        lines.append('f %s\n' % ' '.join(corners[start:start + size]))
+    lines += [ state_line(state) for state in states[s:] ]
+    f.writelines(lines)
+
+def state_line(state: tuple) -> str:
+    (_, record, value) = state
+    return '%s %s\n' % (record, value) if value != '' else '%s\n' % record
@@ -1,7 +1,8 @@
 # Copyright (C) Edward Jones
 
-from os import walk as owalk
-from os.path import abspath, dirname, join, normpath
+from os import environ, stat, stat_result, walk as owalk
+from os.path import abspath, dirname, expanduser, join, normpath
+from sys import platform
 from tempfile import NamedTemporaryFile
 
 adjustkeys_path:str = normpath(abspath(dirname(__file__)))
@@ -10,12 +11,41 @@ if adjustkeys_path.endswith('adjustkeys'):
 if adjustkeys_path.endswith('adjustkeys-bin'):
     adjustkeys_path = normpath(adjustkeys_path[:-len('adjustkeys-bin')])
 
+##
+# @brief Find the directory in which the current user's caches are kept by convention on this platform, so that adjustkeys never writes into its own (possibly read-only) installation
+#
+# @return The path of the adjustkeys cache directory, which may not yet exist
+def user_cache_path() -> str:
+    cache_root:str
+    if platform.startswith('win'):
+        cache_root = environ.get('LOCALAPPDATA', join(expanduser('~'), 'AppData', 'Local'))
+    elif platform == 'darwin':
+        cache_root = join(expanduser('~'), 'Library', 'Caches')
+    else:
+        cache_root = environ.get('XDG_CACHE_HOME', join(expanduser('~'), '.cache'))
+    return normpath(abspath(join(cache_root, 'adjustkeys')))
+
 def walk(dname:str) -> [str]:
     ret:[str] = []
     for (r,_,fs) in owalk(dname):
         ret.extend(map(lambda f: join(r,f), fs))
     return ret
 
+##
+# @brief Describe the files in a directory by their names, sizes and modification times
+#
+# @param dname:str Path of the directory
+#
+# @return A tuple of (name, modification time in nanoseconds, size) of each file within the directory in name order, with None for the time and size of any file removed while it was being listed
+def dir_state(dname:str) -> tuple:
+    def file_state(fname:str) -> tuple:
+        try:
+            fstat:stat_result = stat(fname)
+            return (fname, fstat.st_mtime_ns, fstat.st_size)
+        except OSError:
+            return (fname, None, None)
+    return tuple(map(file_state, sorted(walk(dname))))
+
 def get_temp_file_name() -> str:
     name:str
     with NamedTemporaryFile() as f:
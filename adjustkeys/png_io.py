@@ -0,0 +1,86 @@
+# Copyright (C) Edward Jones
+
+from .log import die
+from numpy import concatenate, frombuffer, ndarray, uint8, zeros
+from struct import pack, unpack
+from typing import BinaryIO, Iterable
+from zlib import compressobj, crc32, decompress
+
+png_signature:bytes = b'\x89PNG\r\n\x1a\n'
+png_compression_level:int = 6
+png_max_idat_size:int = 1 << 20
+
+
+##
+# @brief Write an 8-bit RGBA png a band of rows at a time, so that the whole image never needs to be held in memory
+#
+# @param fname:str Name of the file to write
+# @param width:int Width of the image in pixels
+# @param height:int Height of the image in pixels
+# @param bands:Iterable An iterable of h×width×4 uint8 arrays, which together cover the image from top to bottom
+#
+# @return Nothing
+def write_png(fname:str, width:int, height:int, bands:Iterable[ndarray]):
+    with open(fname, 'wb') as f:
+        f.write(png_signature)
+        write_png_chunk(f, b'IHDR', pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+
+        compressor = compressobj(png_compression_level)
+        pending:[bytes] = []
+        pending_size:int = 0
+        rows_written:int = 0
+        for band in bands:
+            # Prefix each row with filter type zero (none)
+            rows:ndarray = concatenate((zeros((band.shape[0], 1), dtype=uint8), band.reshape(band.shape[0], -1)), axis=1)
+            rows_written += band.shape[0]
+            compressed:bytes = compressor.compress(rows.tobytes())
+            pending.append(compressed)
+            pending_size += len(compressed)
+            if pending_size >= png_max_idat_size:
+                write_png_chunk(f, b'IDAT', b''.join(pending))
+                pending = []
+                pending_size = 0
+        pending.append(compressor.flush())
+        write_png_chunk(f, b'IDAT', b''.join(pending))
+        write_png_chunk(f, b'IEND', b'')
+
+        if rows_written != height:
+            die('Expected %d rows of png data but got %d' % (height, rows_written))
+
+##
+# @brief Read an 8-bit RGBA png as written by `write_png`, whose rows are all unfiltered
+#
+# @param fname:str Name of the file to read
+#
+# @return An h×w×4 uint8 array of the pixels, row by row from the top
+def read_png(fname:str) -> ndarray:
+    with open(fname, 'rb') as f:
+        content:bytes = f.read()
+    if not content.startswith(png_signature):
+        die('"%s" is not a png' % fname)
+    pos:int = len(png_signature)
+    header:tuple = None
+    idat:[bytes] = []
+    while pos < len(content):
+        (length, chunk_type) = unpack('>I4s', content[pos:pos + 8])
+        data:bytes = content[pos + 8:pos + 8 + length]
+        if chunk_type == b'IHDR':
+            header = unpack('>IIBBBBB', data)
+        elif chunk_type == b'IDAT':
+            idat.append(data)
+        elif chunk_type == b'IEND':
+            break
+        pos += 12 + length
+    if header is None or header[2:] != (8, 6, 0, 0, 0):
+        die('Png "%s" is not an 8-bit, non-interlaced RGBA image' % fname)
+    (width, height) = header[:2]
+    rows:ndarray = frombuffer(decompress(b''.join(idat)), dtype=uint8).reshape(height, 1 + 4 * width)
+    if rows[:, 0].any():
+        die('Png "%s" uses row filters, only images written by adjustkeys can be read' % fname)
+    return rows[:, 1:].reshape(height, width, 4)
+
+def write_png_chunk(f:BinaryIO, chunk_type:bytes, data:bytes):
+    f.write(pack('>I', len(data)))
+    f.write(chunk_type)
+    f.write(data)
+    f.write(pack('>I', crc32(data, crc32(chunk_type))))
@@ -9,7 +9,7 @@ Vector:type = LazyImport('mathutils', 'Vector')
 
 
 def resolve_glyph_position(data: dict, layout_min_point:Vector, glyph_ulen: float, cap_ulen:float, scale:float) -> dict:
-    ret: dict = dict(data)
+    ret: dict = data.copy()
 
     # Compute offset from top-left as if ret.rotation == 0
     offset:Vector = Matrix.Scale(glyph_ulen / cap_ulen, 2) @ Vector((ret['p-off-x'], ret['p-off-y'])) - ret['glyph-offset']
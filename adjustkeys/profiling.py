@@ -0,0 +1,149 @@
+# Copyright (C) Edward Jones
+
+from argparse import Namespace
+from contextlib import contextmanager
+from json import dump
+from sys import platform, stderr
+from time import perf_counter, process_time
+
+profiling:bool = False
+stage_stack:[str] = []
+stages:dict = {}
+stage_starts:dict = {}
+counters:dict = {}
+start_time:float = 0.0
+
+
+##
+# @brief Initialise profiling, should be called before any stage is timed.
+# Any data from a previous run is discarded.
+#
+# @param pargs:Namespace Parsed arguments
+#
+# @return Nothing
+def init_profiling(pargs:Namespace):
+    global profiling
+    global stage_stack
+    global stages
+    global stage_starts
+    global counters
+    global start_time
+    profiling = pargs.profile or pargs.profile_out not in ['None', '']
+    stage_stack = []
+    stages = {}
+    stage_starts = {}
+    counters = {}
+    start_time = perf_counter()
+
+##
+# @brief Time a stage of a run.
+# Stages may be nested, in which case the inner stage is recorded under the path of the stages which contain it (such as `adjust-caps/uv-unwrap`), and a stage entered several times accumulates its times.
+#
+# @param name:str Name of the stage
+#
+# @return A context manager which times its body
+@contextmanager
+def profile_stage(name:str):
+    if not profiling:
+        yield
+        return
+    stage_stack.append(name)
+    path:str = '/'.join(stage_stack)
+    if path not in stage_starts:
+        stage_starts[path] = len(stage_starts)
+    wall_start:float = perf_counter()
+    cpu_start:float = process_time()
+    try:
+        yield
+    finally:
+        wall:float = perf_counter() - wall_start
+        cpu:float = process_time() - cpu_start
+        stage_stack.pop()
+        if path not in stages:
+            stages[path] = { 'stage': path, 'depth': path.count('/'), 'calls': 0, 'wall-s': 0.0, 'cpu-s': 0.0 }
+        stage:dict = stages[path]
+        stage['calls'] += 1
+        stage['wall-s'] += wall
+        stage['cpu-s'] += cpu
+        stage['peak-rss-mib'] = peak_rss_mib()
+
+##
+# @brief Add to a counter
+#
+# @param name:str Name of the counter
+# @param n:int Amount to add
+#
+# @return Nothing
+def profile_count(name:str, n:int=1):
+    if profiling:
+        counters[name] = counters.get(name, 0) + n
+
+def profiling_enabled() -> bool:
+    return profiling
+
+##
+# @brief Sample the peak memory use of this process and of its finished child processes
+#
+# @param children:bool Whether to sample child processes rather than this one
+#
+# @return The largest resident set size so far in MiB, or None if this platform does not report it
+def peak_rss_mib(children:bool=False) -> float:
+    try:
+        from resource import getrusage, RUSAGE_CHILDREN, RUSAGE_SELF
+    except ImportError:
+        return None
+    # Linux reports kibibytes, macOS reports bytes
+    return getrusage(RUSAGE_CHILDREN if children else RUSAGE_SELF).ru_maxrss / (1024.0 * 1024.0 if platform == 'darwin' else 1024.0)
+
+##
+# @brief Gather the profiling data of the current run
+#
+# @return A dictionary of the stages (in the order they were first entered, each followed by those it contains), counters, total time and peak memory use
+def profile_report() -> dict:
+    return {
+        'total-wall-s': perf_counter() - start_time,
+        'peak-rss-mib': peak_rss_mib(),
+        'peak-child-rss-mib': peak_rss_mib(children=True),
+        'stages': sorted(stages.values(), key=lambda s: stage_position(s['stage'])),
+        'counters': dict(counters),
+    }
+
+def stage_position(path:str) -> [int]:
+    parts:[str] = path.split('/')
+    return [ stage_starts['/'.join(parts[:i + 1])] for i in range(len(parts)) ]
+
+##
+# @brief Print a profiling report as a table
+#
+# @param report:dict A report as output by `profile_report`
+#
+# @return Nothing
+def print_profile(report:dict):
+    rows:[[str]] = [['stage', 'calls', 'wall (s)', 'cpu (s)', 'peak rss (MiB)']]
+    for stage in report['stages']:
+        rows.append([
+            '  ' * stage['depth'] + stage['stage'].split('/')[-1],
+            str(stage['calls']),
+            '%.4f' % stage['wall-s'],
+            '%.4f' % stage['cpu-s'],
+            '%.1f' % stage['peak-rss-mib'] if stage['peak-rss-mib'] is not None else 'n/a'
+        ])
+    widths:[int] = [ max(map(lambda r: len(r[i]), rows)) for i in range(len(rows[0])) ]
+    for row in rows:
+        print('  '.join([row[0].ljust(widths[0])] + [ c.rjust(w) for c,w in zip(row[1:], widths[1:]) ]), file=stderr)
+    print('total wall time: %.4fs' % report['total-wall-s'], file=stderr)
+    if report['peak-rss-mib'] is not None:
+        print('peak rss: %.1f MiB (child processes: %.1f MiB)' % (report['peak-rss-mib'], report['peak-child-rss-mib']), file=stderr)
+    for name,value in sorted(report['counters'].items()):
+        print('%s: %d' % (name, value), file=stderr)
+
+##
+# @brief Write a profiling report as json
+#
+# @param fname:str Name of the file to write
+# @param report:dict A report as output by `profile_report`
+#
+# @return Nothing
+def write_profile(fname:str, report:dict):
+    with open(fname, 'w') as f:
+        dump(report, f, indent=2)
@@ -0,0 +1,313 @@
+# Copyright (C) Edward Jones
+
+from .log import die, printi, printw
+from .png_io import write_png
+from .profiling import profile_count
+from .rasterisers import rasteriser_available, rasterisers
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from hashlib import sha1
+from numpy import ceil, clip, float32, floor, frombuffer, int64, load, ndarray, savez_compressed, uint8, zeros
+from os import cpu_count, getpid, listdir, makedirs, remove, replace, stat, stat_result, utime
+from os.path import dirname, exists, join
+from typing import Iterator
+from zipfile import BadZipFile
+
+svg_header:str = '<svg width="%d" height="%d" fill="none" xmlns="http://www.w3.org/2000/svg">'
+svg_footer:str = '</svg>'
+
+# Increment when the format of cached rasters changes
+raster_cache_format_version:int = 1
+
+# Size to which the cache of renderings of single keys is reduced after each run
+raster_cache_max_bytes:int = 256 * 1024 * 1024
+
+
+##
+# @brief Rasterise a set of svg groups into a png, a tile at a time.
+# Only the groups whose bounds intersect a tile are rendered with it, tiles are rendered in parallel and the image is written a row of tiles at a time, so memory use is bounded by the tile size and number of workers rather than the size of the image.
+#
+# @param groups:[bytes] Serialised svg groups in the order they should be painted (any sequence, such as an SvgGroups)
+# @param bounds:ndarray An n×4 array of the bounds (xmin, ymin, xmax, ymax) of each group in svg units
+# @param svg_dims:(float, float) The size of the svg canvas in svg units
+# @param image_dims:(int, int) The size of the image to output in pixels
+# @param fname:str Name of the png file to write
+# @param tile_size:int Length of the side of each tile in pixels
+# @param workers:int Number of processes to render tiles in, zero to use one per CPU, one to render in this process
+# @param rasteriser:str Name of the backend which renders svg, one of the keys of `rasterisers.rasterisers`
+# @param cache_dir:str Directory in which to cache the rendering of each group, or None to render the image directly, which is faster unless most groups were rendered by an earlier run
+#
+# @return Nothing
+def rasterise_svg_groups(groups:[bytes], bounds:ndarray, svg_dims:(float, float), image_dims:(int, int), fname:str, tile_size:int, workers:int, rasteriser:str, cache_dir:str=None):
+    if not rasteriser_available(rasteriser):
+        die('Rasteriser "%s" is not available, please install the %s module or choose another with --rasteriser' % (rasteriser, rasteriser))
+    (width, height) = image_dims
+    scale:(float, float) = (width / svg_dims[0], height / svg_dims[1])
+    pixel_bounds:ndarray = bounds.reshape(-1, 4) * (scale + scale)
+    tile_rows:[[(int, int, int, int)]] = plan_tiles(width, height, tile_size)
+    num_workers:int = workers if workers > 0 else cpu_count() or 1
+
+    if cache_dir is not None:
+        composite_cached_groups(groups, pixel_bounds, scale, image_dims, fname, tile_size, num_workers, rasteriser, cache_dir)
+        return
+
+    def tile_jobs() -> Iterator:
+        for tile_row in tile_rows:
+            for tile in tile_row:
+                (x0, y0, x1, y1) = tile
+                in_tile:ndarray = (pixel_bounds[:, 0] < x1) & (pixel_bounds[:, 2] > x0) & (pixel_bounds[:, 1] < y1) & (pixel_bounds[:, 3] > y0)
+                tile_groups:[bytes] = [ groups[i] for i in in_tile.nonzero()[0] ]
+                yield (tile_svg(tile_groups, tile, scale) if tile_groups != [] else None, x1 - x0, y1 - y0, rasteriser)
+
+    def bands(tiles:Iterator) -> Iterator:
+        for tile_row in tile_rows:
+            band_height:int = tile_row[0][3] - tile_row[0][1]
+            band:ndarray = zeros((band_height, width, 4), dtype=uint8)
+            for (x0, _, x1, _) in tile_row:
+                tile:bytes = next(tiles)
+                if tile is not None:
+                    profile_count('bytes-rasterised', len(tile))
+                    band[:, x0:x1] = frombuffer(tile, dtype=uint8).reshape(band_height, x1 - x0, 4)
+            yield band
+
+    num_tiles:int = sum(map(len, tile_rows))
+    printi('Rasterising %dx%d image in %d tiles with %d worker%s using %s', width, height, num_tiles, num_workers, 's' if num_workers != 1 else '', rasteriser)
+    if num_workers == 1 or num_tiles == 1:
+        write_png(fname, width, height, bands(map(render_job, tile_jobs())))
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            write_png(fname, width, height, bands(bounded_map(executor, tile_jobs(), 2 * num_workers)))
+
+##
+# @brief Rasterise svg groups into a png by compositing a separate rendering of each group, taken from the cache where possible.
+# Only groups whose content, placement or resolution has changed since they were last cached are rendered.
+#
+# @param groups:[bytes] Serialised svg groups in the order they should be painted (any sequence, such as an SvgGroups)
+# @param pixel_bounds:ndarray An n×4 array of the bounds (xmin, ymin, xmax, ymax) of each group in pixels
+# @param scale:(float, float) The number of pixels per svg unit along each axis
+# @param image_dims:(int, int) The size of the image to output in pixels
+# @param fname:str Name of the png file to write
+# @param band_height:int The number of rows of the image to composite at once
+# @param num_workers:int Number of processes to render groups in
+# @param rasteriser:str Name of the backend which renders svg
+# @param cache_dir:str Directory which contains the cache
+#
+# @return Nothing
+def composite_cached_groups(groups:[bytes], pixel_bounds:ndarray, scale:(float, float), image_dims:(int, int), fname:str, band_height:int, num_workers:int, rasteriser:str, cache_dir:str):
+    (width, height) = image_dims
+    boxes:ndarray = clip(pixel_bounds, 0, image_dims + image_dims)
+    boxes[:, 0:2] = floor(boxes[:, 0:2])
+    boxes[:, 2:4] = ceil(boxes[:, 2:4])
+    boxes = boxes.astype(int64)
+    visible:[int] = [ i for i in range(len(groups)) if boxes[i, 0] < boxes[i, 2] and boxes[i, 1] < boxes[i, 3] ]
+
+    raster_dir:str = join(cache_dir, 'rasters')
+    raster_paths:dict = { i: join(raster_dir, '%s-v%d.npz' % (raster_hash(groups[i], boxes[i], scale, rasteriser), raster_cache_format_version)) for i in visible }
+
+    def group_job(i:int) -> tuple:
+        return (tile_svg([groups[i]], tuple(boxes[i]), scale), int(boxes[i, 2] - boxes[i, 0]), int(boxes[i, 3] - boxes[i, 1]), rasteriser)
+    def to_raster(i:int, pixels:bytes) -> ndarray:
+        profile_count('bytes-rasterised', len(pixels))
+        return frombuffer(pixels, dtype=uint8).reshape(boxes[i, 3] - boxes[i, 1], boxes[i, 2] - boxes[i, 0], 4)
+
+    # Render the groups which have not been seen before
+    uncached:dict = {}
+    misses:[int] = [ i for i in visible if not exists(raster_paths[i]) ]
+    printi('Rasterising %d of %d keys, the rest are cached', len(misses), len(visible))
+    jobs:list = list(map(group_job, misses))
+    def store(rendered:Iterator):
+        for i,pixels in zip(misses, rendered):
+            raster:ndarray = to_raster(i, pixels)
+            if not write_cached_raster(raster_paths[i], raster):
+                uncached[i] = raster
+    if num_workers == 1 or len(jobs) <= 1:
+        store(map(render_job, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            store(bounded_map(executor, jobs, 2 * num_workers))
+
+    # Renderings which cannot be read, for example as they were damaged by an interrupted write or removed by another process, are made again
+    def load(i:int) -> ndarray:
+        if i in uncached:
+            return uncached[i]
+        raster:ndarray = read_cached_raster(raster_paths[i])
+        if raster is None or raster.shape != (boxes[i, 3] - boxes[i, 1], boxes[i, 2] - boxes[i, 0], 4):
+            raster = to_raster(i, render_job(group_job(i)))
+            write_cached_raster(raster_paths[i], raster)
+        return raster
+
+    # Composite the renderings, keeping each in memory only while it is needed by the current band
+    def bands() -> Iterator:
+        loaded:dict = {}
+        for y0 in range(0, height, band_height):
+            y1:int = min(y0 + band_height, height)
+            band:ndarray = zeros((y1 - y0, width, 4), dtype=uint8)
+            for i in visible:
+                (bx0, by0, bx1, by1) = boxes[i]
+                if by0 < y1 and by1 > y0:
+                    if i not in loaded:
+                        loaded[i] = load(i)
+                    src:ndarray = loaded[i][max(y0, by0) - by0:min(y1, by1) - by0]
+                    composite_over(band[max(y0, by0) - y0:min(y1, by1) - y0, bx0:bx1], src)
+                    if by1 <= y1:
+                        del loaded[i]
+            yield band
+    write_png(fname, width, height, bands())
+
+    prune_raster_cache(raster_dir, set(raster_paths.values()))
+
+##
+# @brief Paint one straight-alpha RGBA image over another in place
+#
+# @param dst:ndarray The image to paint onto
+# @param src:ndarray The image to paint, of the same size as `dst`
+#
+# @return Nothing
+def composite_over(dst:ndarray, src:ndarray):
+    src_alpha:ndarray = src[..., 3:4].astype(float32) / 255.0
+    dst_alpha:ndarray = dst[..., 3:4].astype(float32) / 255.0
+    out_alpha:ndarray = src_alpha + dst_alpha * (1.0 - src_alpha)
+    safe_alpha:ndarray = out_alpha.copy()
+    safe_alpha[safe_alpha == 0.0] = 1.0
+    out_colour:ndarray = (src[..., :3] * src_alpha + dst[..., :3] * dst_alpha * (1.0 - src_alpha)) / safe_alpha
+    dst[..., :3] = (out_colour + 0.5).clip(0, 255).astype(uint8)
+    dst[..., 3:4] = (255.0 * out_alpha + 0.5).clip(0, 255).astype(uint8)
+
+def raster_hash(group:bytes, box:ndarray, scale:(float, float), rasteriser:str) -> str:
+    h = sha1(group)
+    h.update(('%d %d %d %d %r %r %s' % (*box, *scale, rasteriser)).encode('utf-8'))
+    return h.hexdigest()
+
+##
+# @brief Read a cached rendering, marking it as recently used
+#
+# @param path:str Path to the cached rendering
+#
+# @return The pixels of the rendering, or None if it could not be read
+def read_cached_raster(path:str) -> ndarray:
+    try:
+        with load(path) as cached:
+            pixels:ndarray = cached['pixels']
+    except (OSError, ValueError, KeyError, EOFError, BadZipFile) as err:
+        printi('Failed to read cached raster "%s", re-rendering: %s', path, err)
+        return None
+    try:
+        utime(path)
+    except OSError:
+        pass
+    return pixels
+
+def write_cached_raster(path:str, raster:ndarray) -> bool:
+    try:
+        raster_dir:str = dirname(path)
+        if not exists(raster_dir):
+            makedirs(raster_dir)
+        tmp_path:str = '%s.%d.tmp' % (path, getpid())
+        with open(tmp_path, 'wb') as f:
+            savez_compressed(f, pixels=raster)
+        replace(tmp_path, path)
+        return True
+    except OSError as oserr:
+        printw('Could not write cached raster "%s": %s' % (path, oserr))
+        return False
+
+##
+# @brief Remove the least recently used renderings from the cache until it fits within `raster_cache_max_bytes`
+#
+# @param raster_dir:str Directory which contains the cached renderings
+# @param keep:{str} Paths of the renderings used by the current run, which are never removed
+#
+# @return Nothing
+def prune_raster_cache(raster_dir:str, keep:{str}):
+    entries:[(float, int, str)] = []
+    for fname in listdir(raster_dir) if exists(raster_dir) else []:
+        path:str = join(raster_dir, fname)
+        try:
+            fstat:stat_result = stat(path)
+        except OSError:
+            continue
+        entries.append((fstat.st_mtime, fstat.st_size, path))
+    total_size:int = sum(map(lambda e: e[1], entries))
+    for (_, size, path) in sorted(entries):
+        if total_size <= raster_cache_max_bytes:
+            break
+        if path in keep:
+            continue
+        try:
+            remove(path)
+            total_size -= size
+        except OSError:
+            pass
+
+##
+# @brief Split an image into rows of tiles
+#
+# @param width:int Width of the image in pixels
+# @param height:int Height of the image in pixels
+# @param tile_size:int Maximum side length of a tile
+#
+# @return A list of rows, each a list of tiles (x0, y0, x1, y1) from left to right
+def plan_tiles(width:int, height:int, tile_size:int) -> [[(int, int, int, int)]]:
+    return [ [ (x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height)) for x0 in range(0, width, tile_size) ] for y0 in range(0, height, tile_size) ]
+
+def tile_svg(groups:[bytes], tile:(int, int, int, int), scale:(float, float)) -> bytes:
+    (x0, y0, x1, y1) = tile
+    return b'\n'.join([
+            (svg_header % (x1 - x0, y1 - y0)).encode('utf-8'),
+            ('<g transform="translate(%d %d) scale(%f %f)">' % (-x0, -y0, scale[0], scale[1])).encode('utf-8'),
+        ] + groups + [
+            b'</g>',
+            svg_footer.encode('utf-8')
+        ])
+
+##
+# @brief Render tiles in an executor, keeping at most a fixed number in flight.
+# If the executor's processes cannot be started or stop unexpectedly (for example as a spawned process could not import adjustkeys or its dependencies), the remaining tiles are rendered in this process instead.
+#
+# @param executor:Executor The executor to use
+# @param jobs:Iterator Iterator of (svg, width, height, rasteriser) tuples where svg is None for a blank tile
+# @param window:int Maximum number of tiles being rendered at once
+#
+# @return An iterator of rendered tiles (or None for blank ones) in the same order as the jobs
+def bounded_map(executor:Executor, jobs:Iterator, window:int) -> Iterator:
+    pending:deque = deque()
+    pool_broken:bool = False
+    def get_tile_result(job:tuple, future:Future) -> bytes:
+        nonlocal pool_broken
+        if future is not None:
+            try:
+                return future.result()
+            except BrokenProcessPool as bpp:
+                if not pool_broken:
+                    printw('Rasteriser processes stopped unexpectedly, rasterising in this process instead: %s' % str(bpp))
+                    pool_broken = True
+        return render_job(job)
+    for job in jobs:
+        future:Future = None
+        if job[0] is not None and not pool_broken:
+            try:
+                future = executor.submit(render_tile, *job)
+            except (BrokenProcessPool, OSError) as err:
+                printw('Could not start rasteriser processes, rasterising in this process instead: %s' % str(err))
+                pool_broken = True
+        pending.append((job, future))
+        if len(pending) >= window:
+            yield get_tile_result(*pending.popleft())
+    while len(pending) != 0:
+        yield get_tile_result(*pending.popleft())
+
+def render_job(job:tuple) -> bytes:
+    return render_tile(*job) if job[0] is not None else None
+
+##
+# @brief Render an svg to 8-bit RGBA pixels
+#
+# @param svg:bytes The svg to render
+# @param width:int Width of the output in pixels
+# @param height:int Height of the output in pixels
+# @param rasteriser:str Name of the backend to render with
+#
+# @return The rendered pixels, row by row from the top
+def render_tile(svg:bytes, width:int, height:int, rasteriser:str) -> bytes:
+    return rasterisers[rasteriser](svg, width, height)
@@ -0,0 +1,82 @@
+# Copyright (C) Edward Jones
+
+from .lazy_import import LazyImport
+from importlib.util import find_spec
+from numpy import frombuffer, ndarray, uint8, uint16
+from sys import byteorder
+
+# CairoSVG is optional as it needs the cairo library, which cannot be installed through pip
+cairosvg_parser:object = LazyImport('cairosvg.parser')
+cairosvg_surface:object = LazyImport('cairosvg.surface')
+
+
+##
+# @brief Render an svg to 8-bit RGBA pixels using ImageMagick through Wand
+#
+# @param svg:bytes The svg to render
+# @param width:int Width of the output in pixels
+# @param height:int Height of the output in pixels
+#
+# @return The rendered pixels, row by row from the top
+def rasterise_wand(svg:bytes, width:int, height:int) -> bytes:
+    from wand.color import Color as Colour
+    from wand.image import Image
+    with Colour('transparent') as transparent:
+        with Image(blob=svg, format='svg', background=transparent, width=width, height=height) as image:
+            if image.size != (width, height):
+                image.resize(width, height)
+            image.depth = 8
+            return image.make_blob('RGBA')
+
+##
+# @brief Render an svg to 8-bit RGBA pixels using CairoSVG
+#
+# @param svg:bytes The svg to render
+# @param width:int Width of the output in pixels
+# @param height:int Height of the output in pixels
+#
+# @return The rendered pixels, row by row from the top
+def rasterise_cairosvg(svg:bytes, width:int, height:int) -> bytes:
+    tree:object = cairosvg_parser.Tree(bytestring=svg)
+    surface:object = cairosvg_surface.PNGSurface(tree, None, 96, output_width=width, output_height=height)
+    surface.cairo.flush()
+
+    # Cairo holds premultiplied alpha in native-endian 32-bit words, one row per stride
+    stride:int = surface.cairo.get_stride()
+    pixels:ndarray = frombuffer(bytes(surface.cairo.get_data()), dtype=uint8).reshape(height, stride)[:, :4 * width].reshape(height, width, 4)
+    return unpremultiply(pixels[..., [2, 1, 0, 3] if byteorder == 'little' else [1, 2, 3, 0]]).tobytes()
+
+##
+# @brief Convert premultiplied-alpha RGBA pixels to straight alpha
+#
+# @param pixels:ndarray An h×w×4 array of premultiplied RGBA pixels
+#
+# @return An h×w×4 array of straight-alpha RGBA pixels
+def unpremultiply(pixels:ndarray) -> ndarray:
+    alpha:ndarray = pixels[..., 3:4].astype(uint16)
+    safe_alpha:ndarray = alpha.copy()
+    safe_alpha[safe_alpha == 0] = 1
+    out:ndarray = pixels.copy()
+    out[..., :3] = ((pixels[..., :3].astype(uint16) * 255 + safe_alpha // 2) // safe_alpha).clip(0, 255)
+    return out
+
+# Available backends, each takes the same arguments as `rasterise_wand`
+rasterisers:dict = {
+    'wand': rasterise_wand,
+    'cairosvg': rasterise_cairosvg,
+}
+
+# The module each backend requires
+rasteriser_modules:dict = {
+    'wand': 'wand',
+    'cairosvg': 'cairosvg',
+}
+
+##
+# @brief Check whether the module required by a rasteriser backend is installed
+#
+# @param rasteriser:str Name of the backend
+#
+# @return True if and only if the backend can be used
+def rasteriser_available(rasteriser:str) -> bool:
+    return rasteriser in rasterisers and find_spec(rasteriser_modules[rasteriser]) is not None
@@ -0,0 +1,81 @@
+# Copyright (C) Edward Jones
+
+from .path import dir_state
+from .profiling import profile_count
+from contextlib import contextmanager
+from os.path import getmtime, isdir
+from types import FunctionType
+
+# Inputs kept between runs, by kind and then key, or None if inputs are not being shared
+shared_inputs:dict = None
+
+
+##
+# @brief Share inputs which are read or computed during a run (such as the profile data and the cap meshes) with all the runs made within the body, for example the jobs of a batch.
+# Inputs read from files are keyed on their modification times and those found by listing directories on the files they contain, so an input whose files change between runs is read again, replacing the old one.
+#
+# @param store:dict Dictionary to keep the inputs in, to share them with later uses of the same store, or None to share them only within the body
+#
+# @return A context manager within which inputs are shared
+@contextmanager
+def sharing_inputs(store:dict=None):
+    global shared_inputs
+    outer_shared_inputs:dict = shared_inputs
+    if store is not None:
+        shared_inputs = store
+    elif shared_inputs is None:
+        shared_inputs = {}
+    try:
+        yield
+    finally:
+        shared_inputs = outer_shared_inputs
+
+##
+# @brief Obtain an input, reusing that of an earlier run if inputs are being shared
+#
+# @param kind:str The kind of input
+# @param source:str What the input is computed from, such as the name of a file
+# @param state:FunctionType Function which gives the state of the source (such as the modification time of a file, see `file_state` and `listing_state`), or None if it cannot be shared; it is only called when inputs are being shared, and the input is computed again and replaces the old one when the state changes
+# @param compute:FunctionType Function of no arguments which computes the input
+#
+# @return The input, which the caller must not modify other than to bring it up to date
+def shared_input(kind:str, source:str, state:FunctionType, compute:FunctionType) -> object:
+    if shared_inputs is None:
+        return compute()
+    source_state:object = state(source)
+    if source_state is None:
+        return compute()
+    cache:dict = shared_inputs.setdefault(kind, {})
+    if source in cache and cache[source][0] == source_state:
+        profile_count('shared-input-hits')
+    else:
+        cache[source] = (source_state, compute())
+    return cache[source][1]
+
+##
+# @brief Obtain a dictionary which persists between runs if inputs are being shared, for use as a cache
+#
+# @param kind:str The kind of data held in the dictionary
+#
+# @return A dictionary, empty on the first use
+def shared_dict(kind:str) -> dict:
+    if shared_inputs is None:
+        return {}
+    return shared_inputs.setdefault(kind, {})
+
+##
+# @brief Obtain the state of a file for sharing inputs read from it
+#
+# @param fname:str Path of the file
+#
+# @return The modification time of the file, or None if it is standard input or does not exist so that reading it reports the problem as usual
+def file_state(fname:str) -> float:
+    if fname == '-':
+        return None
+    try:
+        return getmtime(fname)
+    except OSError:
+        return None
+
+def listing_state(dname:str) -> tuple:
+    return dir_state(dname) if isdir(dname) else None
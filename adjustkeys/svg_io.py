@@ -0,0 +1,82 @@
+# Copyright (C) Edward Jones
+
+from mmap import ACCESS_READ, mmap
+from numpy import array, float64, ndarray, zeros
+from typing import BinaryIO
+
+svg_document_header:str = '<svg width="%f" height="%f" viewBox="0 0 %f %f" fill="none" xmlns="http://www.w3.org/2000/svg">\n'
+svg_document_footer:str = '</svg>\n'
+
+
+##
+# @brief Writes an svg document a group at a time, recording where each group lies in the file so it can be read back without parsing the document
+class SvgGroupWriter:
+    def __init__(self, fname:str, width:float, height:float):
+        self.fname:str = fname
+        self.f:BinaryIO = open(fname, 'wb')
+        self.offset:int = 0
+        self.spans:[(int, int)] = []
+        self.bounds:[(float, float, float, float)] = []
+        self._write(svg_document_header % (width, height, width, height))
+
+    def _write(self, content:str) -> int:
+        data:bytes = content.encode('utf-8')
+        self.f.write(data)
+        self.offset += len(data)
+        return len(data)
+
+    ##
+    # @brief Write a group of svg content
+    #
+    # @param parts:[str] Serialised svg content of the group, written one per line
+    # @param bounds:(float, float, float, float) The bounds (xmin, ymin, xmax, ymax) of the group's content
+    #
+    # @return Nothing
+    def write_group(self, parts:[str], bounds:(float, float, float, float)):
+        start:int = self.offset
+        length:int = sum(map(lambda p: self._write(p + '\n'), parts))
+        self.spans.append((start, length))
+        self.bounds.append(bounds)
+
+    ##
+    # @brief Finish the document and close the file
+    #
+    # @return An index of the groups written
+    def close(self) -> 'SvgGroups':
+        self._write(svg_document_footer)
+        self.f.close()
+        return SvgGroups(self.fname, self.spans, array(self.bounds, dtype=float64).reshape(-1, 4) if self.bounds != [] else zeros((0, 4)))
+
+    def __enter__(self) -> 'SvgGroupWriter':
+        return self
+
+    def __exit__(self, *_):
+        if not self.f.closed:
+            self.f.close()
+
+
+##
+# @brief Read-only sequence of the serialised groups of an svg written by an SvgGroupWriter, read from the file as needed
+class SvgGroups:
+    def __init__(self, fname:str, spans:[(int, int)], bounds:ndarray):
+        self.fname:str = fname
+        self.spans:[(int, int)] = spans
+        self.bounds:ndarray = bounds
+        self.f:BinaryIO = None
+        self.mm:mmap = None
+
+    def __enter__(self) -> 'SvgGroups':
+        self.f = open(self.fname, 'rb')
+        self.mm = mmap(self.f.fileno(), 0, access=ACCESS_READ)
+        return self
+
+    def __exit__(self, *_):
+        self.mm.close()
+        self.f.close()
+
+    def __len__(self) -> int:
+        return len(self.spans)
+
+    def __getitem__(self, i:int) -> bytes:
+        (start, length) = self.spans[i]
+        return self.mm[start:start + length]
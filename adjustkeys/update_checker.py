@@ -14,7 +14,7 @@ def check_update() -> bool:
     if resp:
         parsedResp:dict = safe_load(resp.text)
         if 'tag_name' in parsedResp:
-            printi('Latest version is %s, current version is %s' %(parsedResp['tag_name'], version))
+            printi('Latest version is %s, current version is %s', parsedResp['tag_name'], version)
             return version_is_outdated(version, parsedResp['tag_name'])
     printw('Failed to find out the name of the latest version from github')
     return False
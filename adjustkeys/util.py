@@ -2,6 +2,7 @@
 
 from decimal import Decimal
 from functools import reduce
+from .key import Key
 from .log import die
 
 
@@ -40,7 +41,8 @@ def list_intersection(a: list, b: list) -> list:
 
 ##
 # @brief The inner join of a pair of lists of dictionaries using pairs of keys and a condition between them.
-# Outputs the list of unions of dictionaries in the input lists which share the same values at the specified keys
+# Outputs the list of unions of dictionaries in the input lists which share the same values at the specified keys.
+# Equality joins are performed by hashing the values of `lbs` at `kb` and hence run in linear time, other conditions (and unhashable values) fall back to a nested-loop join.
 #
 # @param las:[dict] A  list of dictionaries
 # @param ka:object A key present in all of `las` used to join by cond
@@ -58,17 +60,13 @@ def inner_join(las: [dict],
         return []
 
     if cond is None:
-        cond = eq
+        try:
+            lb_index:dict = hash_index(lbs, kb)
+            return [ dict_union(la, lb) for la in las for lb in lb_index.get(safe_get(la, ka), []) ]
+        except TypeError:
+            cond = eq
 
-    return list(
-        reduce(
-            concat,
-            list(
-                map(
-                    lambda la: [
-                        dict_union(la, lb) for lb in lbs
-                        if cond(safe_get(la, ka), safe_get(lb, kb))
-                    ], las))))
+    return nested_loop_inner_join(las, ka, lbs, kb, cond)
 
 
 def left_outer_join(las:[dict], ka:object, lbs:[dict], kb:object, cond=None) -> [dict]:
@@ -78,9 +76,13 @@ def left_outer_join(las:[dict], ka:object, lbs:[dict], kb:object, cond=None) ->
         return las
 
     if cond is None:
-        cond = eq
+        try:
+            lb_index:dict = hash_index(lbs, kb)
+            return inner_join(las, ka, lbs, kb) + [ la for la in las if safe_get(la, ka) not in lb_index ]
+        except TypeError:
+            cond = eq
 
-    return inner_join(las, ka, lbs, kb, cond=cond) + list(filter(lambda la: not any(map(lambda lb: cond(la[ka], lb[kb]), lbs)), las))
+    return nested_loop_inner_join(las, ka, lbs, kb, cond) + list(filter(lambda la: not any(map(lambda lb: cond(la[ka], lb[kb]), lbs)), las))
 
 
 def right_outer_join(las:[dict], ka:object, lbs:[dict], kb:object, cond=None) -> [dict]:
@@ -90,9 +92,45 @@ def right_outer_join(las:[dict], ka:object, lbs:[dict], kb:object, cond=None) ->
         return lbs
 
     if cond is None:
-        cond = eq
+        try:
+            la_index:dict = hash_index(las, ka)
+            return inner_join(las, ka, lbs, kb) + [ lb for lb in lbs if safe_get(lb, kb) not in la_index ]
+        except TypeError:
+            cond = eq
 
-    return inner_join(las, ka, lbs, kb, cond=cond) + list(filter(lambda lb: not any(map(lambda la: cond(la[ka], lb[kb]), las)), lbs))
+    return nested_loop_inner_join(las, ka, lbs, kb, cond) + list(filter(lambda lb: not any(map(lambda la: cond(la[ka], lb[kb]), las)), lbs))
+
+
+##
+# @brief Inner join which compares every pair of rows, used for conditions other than equality
+#
+# @param las:[dict] A  list of dictionaries
+# @param ka:object A key present in all of `las` used to join by cond
+# @param lbs:[dict] Another list of dictionaries
+# @param kb:object A key present in all of `lbs` used to join by cond
+# @param cond Specify the condition between values
+#
+# @return A list of united dictionaries [union(la, lb) | ls <- las, lb <- lbs, cond(la[ka], lb[kb])]
+def nested_loop_inner_join(las:[dict], ka:object, lbs:[dict], kb:object, cond) -> [dict]:
+    return [ dict_union(la, lb) for la in las for lb in lbs if cond(safe_get(la, ka), safe_get(lb, kb)) ]
+
+
+##
+# @brief Index a list of dictionaries by their values at a given key, preserving the order in which they appear
+#
+# @param ds:[dict] A list of dictionaries
+# @param k:object The key to index by
+#
+# @return A dictionary mapping each value at `k` to the list of dictionaries in `ds` which have that value, raises TypeError if a value is unhashable
+def hash_index(ds:[dict], k:object) -> dict:
+    index:dict = {}
+    for d in ds:
+        v:object = safe_get(d, k)
+        if v in index:
+            index[v].append(d)
+        else:
+            index[v] = [d]
+    return index
 
 
 def eq(a: object, b: object) -> bool:
@@ -110,11 +148,12 @@ def eq(a: object, b: object) -> bool:
 #
 # @param *ds:[dict] A list of dictionaries
 #
-# @return The union of all ds
+# @return The union of all ds, which is a Key if any of the ds is a Key
 def dict_union(*ds:[dict]) -> dict:
-    def _dict_union(a:dict, b:dict) -> dict:
-        return dict(a, **b)
-    return dict(reduce(_dict_union, ds, {}))
+    ret:dict = Key() if any(map(lambda d: type(d) == Key, ds)) else {}
+    for d in ds:
+        ret.update(d)
+    return ret
 
 
 ##
@@ -141,7 +180,7 @@ def key_subst(a: dict, k1: object, k2: object) -> dict:
 def rem(d: dict, k) -> dict:
     if k not in d:
         die(f'Key {k} not in {d}')
-    t = dict(d)
+    t = d.copy()
     del t[k]
     return t
 
@@ -154,7 +193,7 @@ def rem(d: dict, k) -> dict:
 #
 # @return `d` without the entry at `k` if `k` is in `d`, otherwise `d`
 def rob_rem(d: dict, k) -> dict:
-    t = dict(d)
+    t = d.copy()
     if k in t:
         del t[k]
     return t
@@ -183,7 +222,7 @@ def safe_get(a: [object], i: object, default:object=None) -> object:
         return default
     elif type(a) == list:
         return a[i] if len(a) > i else default
-    elif type(a) == dict:
+    elif type(a) == dict or type(a) == Key:
         return a[i] if i in a else default
     else:
         die('Can\'t safely-get from unhandled type %s (more code is needed in %s)'
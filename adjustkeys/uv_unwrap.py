@@ -2,44 +2,60 @@
 
 from .log import printi
 from .lazy_import import LazyImport
+from numpy import append, array, diff, empty, float32, int32, maximum, ndarray, sort
 
 Matrix:type = LazyImport('mathutils', 'Matrix')
-MeshPolygon:type = LazyImport('bpy', 'types', 'MexhPolygon')
+Mesh:type = LazyImport('bpy', 'types', 'Mesh')
 Object:type = LazyImport('bpy', 'types', 'Object')
 Vector:type = LazyImport('mathutils', 'Vector')
 
 def uv_unwrap(obj:Object, objmin:Vector, objmax:Vector, partition_uv_by_face_direction:bool):
-    #  # Ensure object mode
-    #  origMode:str = context.object.mode
-    #  if origMode != 'OBJECT':
-        #  ops.object.mode_set(mode='OBJECT')
+    mesh:Mesh = obj.data
 
-    # Project vertices into uv-space, assuming upper-left most point is at
-    scale: Matrix = uv_scale(partition_uv_by_face_direction, objmin, objmax)
-    scale_x:float = scale[0][0]
-    scale_y:float = scale[1][1]
-    min_off:Vector = scale @ objmin
-    data = obj.data.uv_layers.active.data
-    vertices = obj.data.vertices
+    # Fetch the geometry in bulk
+    co:ndarray = empty(3 * len(mesh.vertices), dtype=float32)
+    mesh.vertices.foreach_get('co', co)
+    normals:ndarray = empty(3 * len(mesh.vertices), dtype=float32)
+    mesh.vertices.foreach_get('normal', normals)
+    loop_vertices:ndarray = empty(len(mesh.loops), dtype=int32)
+    mesh.loops.foreach_get('vertex_index', loop_vertices)
+    loop_starts:ndarray = empty(len(mesh.polygons), dtype=int32)
+    mesh.polygons.foreach_get('loop_start', loop_starts)
 
     printi('Projecting uv map...')
-    off_x:float = -min_off.x
-    for face in obj.data.polygons:
-        off_y:float = 1.0 + min_off.y
-        if partition_uv_by_face_direction and is_front_face(vertices, face):
-            off_y -= 0.5
-        for vert_idx, loop_idx in zip(face.vertices, face.loop_indices):
-            uv = data[loop_idx].uv
-            co = vertices[vert_idx].co
-            uv.x = scale_x * co.x + off_x
-            uv.y = scale_y * co.y + off_y
-
-    #  # Reinstate previous mode
-    #  if origMode != 'OBJECT':
-        #  ops.object.mode_set(mode=origMode)
+    uvs:ndarray = project_uvs(co.reshape(-1, 3), normals.reshape(-1, 3), loop_vertices, loop_starts, objmin, objmax, partition_uv_by_face_direction)
+    mesh.uv_layers.active.data.foreach_set('uv', uvs.ravel())
 
     printi('Done projecting uv map')
 
+##
+# @brief Compute the uv-coordinates of each loop of a mesh by projecting its vertices onto the x-y plane
+#
+# @param co:ndarray An n×3 array of vertex coordinates
+# @param normals:ndarray An n×3 array of vertex normals
+# @param loop_vertices:ndarray The index of the vertex used by each loop
+# @param loop_starts:ndarray The index of the first loop of each polygon
+# @param objmin:Vector The minimum point of the area to project into uv-space
+# @param objmax:Vector The maximum point of the area to project into uv-space
+# @param partition_uv_by_face_direction:bool Whether to place faces which face upwards and downwards in separate halves of the uv-space
+#
+# @return An m×2 array of uv-coordinates, one for each loop
+def project_uvs(co:ndarray, normals:ndarray, loop_vertices:ndarray, loop_starts:ndarray, objmin:Vector, objmax:Vector, partition_uv_by_face_direction:bool) -> ndarray:
+    # Project vertices into uv-space, assuming upper-left most point is at
+    scale: Matrix = uv_scale(partition_uv_by_face_direction, objmin, objmax)
+    min_off:Vector = scale @ objmin
+    scale_xy:ndarray = array((scale[0][0], scale[1][1]), dtype=float32)
+    off_xy:ndarray = array((-min_off.x, 1.0 + min_off.y), dtype=float32)
+
+    uvs:ndarray = co[loop_vertices, :2] * scale_xy + off_xy
+    if partition_uv_by_face_direction and len(loop_starts) != 0:
+        # A face is at the front if any of its vertices has a normal with non-negative y component
+        polygon_starts:ndarray = sort(loop_starts)
+        front_faces:ndarray = maximum.reduceat(normals[loop_vertices, 1], polygon_starts) >= 0.0
+        loop_totals:ndarray = diff(append(polygon_starts, len(loop_vertices)))
+        uvs[front_faces.repeat(loop_totals), 1] -= 0.5
+    return uvs
+
 
 # Assume that the top left-most point occupied space is at (0,0)
 def uv_scale(partition_uv_by_face_direction:bool, kbmin:Vector, kbmax:Vector) -> Matrix:
@@ -52,9 +68,6 @@ def uv_scale(partition_uv_by_face_direction:bool, kbmin:Vector, kbmax:Vector) ->
 
     return uv_scale_mat
 
-def is_front_face(vertices:list, f:MeshPolygon) -> bool:
-    return max(map(lambda vi: vertices[vi].normal @ Vector((0.0, 1.0, 0.0)), f.vertices)) >= 0.0
-
 # Assumes square matrix
 def diagonal(m:Matrix) -> [float]:
     return [ m[i][i] for i in range(0, len(m[0])) ]
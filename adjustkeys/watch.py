@@ -0,0 +1,97 @@
+# Copyright (C) Edward Jones
+
+from .exceptions import AdjustKeysException
+from .log import printe, printi, print_warnings
+from .path import dir_state
+from argparse import Namespace
+from os import stat, stat_result
+from os.path import exists, isdir
+from time import monotonic, sleep
+from types import FunctionType
+
+# Seconds between checks of the watched files
+watch_poll_interval:float = 0.25
+
+# Seconds for which the watched files must be left unchanged before they are acted upon, so that several saves in quick succession cause a single run
+watch_debounce_time:float = 0.5
+
+
+##
+# @brief Watches a set of files and directories by polling their sizes and modification times
+class FileWatcher:
+    def __init__(self, paths:[str], debounce_time:float=watch_debounce_time):
+        self.paths:[str] = paths
+        self.debounce_time:float = debounce_time
+        self.state:tuple = paths_state(paths)
+        self.changed_at:float = None
+
+    ##
+    # @brief Check the watched files
+    #
+    # @return True if and only if they have changed and have since been left unchanged for the debounce time
+    def poll(self) -> bool:
+        state:tuple = paths_state(self.paths)
+        if state != self.state:
+            self.state = state
+            self.changed_at = monotonic()
+        elif self.changed_at is not None and monotonic() - self.changed_at >= self.debounce_time:
+            self.changed_at = None
+            return True
+        return False
+
+##
+# @brief List the files and directories on which the outputs of a run depend, and which may be edited while watching
+#
+# @param pargs:Namespace Parsed arguments
+#
+# @return A list of paths
+def watched_paths(pargs:Namespace) -> [str]:
+    paths:[str] = [pargs.layout_file]
+    if pargs.adjust_glyphs:
+        paths += [pargs.glyph_map_file, pargs.glyph_dir]
+    if pargs.apply_colour_map:
+        paths.append(pargs.colour_map_file)
+    return paths
+
+def paths_state(paths:[str]) -> tuple:
+    state:list = []
+    for path in paths:
+        if not exists(path):
+            state.append((path, None, None))
+        elif isdir(path):
+            state.extend(dir_state(path))
+        else:
+            try:
+                fstat:stat_result = stat(path)
+                state.append((path, fstat.st_mtime_ns, fstat.st_size))
+            except OSError:
+                # Removed since it was checked, for example by an editor replacing it
+                state.append((path, None, None))
+    return tuple(state)
+
+##
+# @brief Run, then run again whenever the watched files change, until interrupted.
+# Errors in runs after the first are reported rather than raised, so that mistakes made while editing can be corrected without restarting.
+#
+# @param paths:[str] The files and directories to watch
+# @param run:FunctionType Function of no arguments which makes the outputs
+#
+# @return The output of the last successful run
+def watch(paths:[str], run:FunctionType) -> dict:
+    ret:dict = run()
+    watcher:FileWatcher = FileWatcher(paths)
+    printi('Watching %s for changes, press Ctrl+C to stop', ', '.join(paths))
+    try:
+        while True:
+            sleep(watch_poll_interval)
+            if watcher.poll():
+                printi('Changes detected, updating...')
+                try:
+                    ret = run()
+                except AdjustKeysException as akex:
+                    printe(str(akex))
+                print_warnings()
+                printi('Watching for changes')
+    except KeyboardInterrupt:
+        printi('Stopped watching')
+    return ret
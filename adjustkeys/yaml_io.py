@@ -1,6 +1,7 @@
 # Copyright (C) Edward Jones
 
 from .log import die, printi
+from .profiling import profile_stage
 from os.path import exists
 from re import search # Match
 from sys import stdin
@@ -17,8 +18,8 @@ def read_yaml(fname: str) -> dict:
     yaml_lines:[str]
     if fname == '-':
         printi(
-            'Reading %s from stdin, please either type something or have redirected a file in here'
-            % fname)
+            'Reading %s from stdin, please either type something or have redirected a file in here',
+            fname)
         yaml_lines = stdin.read().split('\n') # stdin.readlines() seems to do something silly with the symbols
     else:
         if exists(fname):
@@ -27,8 +28,9 @@ def read_yaml(fname: str) -> dict:
 
         else:
             die('Couldn\'t find or read file "%s"' % fname)
-    sanitised_yaml_string:str = '\n'.join(list(map(sanitise_yaml_line, yaml_lines)))
-    return safe_load(sanitised_yaml_string)
+    with profile_stage('yaml-load'):
+        sanitised_yaml_string:str = '\n'.join(list(map(sanitise_yaml_line, yaml_lines)))
+        return safe_load(sanitised_yaml_string)
 
 
 def sanitise_yaml_line(line:str) -> str:
@@ -0,0 +1,328 @@
+#!/usr/bin/python3
+# Copyright (C) Edward Jones
+
+from adjustkeys.geometry import kle_positions, layout_bounds, layout_columns
+from adjustkeys.mathutils_shim import install_mathutils_shim
+from adjustkeys.rasterisers import rasteriser_available, rasterisers
+from adjustkeys.util import concat, dict_union, eq, inner_join, right_outer_join, safe_get
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+from importlib import import_module
+from math import radians
+from multiprocessing import get_context
+from numpy import array, ndarray
+from os import devnull, remove
+from os.path import join
+from random import Random
+from sys import argv, exit, platform
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable
+
+
+def main(args:[str]) -> int:
+    ap:ArgumentParser = ArgumentParser(description='Micro-benchmarks for the adjustkeys pipeline')
+    ap.add_argument('benchmarks', metavar='benchmark', nargs='*', choices=[[]] + list(benchmarks.keys()), help='Benchmarks to run (default: all), one of: %s' % ', '.join(benchmarks.keys()))
+    ap.add_argument('-s', '--sizes', metavar='n', type=int, nargs='+', default=[100, 1000, 10000], help='Numbers of keys in the synthetic layouts')
+    ap.add_argument('-r', '--repeats', metavar='n', type=int, default=3, help='Number of times to repeat each measurement, the fastest is reported')
+    ap.add_argument('-u', '--uv-res', metavar='res', type=int, nargs='+', default=[1024, 2048, 4096], help='Resolutions of the uv images rendered by the rasteriser benchmark')
+    pargs:Namespace = ap.parse_args(args[1:])
+
+    for name in pargs.benchmarks if pargs.benchmarks != [] else benchmarks.keys():
+        print('## %s' % name)
+        benchmarks[name](pargs)
+    return 0
+
+
+def time_best(f:Callable, repeats:int) -> float:
+    best:float = None
+    for _ in range(repeats):
+        start:float = perf_counter()
+        f()
+        duration:float = perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+##
+# @brief Make mathutils importable, substituting the shim used by headless runs if it is not installed
+#
+# @return True if and only if the real mathutils module is available
+def use_mathutils() -> bool:
+    install_mathutils_shim()
+    return import_module('mathutils').__name__ == 'mathutils'
+
+
+def print_table(header:[str], rows:[[object]]):
+    cells:[[str]] = [header] + [ [ c if type(c) == str else '%.4f' % c for c in row ] for row in rows ]
+    widths:[int] = [ max(map(lambda r: len(r[i]), cells)) for i in range(len(header)) ]
+    for row in cells:
+        print('  '.join(map(lambda p: p[1].rjust(widths[p[0]]), enumerate(row))))
+
+
+##
+# @brief The nested-loop inner join as it was before equality joins were hashed, kept for comparison
+def legacy_inner_join(las:[dict], ka:object, lbs:[dict], kb:object, cond=None) -> [dict]:
+    if las == [] or lbs == []:
+        return []
+    if cond is None:
+        cond = eq
+    return list(reduce(concat, list(map(lambda la: [ dict_union(la, lb) for lb in lbs if cond(safe_get(la, ka), safe_get(lb, kb)) ], las))))
+
+##
+# @brief The nested-loop right outer join as it was before equality joins were hashed, kept for comparison
+def legacy_right_outer_join(las:[dict], ka:object, lbs:[dict], kb:object, cond=None) -> [dict]:
+    if lbs == []:
+        return []
+    elif las == []:
+        return lbs
+    if cond is None:
+        cond = eq
+    return legacy_inner_join(las, ka, lbs, kb, cond=cond) + list(filter(lambda lb: not any(map(lambda la: cond(la[ka], lb[kb]), las)), lbs))
+
+
+def synthetic_join_relations(n:int) -> dict:
+    widths:[float] = [1.0, 1.25, 1.5, 1.75, 2.0, 2.25, 2.75, 6.25]
+    profile_parts:[str] = ['R1', 'R2', 'R3', 'R4']
+    return {
+        'layout': [ { 'key': 'key-%d' % i, 'width': widths[i % len(widths)], 'profile-part': profile_parts[i % len(profile_parts)] } for i in range(n) ],
+        'glyph-map': [ { 'key': 'key-%d' % i, 'glyph': 'glyph-%d' % (i % (n // 2 + 1)) } for i in range(0, n, 3) ],
+        'glyphs': [ { 'glyph': 'glyph-%d' % i, 'src': 'glyph-%d.svg' % i } for i in range(n // 2 + 1) ],
+        'x-offsets': [ { 'width': w, 'p-off-x': w / 2.0 } for w in widths ],
+        'y-offsets': [ { 'profile-part': p, 'p-off-y': 0.5 } for p in profile_parts ],
+    }
+
+##
+# @brief Run the same sequence of joins as adjustglyphs.collect_data using the given join functions
+def join_pipeline(rels:dict, inner:Callable, right_outer:Callable) -> [dict]:
+    key_offsets:[dict] = inner(rels['glyph-map'], 'glyph', rels['glyphs'], 'glyph')
+    glyph_offset_layout:[dict] = right_outer(key_offsets, 'key', rels['layout'], 'key')
+    x_offset_keys:[dict] = inner(glyph_offset_layout, 'width', rels['x-offsets'], 'width')
+    return inner(x_offset_keys, 'profile-part', rels['y-offsets'], 'profile-part')
+
+def bench_joins(pargs:Namespace):
+    rows:[[object]] = []
+    for n in pargs.sizes:
+        rels:dict = synthetic_join_relations(n)
+        if join_pipeline(rels, inner_join, right_outer_join) != join_pipeline(rels, legacy_inner_join, legacy_right_outer_join):
+            print('Join results differ for %d keys!' % n)
+            exit(1)
+        hashed:float = time_best(lambda: join_pipeline(rels, inner_join, right_outer_join), pargs.repeats)
+        nested:float = time_best(lambda: join_pipeline(rels, legacy_inner_join, legacy_right_outer_join), 1 if n > 1000 else pargs.repeats)
+        rows.append([str(n), nested, hashed, '%.1fx' % (nested / hashed)])
+    print_table(['keys', 'nested-loop (s)', 'hashed (s)', 'speed-up'], rows)
+
+
+##
+# @brief Generate a parsed layout of `n` keys in rows of 15 where every fifth row starts a rotated cluster
+def synthetic_parsed_layout(n:int) -> [dict]:
+    rand:Random = Random(n)
+    layout:[dict] = []
+    rotation:float = 0.0
+    origin:tuple = (0.0, 0.0)
+    for i in range(n):
+        (row, col) = divmod(i, 15)
+        if col == 0 and row % 5 == 0:
+            rotation = radians(-rand.choice([-30.0, 0.0, 15.0, 45.0, 90.0]))
+            origin = (rand.random() * 10.0, row + rand.random())
+        width:float = rand.choice([1.0, 1.0, 1.25, 1.5, 2.0])
+        layout.append({
+            'key': 'key-%d' % i,
+            'rotation': rotation,
+            'placement': (origin[0], origin[1], rotation, float(col), float(row % 5)),
+            'width': width,
+            'height': 1.0,
+            'secondary-width': width,
+            'secondary-height': rand.choice([1.0, 1.0, 2.0]),
+        })
+    return layout
+
+##
+# @brief Compute key positions one at a time using mathutils, as the layout parser did before
+def legacy_kle_positions(placements:[tuple]) -> list:
+    from mathutils import Matrix, Vector
+    return [ Vector((rx, ry)) + Matrix.Rotation(-r, 2) @ Vector((x, y)) for (rx, ry, r, x, y) in placements ]
+
+##
+# @brief Compute the layout dimensions one key at a time using mathutils, as was done before
+def legacy_compute_layout_dims(layout:[dict]) -> tuple:
+    from mathutils import Matrix, Vector
+    def point_enumerator(v:Vector) -> Matrix:
+        return Matrix([
+            (0.0, 0.0,  v[0], v[0]),
+            (0.0, v[1], 0.0,  v[1])
+        ])
+    xmin = 0.0
+    ymin = 0.0
+    xmax = 1.0
+    ymax = 1.0
+    for cap in layout:
+        rot:Matrix = Matrix.Rotation(-cap['rotation'], 2)
+        kle_pos_mat:Matrix = Matrix([[cap['kle-pos'][0]] * 4, [cap['kle-pos'][1]] * 4])
+        primary_points:Matrix = kle_pos_mat + rot @ point_enumerator(Vector((cap['width'], cap['height'])))
+        secondary_points:Matrix = kle_pos_mat + rot @ point_enumerator(Vector((cap['secondary-width'], cap['secondary-height'])))
+        xmin = min(xmin, *primary_points[0], *secondary_points[0])
+        ymin = min(ymin, *primary_points[1], *secondary_points[1])
+        xmax = max(xmax, *primary_points[0], *secondary_points[0])
+        ymax = max(ymax, *primary_points[1], *secondary_points[1])
+    return (Vector((xmin, ymin)), Vector((xmax, ymax)))
+
+def batch_geometry(layout:[dict]) -> tuple:
+    placements:ndarray = array([ k['placement'] for k in layout ])
+    positions:ndarray = kle_positions(placements[:, 0:2], placements[:, 2], placements[:, 3:5])
+    for k,p in zip(layout, positions):
+        k['kle-pos'] = p
+    return layout_bounds(layout_columns(layout))
+
+def legacy_geometry(layout:[dict]) -> tuple:
+    for k,p in zip(layout, legacy_kle_positions([ k['placement'] for k in layout ])):
+        k['kle-pos'] = p
+    return legacy_compute_layout_dims(layout)
+
+def bench_geometry(pargs:Namespace):
+    compare_legacy:bool = use_mathutils()
+    if not compare_legacy:
+        print('Not comparing against the per-key implementation, the mathutils module is required to run it')
+    rows:[[object]] = []
+    for n in pargs.sizes:
+        layout:[dict] = synthetic_parsed_layout(n)
+        batched:float = time_best(lambda: batch_geometry(layout), pargs.repeats)
+        if not compare_legacy:
+            rows.append([str(n), 'n/a', batched, 'n/a'])
+            continue
+        (batch_lo, batch_hi) = batch_geometry(layout)
+        (legacy_lo, legacy_hi) = legacy_geometry(layout)
+        if max(map(abs, list(batch_lo - array(legacy_lo)) + list(batch_hi - array(legacy_hi)))) > 1e-4:
+            print('Layout bounds differ for %d keys!' % n)
+            exit(1)
+        legacy:float = time_best(lambda: legacy_geometry(layout), pargs.repeats)
+        rows.append([str(n), legacy, batched, '%.1fx' % (legacy / batched)])
+    print_table(['keys', 'per-key (s)', 'batched (s)', 'speed-up'], rows)
+
+
+##
+# @brief Write the uv svg of the example layout
+#
+# @param svg_path:str Name of the svg file to write
+#
+# @return The index of the svg groups written, the size of the svg canvas and the options used
+def example_uv_svg(svg_path:str) -> tuple:
+    from adjustkeys.adjustglyphs import write_uv_svg
+    from adjustkeys.args import parse_args
+    from adjustkeys.colour_map_parser import parse_colour_map
+    from adjustkeys.colour_resolver import colourise_layout
+    from adjustkeys.layout import compute_layout_dims, get_layout
+    from adjustkeys.log import init_logging
+    from adjustkeys.yaml_io import read_yaml
+    pargs:Namespace = parse_args(({ 'verbosity': 0 },))
+    init_logging(pargs)
+    profile_data:dict = read_yaml(join(pargs.cap_dir, 'profile_data.yml'))
+    layout:[dict] = get_layout(pargs.layout_file, profile_data, pargs.apply_colour_map)
+    (layout_min_point, layout_max_point) = compute_layout_dims(layout)
+    coloured_layout:[dict] = colourise_layout(pargs.layout_file, layout, parse_colour_map(pargs.colour_map_file))
+    (svg_groups, svg_dims, _) = write_uv_svg(coloured_layout, profile_data, layout_min_point, layout_max_point, read_yaml(pargs.glyph_map_file), svg_path, pargs)
+    return (svg_groups, (svg_dims.x, svg_dims.y), pargs)
+
+##
+# @brief Rasterise the uv svg in the current process, intended to be run in a fresh process so its peak memory use can be measured alone
+#
+# @return The wall time taken and the peak resident set size of the process in MiB (or None if unknown)
+def rasterise_example(svg_groups:object, svg_dims:tuple, uv_res:int, rasteriser:str, png_path:str, example_pargs:Namespace, cache_dir:str=None) -> tuple:
+    from adjustkeys.log import init_logging
+    from adjustkeys.raster import rasterise_svg_groups
+    init_logging(example_pargs)
+    m:float = min(svg_dims)
+    image_dims:tuple = (int(uv_res * svg_dims[0] / m), int(uv_res * svg_dims[1] / m))
+    start:float = perf_counter()
+    with svg_groups:
+        rasterise_svg_groups(svg_groups, svg_groups.bounds, svg_dims, image_dims, png_path, example_pargs.uv_tile_size, 1, rasteriser, cache_dir)
+    duration:float = perf_counter() - start
+    remove(png_path)
+    return (duration, peak_rss())
+
+def peak_rss() -> float:
+    try:
+        from resource import getrusage, RUSAGE_SELF
+    except ImportError:
+        return None
+    # Linux reports kibibytes, macOS reports bytes
+    return getrusage(RUSAGE_SELF).ru_maxrss / (1024.0 * 1024.0 if platform == 'darwin' else 1024.0)
+
+def bench_rasterisers(pargs:Namespace):
+    install_mathutils_shim()
+    available:[str] = list(filter(rasteriser_available, rasterisers.keys()))
+    for rasteriser in rasterisers.keys():
+        if rasteriser not in available:
+            print('Skipping %s, its module is not installed' % rasteriser)
+    if available == []:
+        return
+
+    # The tiled renderer is used by default, the per-key cache only by incremental runs, whose first run starts cold and later ones find most keys cached
+    modes:[str] = ['tiled', 'per-key cold', 'per-key warm']
+    rows:[[object]] = []
+    with TemporaryDirectory() as tmp_dir:
+        (svg_groups, svg_dims, example_pargs) = example_uv_svg(join(tmp_dir, 'uv.svg'))
+        for uv_res in pargs.uv_res:
+            for rasteriser in available:
+                for mode in modes:
+                    # Each rendering happens in a fresh process so that peak memory use is not shared between measurements
+                    results:[tuple] = []
+                    for _ in range(pargs.repeats):
+                        with TemporaryDirectory() as cache_dir:
+                            if mode == 'per-key warm':
+                                with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                                    executor.submit(rasterise_example, svg_groups, svg_dims, uv_res, rasteriser, join(tmp_dir, 'uv.png'), example_pargs, cache_dir).result()
+                            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                                results.append(executor.submit(rasterise_example, svg_groups, svg_dims, uv_res, rasteriser, join(tmp_dir, 'uv.png'), example_pargs, cache_dir if mode != 'tiled' else None).result())
+                    rss:[float] = [ r[1] for r in results if r[1] is not None ]
+                    rows.append([str(uv_res), rasteriser, mode, min(map(lambda r: r[0], results)), '%.1f' % max(rss) if rss != [] else 'n/a'])
+    print_table(['uv-res', 'rasteriser', 'mode', 'wall (s)', 'peak rss (MiB)'], rows)
+
+
+##
+# @brief Log a message about each key as the pipeline does, either formatting each message before the call or passing its values for printi to format
+def log_keys(layout:[dict], deferred:bool):
+    from adjustkeys.log import printi
+    if deferred:
+        for k in layout:
+            printi('Computing cap margin offset of keycap "%s"', k['key'])
+            printi('Placing key "%s" at %s with rotation %s', k['key'], k['kle-pos'], k['rotation'])
+    else:
+        for k in layout:
+            printi('Computing cap margin offset of keycap "%s"' % k['key'])
+            printi('Placing key "%s" at %s with rotation %s' % (k['key'], k['kle-pos'], k['rotation']))
+
+def bench_logging(pargs:Namespace):
+    import adjustkeys.log as log
+    install_mathutils_shim()
+    from mathutils import Vector
+    rows:[[object]] = []
+    stderr:object = log.stderr
+    with open(devnull, 'w') as null:
+        log.stderr = null
+        try:
+            for n in pargs.sizes:
+                layout:[dict] = synthetic_parsed_layout(n)
+                for k in layout:
+                    k['kle-pos'] = Vector(k['placement'][3:5])
+                # Informational messages are shown at the default verbosity of 2 and suppressed below it
+                for verbosity in [2, 1]:
+                    log.init_logging(Namespace(verbosity=verbosity, fatal_warnings=False))
+                    eager:float = time_best(lambda: log_keys(layout, False), pargs.repeats)
+                    deferred:float = time_best(lambda: log_keys(layout, True), pargs.repeats)
+                    rows.append([str(n), str(verbosity), eager, deferred, '%.1fx' % (eager / deferred)])
+        finally:
+            log.stderr = stderr
+    print_table(['keys', 'verbosity', 'eager (s)', 'deferred (s)', 'speed-up'], rows)
+
+
+benchmarks:dict = {
+    'geometry': bench_geometry,
+    'joins': bench_joins,
+    'logging': bench_logging,
+    'rasterisers': bench_rasterisers,
+}
+
+if __name__ == '__main__':
+    exit(main(argv))
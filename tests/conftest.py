@@ -0,0 +1,43 @@
+# Copyright (C) Edward Jones
+
+from adjustkeys.mesh_cache import extract_mesh_data, file_hash, mesh_cache_format_version, write_mesh_data
+from adjustkeys.obj_io import read_obj
+from adjustkeys.path import adjustkeys_path
+from glob import glob
+from numpy import ndarray, zeros
+from os.path import join
+from pytest import fixture
+
+cap_dir:str = join(adjustkeys_path, 'profiles', 'kat')
+
+##
+# @brief Stand-in for a sequence of Blender mesh elements, holding the values of each attribute
+class FakeElements:
+    def __init__(self, n:int, **attrs:ndarray):
+        self.n = n
+        self.attrs = attrs
+
+    def __len__(self) -> int:
+        return self.n
+
+    def foreach_get(self, attr:str, out:ndarray):
+        out[:] = self.attrs[attr].ravel()
+
+##
+# @brief Stand-in for the mesh made by Blender's obj importer, which keeps vertices in the axes of the file
+class FakeMesh:
+    def __init__(self, cap_source:str):
+        obj:dict = read_obj(cap_source)
+        num_faces:int = len(obj['face-sizes'])
+        self.vertices = FakeElements(len(obj['v']), co=obj['v'][:, :3])
+        self.loops = FakeElements(len(obj['face-v']), vertex_index=obj['face-v'], normal=zeros((len(obj['face-v']), 3)))
+        self.polygons = FakeElements(num_faces, loop_start=obj['face-starts'], loop_total=obj['face-sizes'], use_smooth=zeros(num_faces, dtype=bool))
+
+##
+# @brief A cache directory holding the meshes of the kat keycaps as Blender would import them, so runs which use it place caps as they would in Blender
+@fixture
+def blender_mesh_cache(tmp_path) -> str:
+    cache_dir:str = str(tmp_path / 'blender-cache')
+    for cap_source in glob(join(cap_dir, '*.obj')):
+        write_mesh_data(join(cache_dir, 'meshes', '%s-v%d.npz' % (file_hash(cap_source), mesh_cache_format_version)), extract_mesh_data(FakeMesh(cap_source)))
+    return cache_dir
@@ -0,0 +1,52 @@
+# Copyright (C) Edward Jones
+
+from adjustkeys.adjustkeys import adjustkeys
+from adjustkeys.png_io import read_png
+from adjustkeys.rasterisers import rasteriser_available, rasterisers
+from conftest import cap_dir
+from json import load
+from pytest import approx, skip
+from yaml import dump
+
+def run_options(tmp_path, adjust_glyphs:bool) -> dict:
+    return { 'cap_dir': cap_dir, 'headless': True, 'uv_res': 128, 'verbosity': 0, 'adjust_glyphs': adjust_glyphs, 'apply_colour_map': adjust_glyphs, 'cache_dir': str(tmp_path / 'cache'), 'use_cache': False }
+
+##
+# @brief Run a batch in parallel and, separately, each of its jobs with the keycap meshes Blender would import
+#
+# @return Pairs of the results of each job of the batch and the corresponding Blender-path run
+def batch_and_blender_runs(tmp_path, blender_mesh_cache:str, opts:dict) -> [(dict, dict)]:
+    jobs:[dict] = [ { 'headless_out': str(tmp_path / 'batch' / name), 'alignment': alignment } for name,alignment in [('a', 'middle-centre'), ('b', 'top-left')] ]
+    batch_file:str = str(tmp_path / 'batch.yml')
+    with open(batch_file, 'w') as f:
+        dump(jobs, f)
+    batch_results:[dict] = adjustkeys(dict(opts, batch_file=batch_file, jobs=2))['batch']
+    blender_results:[dict] = [ adjustkeys(dict(opts, **dict(job, headless_out=str(tmp_path / 'blender' / str(i))), use_cache=True, cache_dir=blender_mesh_cache, incremental=False)) for i,job in enumerate(jobs) ]
+    return list(zip([ r['result'] for r in batch_results ], blender_results))
+
+def manifest_keys(result:dict) -> [dict]:
+    with open(result['manifest-path']) as f:
+        return load(f)['keys']
+
+def assert_same_placements(batch_result:dict, blender_result:dict):
+    batch_keys:[dict] = manifest_keys(batch_result)
+    blender_keys:[dict] = manifest_keys(blender_result)
+    assert len(batch_keys) == len(blender_keys) != 0
+    for batch_key,blender_key in zip(batch_keys, blender_keys):
+        assert batch_key['key'] == blender_key['key']
+        for field in ['margin-offset', 'cap-pos', 'glyph-pos', 'svg-bounds']:
+            assert (field in batch_key) == (field in blender_key)
+            if field in batch_key:
+                assert batch_key[field] == approx(blender_key[field], abs=1e-4)
+
+def test_parallel_batch_places_caps_as_blender(tmp_path, blender_mesh_cache):
+    for batch_result,blender_result in batch_and_blender_runs(tmp_path, blender_mesh_cache, run_options(tmp_path, False)):
+        assert_same_placements(batch_result, blender_result)
+
+def test_parallel_batch_textures_match_blender(tmp_path, blender_mesh_cache):
+    available:[str] = [ r for r in rasterisers if rasteriser_available(r) ]
+    if available == []:
+        skip('No svg rasteriser is installed')
+    for batch_result,blender_result in batch_and_blender_runs(tmp_path, blender_mesh_cache, dict(run_options(tmp_path, True), rasteriser=available[0])):
+        assert_same_placements(batch_result, blender_result)
+        assert (read_png(batch_result['uv-image-path']) == read_png(blender_result['uv-image-path'])).all()
@@ -0,0 +1,53 @@
+# Copyright (C) Edward Jones
+
+from adjustkeys.mathutils_shim import install_mathutils_shim
+install_mathutils_shim()
+
+import adjustkeys.colour_map_parser as colour_map_parser
+from adjustkeys.colour_map_parser import compile_cond
+from adjustkeys.colour_resolver import colourise_layout
+from mathutils import Vector
+from pytest import raises
+from warnings import catch_warnings, simplefilter
+
+def example_layout() -> [dict]:
+    return [ { 'key': 'k%d' % i, 'kle-pos': Vector((float(i % 4), float(i // 4))), 'secondary-width': 1.0, 'secondary-height': 1.0, 'rotation': 0.0 } for i in range(12) ]
+
+def colour(layout:[dict], conds:[dict]) -> [str]:
+    colour_map:[dict] = [ { 'name': 'rule-%d' % i, 'cap-style': 'c%d' % i, 'matcher': compile_cond(cond) } for i,cond in enumerate(conds) ]
+    return [ key['cap-style'] for key in colourise_layout('layout.yml', layout, colour_map) ]
+
+def per_key_colour(layout:[dict], conds:[dict]) -> [str]:
+    # Keys not indexed in the layout context are evaluated one at a time
+    colour_map:[dict] = [ { 'name': 'rule-%d' % i, 'cap-style': 'c%d' % i, 'matcher': compile_cond(cond) } for i,cond in enumerate(conds) ]
+    bound:list = [ (rule, rule['matcher']({ 'layout-file-name': 'layout', 'layout-file-path': 'layout.yml' })) for rule in colour_map ]
+    return [ next((rule['cap-style'] for rule,matches in bound if matches(key)), None) for key in layout ]
+
+def test_arithmetic():
+    conds:[dict] = [{ 'key-pos': 'x >= 2 & 1/(x + 1) < 0.3' }, { 'key-pos': 'y ^^ 0.5 > 1.2' }]
+    assert colour(example_layout(), conds) == per_key_colour(example_layout(), conds)
+
+def test_division_by_zero():
+    # Both operands of logical operators are evaluated, so guards do not prevent the error
+    for cond in ['1/x < 0.6', 'x != 0 & 1/x < 0.6']:
+        for f in [colour, per_key_colour]:
+            with catch_warnings():
+                simplefilter('error', RuntimeWarning)
+                with raises(ZeroDivisionError):
+                    f(example_layout(), [{ 'key-pos': cond }])
+
+def test_exclusive_or():
+    conds:[dict] = [{ 'key-pos': 'x > 1 ^ y > 1' }]
+    assert colour(example_layout(), conds) == per_key_colour(example_layout(), conds)
+    for f in [colour, per_key_colour]:
+        with raises(TypeError):
+            f(example_layout(), [{ 'key-pos': 'x ^ y' }])
+
+def test_unreached_conditions_are_not_evaluated(monkeypatch):
+    evaluated:[int] = []
+    key_pos_mask = colour_map_parser.key_pos_mask
+    monkeypatch.setattr(colour_map_parser, 'key_pos_mask', lambda *args: evaluated.append(1) or key_pos_mask(*args))
+    assert colour(example_layout(), [{ 'key-name': '.*' }, { 'key-pos': 'x > 1' }]) == ['c0'] * 12
+    assert evaluated == []
+    assert colour(example_layout(), [{ 'key-pos': 'x > 1' }]) == [ 'c0' if i % 4 > 1 else None for i in range(12) ]
+    assert evaluated == [1]
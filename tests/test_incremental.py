@@ -0,0 +1,68 @@
+# Copyright (C) Edward Jones
+
+import adjustkeys.incremental as incremental
+import adjustkeys.shared_inputs as shared_inputs
+from adjustkeys.adjustglyphs import get_glyph_svg_body, glyph_files
+from adjustkeys.adjustkeys import get_colour_map
+from adjustkeys.args import parse_args
+from adjustkeys.exceptions import AdjustKeysException
+from adjustkeys.path import adjustkeys_path
+from adjustkeys.shared_inputs import sharing_inputs
+from argparse import Namespace
+from mathutils import Vector
+from os import remove, utime
+from os.path import join
+from pytest import raises
+
+profile_data:dict = { 'unit-length': 19.05, 'scale': 0.01 }
+
+def coloured_layout(colour:str) -> [dict]:
+    return [ { 'key': 'k%d' % i, 'cap-name': 'R1-1_00u', 'kle-pos': Vector((float(i), 0.0)), 'rotation': 0.0, 'width': 1.0, 'height': 1.0, 'secondary-width': 1.0, 'secondary-height': 1.0, 'cap-style': colour, 'glyph-style': colour } for i in range(3) ]
+
+def test_reused_caps_take_new_colours(monkeypatch):
+    made:[dict] = []
+    def adjust_caps(layout, colour_map, profile_data, collection, layout_min_point, layout_max_point, pargs) -> dict:
+        made.append(layout)
+        return { 'keycaps-model': object(), '~caps-with-margin-offsets': incremental.get_placed_caps(layout, colour_map, profile_data, collection, pargs) }
+    monkeypatch.setattr(incremental, 'adjust_caps', adjust_caps)
+    monkeypatch.setattr(incremental, 'models_name', lambda _: 'capmodel')
+    monkeypatch.setattr(incremental, 'models_exist', lambda *_: True)
+    monkeypatch.setattr(incremental, 'previous_stages', {})
+
+    pargs:Namespace = parse_args(({ 'cap_dir': join(adjustkeys_path, 'profiles', 'kat'), 'layout_file': join(adjustkeys_path, 'examples', 'layout.yml'), 'use_cache': False, 'verbosity': 0 },))
+    with sharing_inputs():
+        for colour in ['ff0000', '0000ff']:
+            model_data:dict = incremental.incremental_adjust_caps(coloured_layout(colour), None, profile_data, None, Vector((0.0, 0.0)), Vector((3.0, 1.0)), pargs)
+            assert [ c['cap-style'] for c in model_data['~caps-with-margin-offsets'] ] == [colour] * 3
+    assert len(made) == 1
+
+def test_shared_listings_follow_directory_changes(tmp_path):
+    svg:bytes = b'<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"><path id="a" d="M0 0"/></svg>'
+    for name in ['a.svg', 'b.svg']:
+        (tmp_path / name).write_bytes(svg)
+    with sharing_inputs():
+        assert sorted(glyph_files(str(tmp_path))) == [str(tmp_path / 'a.svg'), str(tmp_path / 'b.svg')]
+        (tmp_path / 'c.svg').write_bytes(svg)
+        remove(str(tmp_path / 'a.svg'))
+        assert sorted(glyph_files(str(tmp_path))) == [str(tmp_path / 'b.svg'), str(tmp_path / 'c.svg')]
+
+def test_glyph_bodies_are_replaced_when_changed(tmp_path):
+    src:str = str(tmp_path / 'a.svg')
+    cache:dict = {}
+    for i,colour in enumerate(['red', 'blue']):
+        with open(src, 'w', encoding='utf-8') as f:
+            f.write('<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"><path id="a" stroke="%s" d="M0 0"/></svg>' % colour)
+        utime(src, (i, i))
+        assert colour in get_glyph_svg_body(src, '^$', False, cache)
+    assert list(cache) == [src] and len(cache[src][1]) == 1
+
+def test_inputs_are_only_keyed_when_shared(monkeypatch):
+    def getmtime(fname:str) -> float:
+        raise AssertionError('Keyed "%s" outside of sharing' % fname)
+    monkeypatch.setattr(shared_inputs, 'getmtime', getmtime)
+    assert get_colour_map(join(adjustkeys_path, 'examples', 'colour-map.yml')) != []
+
+def test_missing_shared_inputs_are_reported(tmp_path):
+    with sharing_inputs():
+        with raises(AdjustKeysException, match='Couldn\'t find or read file'):
+            get_colour_map(str(tmp_path / 'missing.yml'))
@@ -0,0 +1,30 @@
+# Copyright (C) Edward Jones
+
+from adjustkeys.adjustcaps import get_data
+from adjustkeys.mesh_cache import extract_mesh_data, mesh_max_point, mesh_min_point, read_mesh_vertices
+from conftest import FakeMesh, cap_dir
+from mathutils import Vector
+from os.path import join
+from pytest import approx
+
+profile_data:dict = { 'unit-length': 19.05, 'scale': 0.01 }
+
+def layout(cap_names:[str]) -> [dict]:
+    return [ { 'key': 'k%d' % i, 'cap-name': c, 'kle-pos': Vector((float(i), 0.0)), 'rotation': 0.0, 'width': 1.0, 'height': 1.0, 'secondary-width': 1.0, 'secondary-height': 1.0 } for i,c in enumerate(cap_names) ]
+
+def test_headless_vertices_match_blender_mesh():
+    cap_source:str = join(cap_dir, 'R4-1_00u.obj')
+    blender_mesh:dict = extract_mesh_data(FakeMesh(cap_source))
+    headless_mesh:dict = read_mesh_vertices(cap_source)
+    assert mesh_min_point(headless_mesh) == approx(mesh_min_point(blender_mesh))
+    assert mesh_max_point(headless_mesh) == approx(mesh_max_point(blender_mesh))
+
+def test_headless_margins_match_blender_path(blender_mesh_cache):
+    cap_names:[str] = ['R4-1_00u', 'R1-1_00u']
+    blender_caps:[dict] = get_data(layout(cap_names), cap_dir, blender_mesh_cache, None, None, profile_data)
+    headless_caps:[dict] = get_data(layout(cap_names), cap_dir, None, None, None, profile_data)
+    assert [ 'loop-vertices' in c['cap-mesh'] for c in blender_caps ] == [True, True]
+    assert [ 'loop-vertices' in c['cap-mesh'] for c in headless_caps ] == [False, False]
+    for blender_cap,headless_cap in zip(blender_caps, headless_caps):
+        assert tuple(headless_cap['margin-offset']) == approx(tuple(blender_cap['margin-offset']), abs=1e-5)
+    assert tuple(headless_caps[0]['margin-offset']) == approx((0.425, 0.425), abs=1e-3)
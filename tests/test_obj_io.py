@@ -0,0 +1,53 @@
+# Copyright (C) Edward Jones
+
+from adjustkeys.obj_io import read_obj, write_obj
+from adjustkeys.path import adjustkeys_path
+from numpy import ndarray
+from os.path import join
+
+mixed_corner_obj:bytes = b'''mtllib cap.mtl
+o cap
+v 0 0 0
+v 1 0 0
+v 0 1 0
+v 1 1 0
+vt 0 0
+vt 1 1
+vn 0 0 1
+usemtl Default
+s off
+f 1/1 2//1 3/2
+f 2//1 4/2 3//1
+g rest
+f -3/-2 -2//-1 -1/-1
+'''
+
+def assert_objs_equal(a:dict, b:dict):
+    assert a.keys() == b.keys()
+    for k in a:
+        if type(a[k]) == ndarray:
+            assert a[k].shape == b[k].shape and (a[k] == b[k]).all(), k
+        else:
+            assert a[k] == b[k], k
+
+def test_mixed_corner_forms(tmp_path):
+    fname:str = str(tmp_path / 'cap.obj')
+    with open(fname, 'wb') as f:
+        f.write(mixed_corner_obj)
+    obj:dict = read_obj(fname)
+    assert obj['face-v'].tolist() == [0, 1, 2, 1, 3, 2, 1, 2, 3]
+    assert obj['face-vt'].tolist() == [0, -1, 1, -1, 1, -1, 0, -1, 1]
+    assert obj['face-vn'].tolist() == [-1, 0, -1, 0, -1, 0, -1, 0, -1]
+    assert obj['face-sizes'].tolist() == [3, 3, 3]
+    assert obj['states'] == [(0, 'o', 'cap'), (0, 'usemtl', 'Default'), (0, 's', 'off'), (2, 'g', 'rest')]
+    assert obj['mtllib'] == ['cap.mtl']
+
+def test_round_trip(tmp_path):
+    for src in [join(adjustkeys_path, 'profiles', 'kat', 'R1-1_00u.obj'), str(tmp_path / 'mixed.obj')]:
+        if src.endswith('mixed.obj'):
+            with open(src, 'wb') as f:
+                f.write(mixed_corner_obj)
+        obj:dict = read_obj(src)
+        fname:str = str(tmp_path / 'out.obj')
+        write_obj(fname, obj)
+        assert_objs_equal(obj, read_obj(fname))